@@ -3,7 +3,7 @@ from datetime import timedelta
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -56,6 +56,8 @@ REST_FRAMEWORK = {
 MIDDLEWARE = [
     
     'django.middleware.security.SecurityMiddleware',
+    # Готовые страницы для анонимных GET — до сессий и middleware с запросами к БД
+    'main.page_cache.PageCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -194,3 +196,28 @@ EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 # DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL')
 # FRONTEND_URL = config('FRONTEND_URL')
 
+
+# Снимок каталога в памяти каждого воркера (apps/products/snapshot.py).
+# Требует триггеров fn_notify_catalog_change из dbSNDshop.sql (РАЗДЕЛ 7).
+CATALOG_SNAPSHOT_ENABLED = False
+
+# Версия статики; смена при выкладке сбрасывает кэш страниц (main/page_cache.py)
+STATIC_VERSION = config('STATIC_VERSION', default='1')
+
+# Платёжный шлюз (apps/orders/gateway.py): mock — платежи без обращения к ЮKassa,
+# yookassa — запросы на YOOKASSA_API_URL (sandbox, боевой API или локальная
+# заглушка из команды run_gateway_stub)
+PAYMENT_GATEWAY_MODE = config('PAYMENT_GATEWAY_MODE', default='mock')
+YOOKASSA_API_URL = config('YOOKASSA_API_URL', default='https://sandbox.yookassa.ru/api/v3')
+YOOKASSA_ACCOUNT_ID = config('YOOKASSA_ACCOUNT_ID', default='199347')
+YOOKASSA_SECRET_KEY = config('YOOKASSA_SECRET_KEY', default='test_MsLMuEqoKWDEu9o7LLVIQ_k2vRr0Yq1yqr-QBDfMXJk')
+PAYMENT_RETURN_URL = config('PAYMENT_RETURN_URL', default='http://localhost:8000/decoration-success/')
+# Размер пула keep-alive соединений к шлюзу на процесс
+PAYMENT_GATEWAY_POOL_SIZE = config('PAYMENT_GATEWAY_POOL_SIZE', default=10, cast=int)
+# Адреса, с которых ЮKassa отправляет уведомления (POST /api/payment/webhook/).
+# Для локальной заглушки шлюза добавьте 127.0.0.1
+YOOKASSA_WEBHOOK_IPS = config(
+    'YOOKASSA_WEBHOOK_IPS',
+    default='185.71.76.0/27,185.71.77.0/27,77.75.153.0/25,77.75.156.11,77.75.156.35,77.75.154.128/25,2a02:5180::/32',
+    cast=Csv(),
+)
@@ -0,0 +1,170 @@
+"""
+Идемпотентность оформления заказа и создания платежа (заголовок Idempotency-Key).
+
+Клиент отправляет повтор запроса с тем же ключом, если не дождался ответа.
+Первый запрос выполняется как обычно, успешный ответ сохраняется в таблице
+idempotency_keys (РАЗДЕЛ 14 dbSNDshop.sql), повтор получает сохранённый
+ответ без блокировок остатков и вставок. Параллельный дубль ждёт на
+advisory-блокировке по ключу, пока первый запрос не закончит, и тоже
+получает сохранённый ответ.
+
+Сохраняются только ответы 2xx: ошибочный запрос откатывается целиком
+и повтор выполняется заново. В отпечаток запроса входит его владелец
+(покупатель из JWT, для анонимных — адрес клиента): чужой запрос с тем же
+ключом получает 422, а не сохранённый ответ другого покупателя.
+"""
+import hashlib
+import json
+import logging
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 64
+# Сколько хранить ответ; повтор позже выполняется как новый запрос
+KEY_TTL = timedelta(hours=24)
+# Сколько дубль ждёт завершения первого запроса
+LOCK_WAIT_SECONDS = 10
+LOCK_POLL_SECONDS = 0.05
+
+SELECT_SQL = """
+    SELECT request_hash, status_code, response_body
+    FROM idempotency_keys
+    WHERE scope = %s AND idem_key = %s AND created_at > CURRENT_TIMESTAMP - %s
+"""
+
+UPSERT_SQL = """
+    INSERT INTO idempotency_keys (scope, idem_key, request_hash, status_code, response_body, created_at)
+    VALUES (%s, %s, %s, %s, %s::jsonb, CURRENT_TIMESTAMP)
+    ON CONFLICT (scope, idem_key) DO UPDATE SET
+        request_hash = EXCLUDED.request_hash,
+        status_code = EXCLUDED.status_code,
+        response_body = EXCLUDED.response_body,
+        created_at = EXCLUDED.created_at
+"""
+
+
+def request_hash(data, owner=''):
+    """Отпечаток владельца и тела запроса: тот же ключ с другими данными — ошибка клиента"""
+    payload = json.dumps([owner, data], sort_keys=True, cls=DjangoJSONEncoder, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def request_owner(request):
+    """'customer:<id>' для авторизованного покупателя, иначе 'ip:<адрес клиента>'"""
+    from apps.users.decorators import get_user_from_request
+    try:
+        user, customer = get_user_from_request(request)
+    except Exception:
+        customer = None
+    if customer is not None:
+        return f'customer:{customer.customer_id}'
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def lock_name(scope, key):
+    return f'idempotency:{scope}:{key}'
+
+
+class IdempotencyService:
+    """Сохранённые ответы по ключам идемпотентности"""
+
+    @staticmethod
+    def acquire(cursor, scope, key, wait=None):
+        """Сессионная advisory-блокировка ключа; False — не дождались за wait (LOCK_WAIT_SECONDS) секунд"""
+        deadline = time.monotonic() + (LOCK_WAIT_SECONDS if wait is None else wait)
+        while True:
+            cursor.execute('SELECT pg_try_advisory_lock(hashtext(%s))', [lock_name(scope, key)])
+            if cursor.fetchone()[0]:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(LOCK_POLL_SECONDS)
+
+    @staticmethod
+    def release(cursor, scope, key):
+        cursor.execute('SELECT pg_advisory_unlock(hashtext(%s))', [lock_name(scope, key)])
+
+    @staticmethod
+    def lookup(cursor, scope, key):
+        """(request_hash, status_code, body) или None"""
+        cursor.execute(SELECT_SQL, [scope, key, KEY_TTL])
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        body = row[2]
+        if isinstance(body, str):
+            body = json.loads(body)
+        return row[0], row[1], body
+
+    @staticmethod
+    def store(cursor, scope, key, fingerprint, response):
+        cursor.execute(UPSERT_SQL, [
+            scope, key, fingerprint, response.status_code,
+            json.dumps(response.data, cls=DjangoJSONEncoder, ensure_ascii=False),
+        ])
+
+    @staticmethod
+    def purge(ttl=KEY_TTL):
+        """Удалить просроченные ключи; количество удалённых"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM idempotency_keys WHERE created_at <= CURRENT_TIMESTAMP - %s', [ttl]
+            )
+            return cursor.rowcount
+
+
+def idempotent(scope):
+    """
+    Декоратор DRF-представления: повтор с тем же Idempotency-Key получает сохранённый ответ.
+    Ставится под @api_view / @permission_classes. Без заголовка запрос выполняется как раньше.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = request.headers.get(HEADER, '').strip()
+            if not key:
+                return view(request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response({
+                    'success': False,
+                    'error': f'{HEADER} длиннее {MAX_KEY_LENGTH} символов'
+                }, status=400)
+
+            fingerprint = request_hash(request.data, request_owner(request))
+            with connection.cursor() as cursor:
+                if not IdempotencyService.acquire(cursor, scope, key):
+                    return Response({
+                        'success': False,
+                        'error': 'Запрос с этим ключом ещё выполняется. Повторите позже.'
+                    }, status=409)
+                try:
+                    stored = IdempotencyService.lookup(cursor, scope, key)
+                    if stored is not None:
+                        stored_hash, status_code, body = stored
+                        if stored_hash != fingerprint:
+                            return Response({
+                                'success': False,
+                                'error': f'{HEADER} уже использован с другими данными запроса'
+                            }, status=422)
+                        logger.info(f"Повтор {scope} по ключу {key}: отдан сохранённый ответ")
+                        response = Response(body, status=status_code)
+                        response['Idempotent-Replayed'] = 'true'
+                        return response
+
+                    response = view(request, *args, **kwargs)
+                    if 200 <= response.status_code < 300:
+                        IdempotencyService.store(cursor, scope, key, fingerprint, response)
+                    return response
+                finally:
+                    IdempotencyService.release(cursor, scope, key)
+
+        return wrapper
+    return decorator
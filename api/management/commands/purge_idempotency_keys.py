@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.idempotency import IdempotencyService
+
+
+class Command(BaseCommand):
+    help = 'Удалить ключи идемпотентности старше суток (таблица idempotency_keys)'
+
+    def handle(self, *args, **options):
+        deleted = IdempotencyService.purge()
+        self.stdout.write(self.style.SUCCESS(f'Ключи идемпотентности: удалено {deleted}'))
@@ -18,6 +18,7 @@ class OrderDebugger:
         """
         Проверяет, не было ли создано двойных заказов для клиента
         Смотрит заказы, созданные за последние N минут
+        (повторы с заголовком Idempotency-Key дублей не создают — api/idempotency.py)
         
         Args:
             customer_id: ID клиента
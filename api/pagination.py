@@ -0,0 +1,39 @@
+# api/pagination.py
+from rest_framework.pagination import CursorPagination
+
+from apps.products.filters import get_ordering
+
+
+class ProductCursorPagination(CursorPagination):
+    """
+    Keyset-пагинация списка товаров по (product_id).
+
+    Курсор кодирует последний отданный product_id, поэтому следующая страница
+    выбирается запросом WHERE product_id > X ORDER BY product_id LIMIT N
+    по первичному ключу — без OFFSET, и стоимость глубоких страниц не растёт
+    вместе с каталогом.
+
+    При ?sort= курсор строится по первому полю сортировки (например, price),
+    а повторы значений DRF разрешает коротким смещением внутри одного значения.
+
+    Пагинация включается только если клиент передал ?cursor= или ?page_size=.
+    Без них /api/products/ по-прежнему возвращает простой массив, на который
+    рассчитаны админ-панель, корзина и сравнение товаров.
+    """
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('product_id',)
+    cursor_query_param = 'cursor'
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def get_ordering(self, request, queryset, view):
+        return get_ordering(request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        return super().paginate_queryset(queryset, request, view)
@@ -1,7 +1,7 @@
 """
 Сервис для работы с SQL Views, Triggers и Stored Procedures
 """
-from django.db import connection
+from django.db import connection, transaction
 from typing import List, Dict, Any
 import logging
 
@@ -104,7 +104,10 @@ class SQLViewsService:
     @staticmethod
     def get_product_ratings() -> List[Dict[str, Any]]:
         """
-        Получить рейтинги продуктов из VIEW vw_product_ratings
+        Получить рейтинги продуктов (те же колонки, что у VIEW vw_product_ratings)
+        
+        Читает предрассчитанные агрегаты одобренных отзывов (approved_*) из
+        product_rating_stats, поэтому стоимость запроса не зависит от числа отзывов.
         
         Returns:
             Список словарей с рейтингами продуктов
@@ -113,20 +116,23 @@ class SQLViewsService:
             with connection.cursor() as cursor:
                 cursor.execute("""
                     SELECT 
-                        product_id,
-                        product_name,
-                        category_name,
-                        brand_name,
-                        review_count,
-                        avg_rating,
-                        five_star_count,
-                        four_star_count,
-                        three_star_count,
-                        two_star_count,
-                        one_star_count,
-                        last_review_date
-                    FROM vw_product_ratings
-                    WHERE review_count > 0
+                        p.product_id,
+                        p.product_name,
+                        c.category_name,
+                        b.brand_name,
+                        s.approved_count AS review_count,
+                        ROUND(s.approved_sum::NUMERIC / s.approved_count, 2) AS avg_rating,
+                        s.approved_stars_5 AS five_star_count,
+                        s.approved_stars_4 AS four_star_count,
+                        s.approved_stars_3 AS three_star_count,
+                        s.approved_stars_2 AS two_star_count,
+                        s.approved_stars_1 AS one_star_count,
+                        s.approved_last_review_date AS last_review_date
+                    FROM product_rating_stats s
+                    JOIN products p ON p.product_id = s.product_id
+                    LEFT JOIN categories c ON p.category_id = c.category_id
+                    LEFT JOIN brands b ON p.brand_id = b.brand_id
+                    WHERE s.approved_count > 0
                     ORDER BY avg_rating DESC, review_count DESC
                 """)
                 columns = [col[0] for col in cursor.description]
@@ -136,6 +142,66 @@ class SQLViewsService:
             return []
 
 
+class RatingStatsService:
+    """Сервис для денормализованных агрегатов отзывов (таблица product_rating_stats)"""
+
+    @staticmethod
+    def rebuild() -> Dict[str, Any]:
+        """
+        Полностью пересобрать product_rating_stats из таблицы reviews
+        
+        Выполняется одной транзакцией: пока идёт пересборка, триггер
+        trg_update_product_rating_stats ждёт блокировку таблицы, поэтому
+        параллельные изменения отзывов не теряются.
+        
+        Returns:
+            Количество товаров с отзывами и общее число учтённых отзывов
+        """
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("LOCK TABLE product_rating_stats IN EXCLUSIVE MODE")
+                cursor.execute("DELETE FROM product_rating_stats")
+                cursor.execute("""
+                    INSERT INTO product_rating_stats (
+                        product_id, review_count, rating_sum,
+                        stars_1, stars_2, stars_3, stars_4, stars_5,
+                        last_review_date,
+                        approved_count, approved_sum,
+                        approved_stars_1, approved_stars_2, approved_stars_3, approved_stars_4, approved_stars_5,
+                        approved_last_review_date, updated_at
+                    )
+                    SELECT
+                        r.product_id,
+                        COUNT(*),
+                        SUM(r.rating),
+                        COUNT(*) FILTER (WHERE r.rating = 1),
+                        COUNT(*) FILTER (WHERE r.rating = 2),
+                        COUNT(*) FILTER (WHERE r.rating = 3),
+                        COUNT(*) FILTER (WHERE r.rating = 4),
+                        COUNT(*) FILTER (WHERE r.rating = 5),
+                        MAX(r.publication_date),
+                        COUNT(*) FILTER (WHERE r.status = 'approved'),
+                        COALESCE(SUM(r.rating) FILTER (WHERE r.status = 'approved'), 0),
+                        COUNT(*) FILTER (WHERE r.status = 'approved' AND r.rating = 1),
+                        COUNT(*) FILTER (WHERE r.status = 'approved' AND r.rating = 2),
+                        COUNT(*) FILTER (WHERE r.status = 'approved' AND r.rating = 3),
+                        COUNT(*) FILTER (WHERE r.status = 'approved' AND r.rating = 4),
+                        COUNT(*) FILTER (WHERE r.status = 'approved' AND r.rating = 5),
+                        MAX(r.publication_date) FILTER (WHERE r.status = 'approved'),
+                        CURRENT_TIMESTAMP
+                    FROM reviews r
+                    WHERE r.product_id IS NOT NULL
+                      AND r.status IS DISTINCT FROM 'rejected'
+                    GROUP BY r.product_id
+                """)
+                products_count = cursor.rowcount
+                cursor.execute("SELECT COALESCE(SUM(review_count), 0) FROM product_rating_stats")
+                reviews_count = cursor.fetchone()[0]
+
+        logger.info(f"product_rating_stats rebuilt: {products_count} products, {reviews_count} reviews")
+        return {'products': products_count, 'reviews': reviews_count}
+
+
 class SQLProceduresService:
     """Сервис для работы с хранимыми процедурами (Stored Procedures)"""
     
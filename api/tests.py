@@ -1,3 +1,114 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from api.idempotency import idempotent, request_owner
+
+
+class FakeKeyStore:
+    "Курсор с таблицей idempotency_keys и advisory-блокировками в памяти"
+
+    def __init__(self, locked=False):
+        self.rows = {}
+        self.locked = locked
+        self.unlocks = 0
+        self._result = None
+
+    def execute(self, sql, params=None):
+        if 'pg_try_advisory_lock' in sql:
+            self._result = (not self.locked,)
+        elif 'pg_advisory_unlock' in sql:
+            self.unlocks += 1
+            self._result = (True,)
+        elif sql.lstrip().startswith('SELECT request_hash'):
+            self._result = self.rows.get((params[0], params[1]))
+        elif 'INSERT INTO idempotency_keys' in sql:
+            scope, key, fingerprint, status_code, body = params
+            self.rows[(scope, key)] = (fingerprint, status_code, body)
+
+    def fetchone(self):
+        return self._result
+
+
+class IdempotencyTest(SimpleTestCase):
+    "Повтор create_order/create_payment с тем же Idempotency-Key не выполняет работу второй раз"
+
+    def setUp(self):
+        self.calls = []
+        self.factory = APIRequestFactory()
+
+        @api_view(['POST'])
+        @permission_classes([AllowAny])
+        @idempotent('create_order')
+        def view(request):
+            self.calls.append(request.data)
+            if request.data.get('fail'):
+                return Response({'success': False}, status=400)
+            return Response({'success': True, 'order_id': len(self.calls)}, status=201)
+
+        self.view = view
+
+    def _post(self, store, data, key='k-1', ip='10.0.0.1'):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key, 'REMOTE_ADDR': ip} if key else {'REMOTE_ADDR': ip}
+        request = self.factory.post('/api/orders/create/', data, format='json', **headers)
+        with mock.patch('api.idempotency.connection') as conn, \
+                mock.patch('api.idempotency.LOCK_WAIT_SECONDS', 0):
+            conn.cursor.return_value.__enter__.return_value = store
+            return self.view(request)
+
+    def test_retry_replays_stored_response(self):
+        store = FakeKeyStore()
+        first = self._post(store, {'items': [1]})
+        retry = self._post(store, {'items': [1]})
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual((retry.status_code, retry.data), (201, {'success': True, 'order_id': 1}))
+        self.assertEqual(first.data, retry.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(store.unlocks, 2)
+
+    def test_same_key_with_other_payload_is_rejected(self):
+        store = FakeKeyStore()
+        self._post(store, {'items': [1]})
+        response = self._post(store, {'items': [2]})
+
+        self.assertEqual((response.status_code, len(self.calls)), (422, 1))
+
+    def test_same_key_from_other_client_does_not_replay(self):
+        store = FakeKeyStore()
+        self._post(store, {'items': [1]})
+        response = self._post(store, {'items': [1]}, ip='10.0.0.2')
+
+        self.assertEqual((response.status_code, len(self.calls)), (422, 1))
+        self.assertNotIn('order_id', response.data)
+
+    def test_owner_is_customer_or_client_address(self):
+        request = self.factory.post('/api/orders/create/', {}, format='json', REMOTE_ADDR='10.0.0.3')
+        self.assertEqual(request_owner(request), 'ip:10.0.0.3')
+
+        customer = mock.Mock(customer_id=42)
+        with mock.patch('apps.users.decorators.get_user_from_request', return_value=(mock.Mock(), customer)):
+            self.assertEqual(request_owner(request), 'customer:42')
+
+    def test_errors_are_not_stored(self):
+        store = FakeKeyStore()
+        self._post(store, {'fail': True})
+        self._post(store, {'fail': True})
+
+        self.assertEqual((len(self.calls), store.rows), (2, {}))
+
+    def test_concurrent_duplicate_waits_then_gives_up(self):
+        response = self._post(FakeKeyStore(locked=True), {'items': [1]})
+
+        self.assertEqual((response.status_code, self.calls), (409, []))
+
+    def test_requests_without_key_are_unchanged(self):
+        store = FakeKeyStore()
+        self._post(store, {'items': [1]}, key=None)
+        self._post(store, {'items': [1]}, key=None)
+
+        self.assertEqual((len(self.calls), store.rows), (2, {}))
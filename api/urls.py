@@ -93,7 +93,14 @@ urlpatterns = [
     # === PAYMENT PROCESSING ===
     path('payment/create/', views.create_payment, name='create_payment'),
     path('payment/status/', views.check_payment_status, name='check_payment_status'),
+    path('payment/webhook/', views.payment_webhook, name='payment_webhook'),
     
+    # === CART (корзина текущего покупателя) ===
+    path('cart/', views.cart_detail, name='cart_detail'),
+    path('cart/items/', views.cart_items, name='cart_items'),
+    path('cart/items/<int:product_id>/', views.cart_item_detail, name='cart_item_detail'),
+    path('cart/merge/', views.cart_merge, name='cart_merge'),
+
     # === ORDERS (specific paths before router) ===
     path('orders/create/', views.create_order, name='create_order'),
     path('orders/<int:order_id>/receipt/', views.order_receipt, name='order_receipt'),
@@ -5,12 +5,25 @@ from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from api.permissions import IsAdmin, IsAdminOrEmployee
+from api.idempotency import idempotent
+from api.pagination import ProductCursorPagination
+from apps.products.conditional import list_validators, not_modified, product_validators, set_validators
+from apps.products.facets import get_facets
+from apps.products.batch import MAX_BATCH_IDS, batch_products
+from apps.products.categories import get_tree as get_category_tree
+from apps.products.compare import MAX_COMPARE_IDS, get_comparison
+from apps.products.filters import filter_products, parse_ids
+from apps.products.bulk_update import ProductBulkUpdateService
+from apps.products.importer import ProductImportService
+from apps.products.search import normalize_query, search_products, autocomplete_products
+from apps.products.signals import products_bulk_changed
+from apps.products.snapshot import SnapshotRows, get_snapshot
+from apps.promotions.pricing import PriceResolver, get_price_resolver, order_items_total
 import random
 import string
 from datetime import datetime
 from django.utils import timezone
-from django.db import transaction
-from django.db.models import F
+from django.db import IntegrityError, transaction
 
 # Products
 from apps.products.models import (
@@ -26,6 +39,11 @@ class CategoryViewSet(viewsets.ModelViewSet):
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
 
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        """Всё дерево категорий одним запросом (кэшируется до изменения категорий)"""
+        return Response(get_category_tree())
+
 class BrandViewSet(viewsets.ModelViewSet):
     queryset = Brands.objects.all()
     serializer_class = BrandSerializer
@@ -37,15 +55,202 @@ class SupplierViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticatedOrReadOnly]
 
 class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Products.objects.all()
+    queryset = ProductSerializer.setup_eager_loading(Products.objects.all()).order_by('product_id')
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
+
+    def get_queryset(self):
+        """Фильтры и сортировка списка: ?q=&category=&brand=&min_price=&max_price=&in_stock=&status=&sort="""
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = filter_products(queryset, self.request.query_params)
+        elif self.action == 'search':
+            # q обрабатывает сам поиск (с ранжированием и нечётким запасным вариантом)
+            params = self.request.query_params.copy()
+            params.pop('q', None)
+            queryset = filter_products(queryset, params)
+        return queryset
 
     def get_permissions(self):
         """Для создания и изменения товаров требуется роль admin или employee"""
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in ['create', 'update', 'partial_update', 'destroy', 'snapshot_stats', 'import_products', 'bulk_update']:
             return [IsAdminOrEmployee()]
+        if self.action == 'batch':
+            # POST здесь только читает — длинный список id не помещается в URL
+            return [AllowAny()]
         return [IsAuthenticatedOrReadOnly()]
 
+    def list(self, request, *args, **kwargs):
+        """Список со слабым ETag: повторная загрузка без изменений -> 304 без тела"""
+        snapshot = get_snapshot()
+        rows = snapshot.list(request.query_params) if snapshot is not None else None
+        if rows is not None:
+            # Ответ из снимка каталога в памяти воркера, без запросов к БД (акции — тоже из снимка)
+            etag, last_modified = snapshot.validators(request.query_params)
+            response = not_modified(request, etag, None)
+            if response is not None:
+                return response
+            resolver = PriceResolver(fetch=snapshot.active_promotions)
+            # ?cursor= / ?page_size= — та же keyset-пагинация по строкам снимка
+            page = self.paginate_queryset(SnapshotRows(rows))
+            data = resolver.apply([dict(row.payload) for row in (page if page is not None else rows)])
+            response = self.get_paginated_response(data) if page is not None else Response(data)
+            return set_validators(response, etag, last_modified)
+
+        etag, last_modified = list_validators(request.query_params)
+        # Last-Modified общий для всего каталога, выборку различает только ETag
+        response = not_modified(request, etag, None)
+        if response is not None:
+            return response
+        response = super().list(request, *args, **kwargs)
+        self._with_prices(response.data['results'] if isinstance(response.data, dict) else response.data)
+        return set_validators(response, etag, last_modified)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Карточка товара с ETag из row_version; If-None-Match -> 304 без сериализации"""
+        etag, last_modified = product_validators(self.get_queryset(), kwargs.get(self.lookup_field))
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+        response = super().retrieve(request, *args, **kwargs)
+        self._with_prices([response.data])
+        return set_validators(response, etag, last_modified)
+
+    def _with_prices(self, items):
+        """effective_price, discount и promotion по акциям на сегодня — один запрос на ответ"""
+        return get_price_resolver(self.request).apply(items)
+
+    def _get_limit(self, default, maximum):
+        try:
+            return max(1, min(int(self.request.query_params.get('limit', default)), maximum))
+        except (ValueError, TypeError):
+            return default
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        GET /api/products/search/?q=&limit=
+        Ранжированный полнотекстовый поиск; если совпадений нет — нечёткий поиск по названию.
+        Принимает те же фильтры, что и список товаров.
+        """
+        q = normalize_query(request.query_params.get('q'))
+        if not q:
+            return Response({'error': 'Укажите поисковый запрос q'}, status=400)
+
+        mode, products = search_products(self.get_queryset(), q, self._get_limit(20, 50))
+        serializer = self.get_serializer(products, many=True)
+        return Response({
+            'query': q,
+            'mode': mode,
+            'count': len(products),
+            'results': self._with_prices(serializer.data)
+        })
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """
+        GET /api/products/facets/?template=&brand=&min_price=&specs.ram=16GB...
+        Количество товаров по брендам, категориям, ценам, наличию и спецификациям
+        для текущего набора фильтров (кэшируется по набору параметров).
+        """
+        return Response(get_facets(Products.objects.all(), request.query_params))
+
+    @action(detail=False, methods=['get'], url_path='snapshot-stats')
+    def snapshot_stats(self, request):
+        """GET /api/products/snapshot-stats/ — попадания, промахи и отставание снимка каталога"""
+        snapshot = get_snapshot()
+        if snapshot is None:
+            return Response({'enabled': False})
+        return Response({'enabled': True, **snapshot.stats()})
+
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """GET /api/products/autocomplete/?q=  — подсказки по началу слов"""
+        q = normalize_query(request.query_params.get('q'))
+        if not q:
+            return Response([])
+        return Response(autocomplete_products(Products.objects.all(), q, self._get_limit(10, 20)))
+
+    @action(detail=False, methods=['get', 'post'])
+    def batch(self, request):
+        """
+        GET /api/products/batch/?ids=1,2,3  или  POST {"ids": [1, 2, 3]}
+        Облегчённые карточки товаров корзины в порядке ids
+        """
+        if request.method == 'POST':
+            ids = request.data.get('ids') if isinstance(request.data, dict) else request.data
+        else:
+            ids = request.query_params.get('ids')
+        return Response(batch_products(parse_ids(ids, MAX_BATCH_IDS), get_price_resolver(request)))
+
+    @action(detail=False, methods=['get'])
+    def compare(self, request):
+        """
+        GET /api/products/compare/?ids=1,2,3
+        Матрица характеристик по шаблонам категорий с пометкой отличий; ETag из версий товаров
+        """
+        ids = parse_ids(request.query_params.get('ids'), MAX_COMPARE_IDS)
+        if not ids:
+            return Response({'error': 'Не переданы ids'}, status=400)
+        data, etag = get_comparison(ids)
+        response = not_modified(request, etag, None)
+        if response is not None:
+            return response
+        get_price_resolver(request).apply(data['products'])
+        return set_validators(Response(data), etag, None)
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_products(self, request):
+        """
+        POST /api/products/import/  (multipart: file=.csv|.xlsx, dry_run=1)
+        Массовое создание и обновление товаров по sku
+        """
+        uploaded = request.FILES.get('file')
+        if not uploaded:
+            return Response({'error': 'Не передан файл (поле file)'}, status=400)
+        dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+
+        from apps.users.decorators import get_user_from_request
+        user, customer = get_user_from_request(request)
+        try:
+            result = ProductImportService.import_file(
+                uploaded.file, uploaded.name,
+                user_id=customer.customer_id if customer else None,
+                dry_run=dry_run,
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        except IntegrityError as e:
+            # Строки с неизвестными ссылками отсеиваются до вставки; сюда попадают прочие нарушения ограничений
+            return Response({'error': f'Импорт отменён: нарушено ограничение БД ({e.__cause__ or e})'}, status=400)
+        return Response(result)
+
+    @action(detail=False, methods=['post'], url_path='bulk-update')
+    def bulk_update(self, request):
+        """
+        POST /api/products/bulk-update/
+        {"items": [{"sku": "A-1", "price": "1990.00", "stock_quantity": 5, "row_version": 3}, ...],
+         "all_or_nothing": false}
+        Тело может быть и просто списком строк. Ответ — статус по каждой строке.
+        """
+        payload = request.data
+        all_or_nothing = False
+        if isinstance(payload, dict):
+            all_or_nothing = str(payload.get('all_or_nothing', '')).lower() in ('1', 'true', 'yes')
+            payload = payload.get('items')
+
+        from apps.users.decorators import get_user_from_request
+        user, customer = get_user_from_request(request)
+        try:
+            result = ProductBulkUpdateService.apply(
+                payload,
+                user_id=customer.customer_id if customer else None,
+                all_or_nothing=all_or_nothing,
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        return Response(result, status=200 if result['applied'] else 409)
+
     def _log_product_change(self, customer, action, product, old_data=None, new_data=None):
         """Логирование изменений товара"""
         try:
@@ -280,16 +485,107 @@ class AddressViewSet(viewsets.ModelViewSet):
 from apps.cart.models import Carts, CartItems, Wishlists
 from apps.cart.serializers import CartSerializer, CartItemSerializer, WishlistSerializer
 
+from apps.cart.services import DELIVERY_COST, CartError, CartService
+from apps.orders.checkout import CheckoutError, create_order_items, take_stock
+from apps.orders.reservations import StockReservationService
+
+
+def _cart_customer(request):
+    """Покупатель из JWT; корзина доступна только своему владельцу"""
+    from apps.users.decorators import get_user_from_request
+    user, customer = get_user_from_request(request)
+    return customer
+
+
 class CartViewSet(viewsets.ModelViewSet):
     queryset = Carts.objects.all()
     serializer_class = CartSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        customer = _cart_customer(self.request)
+        if customer is None:
+            return Carts.objects.none()
+        return Carts.objects.filter(customer=customer)
+
 class CartItemViewSet(viewsets.ModelViewSet):
     queryset = CartItems.objects.all()
     serializer_class = CartItemSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        customer = _cart_customer(self.request)
+        if customer is None:
+            return CartItems.objects.none()
+        return CartItems.objects.filter(cart__customer=customer)
+
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([AllowAny])
+def cart_detail(request):
+    """
+    GET /api/cart/     — корзина текущего покупателя: строки, цены, остатки и итоги
+    DELETE /api/cart/  — очистить корзину
+    """
+    customer = _cart_customer(request)
+    if customer is None:
+        return Response({'error': 'Требуется авторизация'}, status=401)
+    if request.method == 'DELETE':
+        CartService.clear(customer.customer_id)
+    return Response(CartService.get_cart(customer.customer_id, get_price_resolver(request)))
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def cart_items(request):
+    """POST /api/cart/items/ {"product_id": 1, "quantity": 2} — добавить товар"""
+    customer = _cart_customer(request)
+    if customer is None:
+        return Response({'error': 'Требуется авторизация'}, status=401)
+    try:
+        with transaction.atomic():
+            CartService.add_item(customer.customer_id, request.data.get('product_id'), request.data.get('quantity', 1))
+    except CartError as e:
+        return Response({'error': str(e)}, status=400)
+    return Response(CartService.get_cart(customer.customer_id, get_price_resolver(request)), status=201)
+
+
+@api_view(['PATCH', 'PUT', 'DELETE'])
+@permission_classes([AllowAny])
+def cart_item_detail(request, product_id):
+    """
+    PATCH /api/cart/items/<product_id>/ {"quantity": 3} — изменить количество (0 — удалить)
+    DELETE /api/cart/items/<product_id>/                  — удалить товар
+    """
+    customer = _cart_customer(request)
+    if customer is None:
+        return Response({'error': 'Требуется авторизация'}, status=401)
+    try:
+        if request.method == 'DELETE':
+            CartService.remove_item(customer.customer_id, product_id)
+        else:
+            with transaction.atomic():
+                CartService.set_quantity(customer.customer_id, product_id, request.data.get('quantity'))
+    except CartError as e:
+        return Response({'error': str(e)}, status=400)
+    return Response(CartService.get_cart(customer.customer_id, get_price_resolver(request)))
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def cart_merge(request):
+    """POST /api/cart/merge/ {"items": [{"product_id": 1, "quantity": 2}]} — перенести гостевую корзину после входа"""
+    customer = _cart_customer(request)
+    if customer is None:
+        return Response({'error': 'Требуется авторизация'}, status=401)
+    items = request.data.get('items') if isinstance(request.data, dict) else request.data
+    try:
+        with transaction.atomic():
+            CartService.merge(customer.customer_id, items)
+    except CartError as e:
+        return Response({'error': str(e)}, status=400)
+    return Response(CartService.get_cart(customer.customer_id, get_price_resolver(request)))
+
 class WishlistViewSet(viewsets.ModelViewSet):
     queryset = Wishlists.objects.all()
     serializer_class = WishlistSerializer
@@ -949,33 +1245,32 @@ from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 import random
 import string
-import uuid
 import os
 
-# YooKassa credentials для SANDBOX (для тестирования)
-# Для production замените на реальные учетные данные
-YOOKASSA_ACCOUNT_ID = '199347'  # Тестовый shop ID для sandbox
-YOOKASSA_SECRET_KEY = 'test_MsLMuEqoKWDEu9o7LLVIQ_k2vRr0Yq1yqr-QBDfMXJk'  # Тестовый ключ для sandbox
-
-# API endpoints
-YOOKASSA_SANDBOX_URL = 'https://sandbox.yookassa.ru/api/v3'
-YOOKASSA_PRODUCTION_URL = 'https://payment.yookassa.ru/api/v3'
-
-# Используем sandbox по умолчанию, но в режиме MOCK для тестирования без интернета
-YOOKASSA_API_URL = YOOKASSA_SANDBOX_URL
-USE_MOCK_PAYMENTS = True  # Установите False для реальных платежей с интернетом
+# Платёжный шлюз: режим и учётные данные ЮKassa — в settings (PAYMENT_GATEWAY_MODE, YOOKASSA_*),
+# пул соединений, повторы и CircuitBreaker — apps/orders/gateway.py
+from apps.orders.gateway import GatewayError, get_gateway
+from apps.orders.payment_events import PaymentEventService, is_trusted_source, parse_amount, parse_notification
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@idempotent('create_payment')
 def create_payment(request):
     """
     Create payment in YooKassa and return payment form
+    Товары корзины резервируются на время оплаты; reservation_key передаётся в create_order
     """
+    reservation = None
     try:
         data = request.data
         
         # Calculate total with delivery
-        items_total = float(data.get('total', 0))
+        # Сумма товаров считается по ценам с акциями; total от клиента — только если строк нет
+        items = data.get('items')
+        if isinstance(items, list) and items:
+            items_total = float(order_items_total(items, get_price_resolver(request)))
+        else:
+            items_total = float(data.get('total', 0))
         delivery_cost = 349 if data.get('delivery_type') == 'courier' else 0
         total_amount = items_total + delivery_cost
         
@@ -985,80 +1280,69 @@ def create_payment(request):
                 'success': False,
                 'error': 'Сумма платежа должна быть больше нуля'
             }, status=400)
+
+        # Резерв остатков до создания заказа (apps/orders/reservations.py) — только для авторизованных:
+        # анонимный запрос мог бы без ограничений замораживать остатки
+        try:
+            customer = _cart_customer(request)
+        except Exception:
+            customer = None
+        if isinstance(items, list) and items and customer is not None:
+            try:
+                reservation = StockReservationService.reserve(items, customer.customer_id)
+            except CheckoutError as checkout_error:
+                response_data = {'success': False, 'error': checkout_error.message}
+                if checkout_error.details:
+                    response_data['details'] = checkout_error.details
+                return Response(response_data, status=400)
+        reservation_data = {
+            'reservation_key': reservation['reservation_key'],
+            'reserved_until': reservation['expires_at'].isoformat(),
+        } if reservation else {}
         
-        if USE_MOCK_PAYMENTS:
-            # MOCK режим - симулируем платеж для тестирования
-            payment_id = f"mock_{uuid.uuid4().hex[:12]}"
-            confirmation_url = f"http://localhost:8000/decoration-success/?payment_id={payment_id}&mock=true"
-            
-            print(f"[MOCK] Created mock payment: {payment_id}")
-            print(f"[MOCK] Confirmation URL: {confirmation_url}")
-            
-            return Response({
-                'success': True,
-                'payment_id': payment_id,
-                'confirmation_url': confirmation_url,
-                'message': 'Переходим на страницу оплаты (ТЕСТОВЫЙ РЕЖИМ)'
-            }, status=201)
-        else:
-            # РЕАЛЬНЫЙ режим - отправляем запрос на YooKassa
-            payment_data = {
-                "amount": {
-                    "value": f"{total_amount:.2f}",
-                    "currency": "RUB"
-                },
-                "confirmation": {
-                    "type": "redirect",
-                    "return_url": "http://localhost:8000/decoration-success/"
-                },
-                "capture": True,
-                "description": f"Заказ от {data.get('first_name')} {data.get('last_name')}",
-                "metadata": {
-                    "phone": data.get('phone'),
-                    "email": data.get('email'),
-                    "delivery_type": data.get('delivery_type')
-                }
-            }
-            
-            # Create payment using requests directly
-            import requests
-            from requests.auth import HTTPBasicAuth
-            
-            print(f"Creating real payment with credentials: {YOOKASSA_ACCOUNT_ID}")
-            print(f"Payload: {payment_data}")
-            
-            response = requests.post(
-                f'{YOOKASSA_API_URL}/payments',
-                json=payment_data,
-                auth=HTTPBasicAuth(YOOKASSA_ACCOUNT_ID, YOOKASSA_SECRET_KEY),
-                headers={
-                    'Idempotency-Key': str(uuid.uuid4()),
-                    'Content-Type': 'application/json'
+        gateway = get_gateway()
+        try:
+            payment = gateway.create_payment(
+                total_amount,
+                description=f"Заказ от {data.get('first_name')} {data.get('last_name')}",
+                metadata={
+                    'phone': data.get('phone'),
+                    'email': data.get('email'),
+                    'delivery_type': data.get('delivery_type'),
                 },
-                timeout=10
+                # Повтор запроса клиента с тем же ключом не создаёт второй платёж в шлюзе
+                idempotence_key=request.headers.get('Idempotency-Key') or None,
             )
-            
-            print(f"Response status: {response.status_code}")
-            print(f"Response body: {response.text}")
-            
-            if response.status_code in [200, 201]:
-                result = response.json()
-                return Response({
-                    'success': True,
-                    'payment_id': result['id'],
-                    'confirmation_url': result['confirmation']['confirmation_url'],
-                    'message': 'Переходим на страницу оплаты'
-                }, status=201)
-            else:
-                return Response({
-                    'success': False,
-                    'error': f'YooKassa error: {response.text}'
-                }, status=response.status_code)
+        except GatewayError as gateway_error:
+            if reservation:
+                StockReservationService.release(reservation['reservation_key'])
+            print(f"YooKassa Error: {gateway_error}")
+            return Response({
+                'success': False,
+                'error': str(gateway_error)
+            }, status=gateway_error.status_code)
+
+        # Статус платежа дальше обновляют уведомления шлюза (payment_webhook)
+        try:
+            PaymentEventService.record_payment(payment['id'], payment['status'], parse_amount(payment.get('amount')))
+        except Exception as record_error:
+            # не критично: check_payment_status спросит шлюз сам
+            print(f"[PAYMENT] Не удалось сохранить платёж {payment['id']}: {record_error}")
+
+        return Response({
+            'success': True,
+            'payment_id': payment['id'],
+            'confirmation_url': payment['confirmation']['confirmation_url'],
+            'message': 'Переходим на страницу оплаты (ТЕСТОВЫЙ РЕЖИМ)' if gateway.test_mode else 'Переходим на страницу оплаты',
+            **reservation_data,
+        }, status=201)
         
     except Exception as e:
         import traceback
         print(f"YooKassa Error: {str(e)}")
         print(traceback.format_exc())
+        if reservation:
+            StockReservationService.release(reservation['reservation_key'])
         return Response({
             'success': False,
             'error': f'Ошибка при создании платежа: {str(e)}'
@@ -1070,10 +1354,10 @@ def create_payment(request):
 def check_payment_status(request):
     """
     Check payment status by payment_id
+    Статус читается из нашей БД (gateway_payments, обновляется уведомлениями шлюза)
     """
     try:
         payment_id = request.query_params.get('payment_id')
-        is_mock = request.query_params.get('mock') == 'true'
         
         if not payment_id:
             return Response({
@@ -1081,42 +1365,23 @@ def check_payment_status(request):
                 'error': 'Payment ID not provided'
             }, status=400)
         
-        if USE_MOCK_PAYMENTS or is_mock:
-            # MOCK режим - автоматически считаем платеж успешным
-            print(f"[MOCK] Checking mock payment status: {payment_id}")
+        # Параметр mock из ссылки подтверждения не учитывается: тестовый шлюз — только при PAYMENT_GATEWAY_MODE = 'mock'
+        gateway = get_gateway()
+        try:
+            payment = PaymentEventService.get_status(payment_id, gateway)
+        except GatewayError as gateway_error:
             return Response({
-                'success': True,
-                'payment_id': payment_id,
-                'status': 'succeeded',
-                'amount': 0,  # Не важно в mock режиме
-                'paid': True  # Всегда успешно в mock режиме
-            }, status=200)
-        else:
-            # РЕАЛЬНЫЙ режим - отправляем запрос на YooKassa
-            import requests
-            from requests.auth import HTTPBasicAuth
-            
-            response = requests.get(
-                f'{YOOKASSA_API_URL}/payments/{payment_id}',
-                auth=HTTPBasicAuth(YOOKASSA_ACCOUNT_ID, YOOKASSA_SECRET_KEY),
-                headers={'Content-Type': 'application/json'},
-                timeout=10
-            )
-            
-            if response.status_code in [200, 201]:
-                payment = response.json()
-                return Response({
-                    'success': True,
-                    'payment_id': payment['id'],
-                    'status': payment['status'],
-                    'amount': float(payment['amount']['value']),
-                    'paid': payment['status'] == 'succeeded'
-                }, status=200)
-            else:
-                return Response({
-                    'success': False,
-                    'error': f'Payment not found: {response.text}'
-                }, status=response.status_code)
+                'success': False,
+                'error': f'Payment not found: {gateway_error.text or gateway_error}'
+            }, status=gateway_error.status_code)
+
+        return Response({
+            'success': True,
+            'payment_id': payment['payment_id'],
+            'status': payment['status'],
+            'amount': float(payment['amount'] or 0),
+            'paid': payment['status'] == 'succeeded'
+        }, status=200)
         
     except Exception as e:
         return Response({
@@ -1127,15 +1392,35 @@ def check_payment_status(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+def payment_webhook(request):
+    """
+    Уведомление ЮKassa о платеже: проверка отправителя и постановка в очередь.
+    Статусы заказов обновляет команда process_payment_events (apps/orders/payment_events.py)
+    """
+    if not is_trusted_source(request.META.get('REMOTE_ADDR')):
+        print(f"[WEBHOOK] Уведомление с недоверенного адреса {request.META.get('REMOTE_ADDR')}")
+        return Response({'success': False, 'error': 'Forbidden'}, status=403)
+    try:
+        payment_id, event, status, amount = parse_notification(request.data)
+    except ValueError as e:
+        return Response({'success': False, 'error': str(e)}, status=400)
+
+    # Повтор того же события ЮKassa получает 200, второй раз не ставится в очередь
+    queued = PaymentEventService.enqueue(payment_id, event, status, amount, request.data)
+    return Response({'success': True, 'queued': queued}, status=200)
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@idempotent('create_order')
 def create_order(request):
     """
     Create order from cart and save to database
     Используется транзакция для атомарности операций
     """
     try:
-        from apps.orders.models import Orders, OrderItems
+        from apps.orders.models import Orders
         from apps.users.models import Customers, Addresses, Users
-        from apps.products.models import Products
         from apps.users.decorators import get_user_from_request
         from datetime import datetime
         
@@ -1151,6 +1436,14 @@ def create_order(request):
         except Exception as e:
             print(f"[CREATE_ORDER] Error getting customer from JWT: {e}")
 
+        # Заказ из серверной корзины — только для покупателя, вошедшего по JWT
+        use_server_cart = str(order_data.get('use_server_cart', '')).lower() in ('1', 'true', 'yes')
+        if use_server_cart and not customer:
+            return Response({
+                'success': False,
+                'error': 'Войдите в аккаунт, чтобы оформить заказ из корзины.'
+            }, status=401)
+
         # Если не получили из JWT, пытаемся найти по email из order_data
         phone = order_data.get('phone', '')
         email = order_data.get('email', '')
@@ -1306,85 +1599,30 @@ def create_order(request):
                         }
                     }, status=400)
         
-            # Calculate total amount
-            items = order_data.get('items', [])
-            total_amount = 0
-            
-            # Проверяем наличие всех товаров ПЕРЕД созданием заказа
-            if not items:
-                return Response({
-                    'success': False,
-                    'error': 'Корзина пуста. Добавьте товары в корзину перед оформлением заказа.'
-                }, status=400)
-            
-            # Предварительная проверка всех товаров на наличие
-            products_to_check = {}
-            item_errors = []
-            print(f"[CREATE_ORDER] Получено {len(items)} товаров для проверки")
-            for idx, item in enumerate(items):
-                try:
-                    print(f"[CREATE_ORDER] Проверяем товар #{idx}: {item}")
-                    product_id = item.get('product_id')
-                    quantity = item.get('quantity', 1)
-
-                    if not product_id:
-                        item_errors.append(f'Товар #{idx}: отсутствует product_id')
-                        continue
-
-                    try:
-                        product_id = int(product_id)
-                        quantity = int(quantity)
-                    except (ValueError, TypeError) as ve:
-                        item_errors.append(f'Товар #{idx}: некорректный тип данных - {str(ve)}')
-                        print(f"[CREATE_ORDER] Ошибка типа: product_id={product_id} (тип {type(product_id)}), quantity={quantity} (тип {type(quantity)})")
-                        continue
+            # Позиции заказа
+            if use_server_cart:
+                items = CartService.order_items(customer.customer_id)
+            else:
+                items = order_data.get('items', [])
+            print(f"[CREATE_ORDER] Получено {len(items) if isinstance(items, list) else 0} товаров для проверки")
 
-                    if quantity <= 0:
-                        item_errors.append(f'Товар {product_id}: некорректное количество {quantity}')
-                        continue
+            # Все товары блокируются одним запросом в порядке product_id, остатки
+            # списываются одним UPDATE (apps/orders/checkout.py); резерв из
+            # create_payment не считается занятым и отмечается оформленным
+            try:
+                lines = take_stock(items, hold_key=order_data.get('reservation_key') or None)
+            except CheckoutError as checkout_error:
+                transaction.set_rollback(True)
+                print(f"[CREATE_ORDER] Ошибки проверки товаров: {checkout_error.details or checkout_error.message}")
+                response_data = {'success': False, 'error': checkout_error.message}
+                if checkout_error.details:
+                    response_data['details'] = checkout_error.details
+                return Response(response_data, status=400)
+
+            # Цены позиций — с учётом акций на сегодня, одним запросом на заказ
+            prices = get_price_resolver(request).prices({line['product_id']: line['price'] for line in lines})
+            sold_out = [line['product_id'] for line in lines if line['remaining'] is not None and line['remaining'] <= 0]
 
-                    try:
-                        product = Products.objects.select_for_update().get(product_id=product_id)
-                        # Логируем актуальное значение stock_quantity
-                        print(f"[CHECK_STOCK] Товар {product_id} ({product.product_name}): stock_quantity={product.stock_quantity}, запрошено={quantity}")
-                        # Проверяем наличие товара (блокируем для обновления)
-                        if product.stock_quantity is not None and product.stock_quantity < quantity:
-                            item_errors.append(f'Товар {product.product_name}: недостаточно товара на складе (доступно: {product.stock_quantity}, запрошено: {quantity})')
-                            print(f"[STOCK_ERROR] Товар {product_id}: недостаточно запасов")
-                            continue
-
-                        products_to_check[product_id] = {
-                            'product': product,
-                            'quantity': quantity,
-                            'price': product.price
-                        }
-                    except Products.DoesNotExist:
-                        item_errors.append(f'Товар {product_id}: товар не найден')
-                        print(f"[CREATE_ORDER] Товар {product_id} не найден в БД")
-                        continue
-                except Exception as e:
-                    item_errors.append(f'Ошибка при обработке товара #{idx}: {str(e)}')
-                    print(f"[CREATE_ORDER] Неожиданная ошибка: {e}")
-                    continue
-
-            # Если есть ошибки, возвращаем их с подробностями
-            if item_errors:
-                error_message = 'Ошибки при проверке товаров: ' + '; '.join(item_errors[:5])
-                print(f"[CREATE_ORDER] Ошибки валидации: {item_errors}")
-                print(f"[CREATE_ORDER] Request data: {order_data}")
-                return Response({
-                    'success': False,
-                    'error': error_message,
-                    'details': item_errors[:5]
-                }, status=400)
-        
-            # Если не найдено ни одного товара, возвращаем ошибку
-            if not products_to_check:
-                return Response({
-                    'success': False,
-                    'error': 'Не удалось найти товары для заказа.'
-                }, status=400)
-            
             # Создаем заказ
             import uuid
             tracking_number = f'TRK-{uuid.uuid4().hex[:8].upper()}'
@@ -1395,7 +1633,8 @@ def create_order(request):
                 payment_status = 'pending'  # Оплата ожидается при получении
             else:
                 payment_method = order_data.get('payment_method', 'card')
-                payment_status = 'completed'  # Для онлайн оплаты статус будет обновлен после оплаты
+                # completed ставит только подтверждённый платёж: link_order или уведомление шлюза
+                payment_status = 'pending'
             
             order = Orders.objects.create(
                 customer=customer,
@@ -1442,70 +1681,21 @@ def create_order(request):
             except Exception as audit_error:
                 print(f"Error logging order creation: {audit_error}")
 
-            # Создаем элементы заказа и уменьшаем количество товаров атомарно
-            created_items = []
-            for item in items:
-                product_id = int(item.get('product_id'))
-                quantity = int(item.get('quantity', 1))
-                if product_id not in products_to_check:
-                    continue
-                product_data = products_to_check[product_id]
-                product = product_data['product']
-                price = product_data['price']
-                # Сначала уменьшаем stock_quantity, потом создаём OrderItems
-                try:
-                    # Атомарно уменьшаем количество товара ПЕРЕД созданием элемента заказа
-                    # Это избегает срабатывания триггера update_stock_on_order
-                    updated = Products.objects.filter(
-                        product_id=product_id,
-                        stock_quantity__gte=quantity
-                    ).update(stock_quantity=F('stock_quantity') - quantity)
-                    
-                    if updated == 0:
-                        # Если не обновилось, значит товара недостаточно
-                        product.refresh_from_db()
-                        print(f"[STOCK_CHECK_FAIL] Товар {product_id}: запрошено {quantity}, доступно {product.stock_quantity}")
-                        return Response({
-                            'success': False,
-                            'error': f'Недостаточно товара для продукта {product.product_name}. Попробуйте позже.'
-                        }, status=400)
-                    
-                    print(f"[STOCK_DECREASED] Товар {product_id}: уменьшено на {quantity}")
-                    
-                    # Теперь создаём элемент заказа (без триггера, т.к. stock уже уменьшен)
-                    order_item = OrderItems.objects.create(
-                        order=order,
-                        product=product,
-                        quantity=quantity,
-                        price_at_purchase=price
-                    )
-                    created_items.append(order_item)
-                    total_amount += float(price) * quantity
-                except Exception as item_error:
-                    error_msg = str(item_error)
-                    print(f"[ORDER_ITEM_ERROR] Ошибка при создании элемента заказа: {error_msg}")
-                    # Не пытаемся делать rollback внутри atomic блока при ошибке
-                    # Просто возвращаем ошибку и позволяем atomic() откатить всё
-                    return Response({
-                        'success': False,
-                        'error': f'Ошибка при создании заказа: недостаточно товара или внутренняя ошибка'
-                    }, status=400)
-        
-            # Обновляем итоговую сумму заказа
-            order.total_amount = total_amount
-            # Если нужна фиксированная стоимость доставки, просто добавьте:
-            order.total_amount += 349  # фиксированная доставка
+            # Строки заказа — одним INSERT
+            created_items, items_total = create_order_items(order, lines, prices)
+
+            # Итоговая сумма заказа с фиксированной доставкой
+            order.total_amount = items_total + DELIVERY_COST
             order.save(update_fields=['total_amount'])
+            # Статус оплаты — из платежа шлюза, если он уже подтверждён; без платежа заказ остаётся pending
+            PaymentEventService.link_order(order_data.get('transaction_id'), order.order_id)
+            if sold_out:
+                products_bulk_changed.send(sender=Orders, product_ids=sold_out)
 
             # Очищаем корзину покупателя (если есть)
             try:
-                from apps.cart.models import Carts, CartItems
-                cart = Carts.objects.filter(customer=customer).first()
-                if cart:
-                    deleted_count = CartItems.objects.filter(cart=cart).delete()[0]
-                    print(f'[ORDER] Корзина очищена: удалено {deleted_count} товаров из корзины customer={customer.customer_id}')
-                else:
-                    print(f'[ORDER] Корзина не найдена для customer={customer.customer_id}')
+                deleted_count = CartService.clear(customer.customer_id)
+                print(f'[ORDER] Корзина очищена: удалено {deleted_count} товаров из корзины customer={customer.customer_id}')
             except Exception as cart_error:
                 # не критично, логируем и продолжаем
                 print(f'[ORDER] Не удалось очистить корзину автоматически: {cart_error}')
@@ -0,0 +1,231 @@
+# apps/cart/services.py
+"""
+Серверная корзина покупателя (таблицы carts / cart_items).
+
+У покупателя одна корзина и одна строка на товар (уникальные индексы из
+РАЗДЕЛА 10 dbSNDshop.sql), поэтому добавление, изменение и слияние гостевой
+корзины — по одному INSERT ... ON CONFLICT, а чтение корзины со строками,
+ценами, остатками и итогами — один запрос с JOIN (цены со скидками по
+акциям — apps/promotions/pricing.py, ещё один запрос).
+"""
+import logging
+from decimal import Decimal
+
+from django.db import connection
+
+from apps.promotions.pricing import PriceResolver
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_COST = Decimal('349')
+MAX_LINE_QUANTITY = 999
+MAX_MERGE_LINES = 200
+
+# Корзина покупателя: создаётся при первом обращении
+CART_CTE = """
+    cart AS (
+        INSERT INTO carts (customer_id, created_date)
+        VALUES (%s, CURRENT_TIMESTAMP)
+        ON CONFLICT (customer_id) DO UPDATE SET customer_id = EXCLUDED.customer_id
+        RETURNING cart_id
+    )
+"""
+
+
+class CartError(ValueError):
+    """Некорректная операция с корзиной"""
+
+
+def parse_quantity(value, allow_zero=False):
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        raise CartError('Некорректное количество')
+    if quantity < (0 if allow_zero else 1) or quantity > MAX_LINE_QUANTITY:
+        raise CartError(f'Количество должно быть от {0 if allow_zero else 1} до {MAX_LINE_QUANTITY}')
+    return quantity
+
+
+def parse_product_id(value):
+    try:
+        product_id = int(value)
+    except (TypeError, ValueError):
+        raise CartError('Некорректный product_id')
+    if product_id <= 0:
+        raise CartError('Некорректный product_id')
+    return product_id
+
+
+def build_cart(rows, prices=None):
+    """
+    Строки запроса CartService.get_cart -> корзина с итогами.
+    prices — {product_id: цена со скидкой}; для остальных товаров берётся цена из строки.
+    """
+    prices = prices or {}
+    lines = []
+    items_count = 0
+    subtotal = Decimal('0')
+    for product_id, quantity, product_name, base_price, stock_quantity, images, image_url in rows:
+        stock_quantity = stock_quantity or 0
+        price = prices.get(product_id, base_price)
+        line_total = price * quantity
+        items_count += quantity
+        subtotal += line_total
+        lines.append({
+            'product_id': product_id,
+            'product_name': product_name,
+            'image': images[0] if images else image_url,
+            'unit_price': str(price),
+            'base_price': str(base_price),
+            'quantity': quantity,
+            'line_total': str(line_total),
+            'stock_quantity': stock_quantity,
+            'is_in_stock': stock_quantity > 0,
+            'enough_stock': stock_quantity >= quantity,
+        })
+
+    delivery = DELIVERY_COST if lines else Decimal('0')
+    return {
+        'items': lines,
+        'items_count': items_count,
+        'subtotal': str(subtotal),
+        'delivery': str(delivery),
+        'total': str(subtotal + delivery),
+        'can_checkout': bool(lines) and all(line['enough_stock'] for line in lines),
+    }
+
+
+class CartService:
+    """Операции с корзиной; все методы принимают customer_id владельца"""
+
+    @staticmethod
+    def get_cart(customer_id, resolver=None):
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT ci.product_id, ci.quantity, p.product_name, p.price,
+                       p.stock_quantity, p.images, p.image_url
+                FROM carts c
+                JOIN cart_items ci ON ci.cart_id = c.cart_id
+                JOIN products p ON p.product_id = ci.product_id
+                WHERE c.customer_id = %s
+                ORDER BY ci.item_id
+            """, [customer_id])
+            rows = cursor.fetchall()
+        prices = (resolver or PriceResolver()).prices({row[0]: row[3] for row in rows})
+        return build_cart(rows, prices)
+
+    @staticmethod
+    def add_item(customer_id, product_id, quantity):
+        """Добавить товар (количество суммируется с уже лежащим в корзине)"""
+        product_id = parse_product_id(product_id)
+        quantity = parse_quantity(quantity)
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                WITH {CART_CTE}
+                INSERT INTO cart_items (cart_id, product_id, quantity)
+                SELECT cart.cart_id, p.product_id, %s
+                FROM cart, products p
+                WHERE p.product_id = %s
+                ON CONFLICT (cart_id, product_id)
+                DO UPDATE SET quantity = LEAST(cart_items.quantity + EXCLUDED.quantity, {MAX_LINE_QUANTITY})
+                RETURNING quantity
+            """, [customer_id, quantity, product_id])
+            row = cursor.fetchone()
+        if row is None:
+            raise CartError('Товар не найден')
+        return row[0]
+
+    @staticmethod
+    def set_quantity(customer_id, product_id, quantity):
+        """Установить количество; 0 — удалить строку"""
+        product_id = parse_product_id(product_id)
+        quantity = parse_quantity(quantity, allow_zero=True)
+        if quantity == 0:
+            CartService.remove_item(customer_id, product_id)
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                WITH {CART_CTE}
+                INSERT INTO cart_items (cart_id, product_id, quantity)
+                SELECT cart.cart_id, p.product_id, %s
+                FROM cart, products p
+                WHERE p.product_id = %s
+                ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = EXCLUDED.quantity
+                RETURNING quantity
+            """, [customer_id, quantity, product_id])
+            row = cursor.fetchone()
+        if row is None:
+            raise CartError('Товар не найден')
+        return row[0]
+
+    @staticmethod
+    def remove_item(customer_id, product_id):
+        product_id = parse_product_id(product_id)
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                DELETE FROM cart_items ci
+                USING carts c
+                WHERE ci.cart_id = c.cart_id AND c.customer_id = %s AND ci.product_id = %s
+            """, [customer_id, product_id])
+            return cursor.rowcount
+
+    @staticmethod
+    def clear(customer_id):
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                DELETE FROM cart_items ci
+                USING carts c
+                WHERE ci.cart_id = c.cart_id AND c.customer_id = %s
+            """, [customer_id])
+            return cursor.rowcount
+
+    @staticmethod
+    def merge(customer_id, items):
+        """
+        Слить гостевую корзину (localStorage) с серверной одним запросом.
+
+        Для товара, который уже есть в серверной корзине, остаётся большее из
+        двух количеств: повторное слияние той же гостевой корзины ничего не удваивает.
+        Несуществующие товары и некорректные строки пропускаются.
+        """
+        if not isinstance(items, list):
+            raise CartError('Ожидается список товаров')
+
+        quantities = {}
+        for item in items[:MAX_MERGE_LINES]:
+            try:
+                product_id = parse_product_id(item.get('product_id'))
+                quantity = parse_quantity(item.get('quantity', 1))
+            except (CartError, AttributeError):
+                continue
+            quantities[product_id] = min(quantities.get(product_id, 0) + quantity, MAX_LINE_QUANTITY)
+
+        if not quantities:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                WITH {CART_CTE}
+                INSERT INTO cart_items (cart_id, product_id, quantity)
+                SELECT cart.cart_id, p.product_id, v.quantity
+                FROM cart
+                CROSS JOIN unnest(%s::int[], %s::int[]) AS v (product_id, quantity)
+                JOIN products p ON p.product_id = v.product_id
+                ON CONFLICT (cart_id, product_id)
+                DO UPDATE SET quantity = GREATEST(cart_items.quantity, EXCLUDED.quantity)
+            """, [customer_id, list(quantities), list(quantities.values())])
+            merged = cursor.rowcount
+        logger.info(f"Гостевая корзина слита с корзиной покупателя {customer_id}: {merged} строк")
+        return merged
+
+    @staticmethod
+    def order_items(customer_id):
+        """Строки корзины в формате items из create_order"""
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT ci.product_id, ci.quantity
+                FROM carts c
+                JOIN cart_items ci ON ci.cart_id = c.cart_id
+                WHERE c.customer_id = %s
+                ORDER BY ci.product_id
+            """, [customer_id])
+            return [{'product_id': product_id, 'quantity': quantity} for product_id, quantity in cursor.fetchall()]
@@ -1,3 +1,83 @@
-from django.test import TestCase
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.test import RequestFactory, SimpleTestCase
+
+from api.views import cart_detail, cart_merge
+from apps.cart.services import CartError, CartService, build_cart, parse_quantity
+
+
+class CartTotalsTest(SimpleTestCase):
+    "Корзина с итогами собирается из строк одного запроса"
+
+    def test_lines_and_totals(self):
+        rows = [
+            (1, 2, 'Мышь', Decimal('990.00'), 5, ['/media/a.jpg'], None),
+            (2, 3, 'Коврик', Decimal('100.50'), 1, [], '/media/b.jpg'),
+        ]
+
+        cart = build_cart(rows)
+
+        self.assertEqual(cart['items_count'], 5)
+        self.assertEqual(cart['subtotal'], '2281.50')
+        self.assertEqual(cart['total'], '2630.50')
+        self.assertEqual(cart['items'][0]['line_total'], '1980.00')
+        self.assertEqual(cart['items'][1]['image'], '/media/b.jpg')
+        self.assertFalse(cart['items'][1]['enough_stock'])
+        self.assertFalse(cart['can_checkout'])
+
+    def test_promotion_prices_replace_base_price(self):
+        rows = [(1, 2, 'Мышь', Decimal('990.00'), 5, [], None)]
+
+        cart = build_cart(rows, {1: Decimal('841.50')})
+
+        self.assertEqual((cart['items'][0]['unit_price'], cart['items'][0]['base_price']), ('841.50', '990.00'))
+        self.assertEqual(cart['subtotal'], '1683.00')
+
+    def test_empty_cart_has_no_delivery(self):
+        cart = build_cart([])
+        self.assertEqual((cart['total'], cart['can_checkout']), ('0', False))
+
+    def test_quantity_validation(self):
+        for value in (0, -1, 'x', None, 1000):
+            with self.subTest(value=value), self.assertRaises(CartError):
+                parse_quantity(value)
+        self.assertEqual(parse_quantity('0', allow_zero=True), 0)
+
+
+class CartMergeTest(SimpleTestCase):
+    "Слияние гостевой корзины — один запрос"
+
+    def test_merge_aggregates_lines_into_one_statement(self):
+        items = [
+            {'product_id': 5, 'quantity': 1},
+            {'product_id': '5', 'quantity': 2},
+            {'product_id': 7},
+            {'product_id': 'x', 'quantity': 1},
+            'garbage',
+        ]
+        with mock.patch('apps.cart.services.connection') as connection:
+            cursor = connection.cursor.return_value.__enter__.return_value
+            cursor.rowcount = 2
+            CartService.merge(10, items)
+
+        cursor.execute.assert_called_once()
+        sql, params = cursor.execute.call_args.args
+        self.assertIn('GREATEST(cart_items.quantity, EXCLUDED.quantity)', sql)
+        self.assertEqual(params, [10, [5, 7], [3, 1]])
+
+    def test_merge_without_valid_lines_skips_db(self):
+        with mock.patch('apps.cart.services.connection') as connection:
+            self.assertEqual(CartService.merge(10, [{'quantity': 1}]), 0)
+        connection.cursor.assert_not_called()
+
+
+class CartApiTest(SimpleTestCase):
+    "Корзина доступна только вошедшему покупателю"
+
+    def test_anonymous_requests_are_rejected(self):
+        factory = RequestFactory()
+        with mock.patch('apps.users.decorators.get_user_from_request', return_value=(None, None)):
+            self.assertEqual(cart_detail(factory.get('/api/cart/')).status_code, 401)
+            response = cart_merge(factory.post('/api/cart/merge/', {'items': []}, content_type='application/json'))
+            self.assertEqual(response.status_code, 401)
@@ -0,0 +1,193 @@
+# apps/orders/checkout.py
+"""
+Списание остатков и строки заказа при оформлении (api.views.create_order).
+
+Все товары заказа блокируются одним SELECT ... ORDER BY product_id FOR UPDATE:
+встречные заказы с общими товарами берут блокировки в одном порядке и не
+взаимоблокируются. Остатки уменьшаются одним UPDATE ... FROM unnest(...),
+который возвращает новый остаток по каждому товару (NULL — не хватило),
+строки order_items вставляются одним bulk_create. Заказ из 20 позиций —
+несколько запросов вместо ~60.
+
+Свободный остаток — stock_quantity за вычетом чужих активных резервов
+(apps/orders/reservations.py); собственный резерв заказа (hold_key)
+при списании отмечается оформленным.
+
+Функции вызываются внутри transaction.atomic() вызывающего кода; при
+CheckoutError транзакцию нужно откатить.
+"""
+import logging
+from decimal import Decimal
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+MAX_ORDER_LINES = 200
+
+LOCK_SQL = """
+    SELECT product_id, product_name, price, stock_quantity
+    FROM products
+    WHERE product_id = ANY(%s)
+    ORDER BY product_id
+    FOR UPDATE
+"""
+
+DECREMENT_SQL = """
+    WITH v (product_id, quantity) AS (
+        SELECT * FROM unnest(%s::int[], %s::int[])
+    ),
+    updated AS (
+        UPDATE products p
+        SET stock_quantity = p.stock_quantity - v.quantity
+        FROM v
+        WHERE p.product_id = v.product_id AND p.stock_quantity >= v.quantity
+        RETURNING p.product_id, p.stock_quantity
+    )
+    SELECT v.product_id, u.stock_quantity
+    FROM v
+    LEFT JOIN updated u ON u.product_id = v.product_id
+    ORDER BY v.product_id
+"""
+
+
+class CheckoutError(ValueError):
+    """Заказ нельзя оформить; details — ошибки по позициям"""
+
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.message = message
+        self.details = details or []
+
+
+def parse_items(items):
+    """
+    Строки корзины [{product_id, quantity}] -> ({product_id: quantity}, ошибки).
+    Повторы одного товара складываются; ключи отсортированы по product_id.
+    """
+    quantities = {}
+    errors = []
+    if not isinstance(items, list):
+        return {}, ['Некорректный список товаров']
+    for idx, item in enumerate(items[:MAX_ORDER_LINES]):
+        if not isinstance(item, dict):
+            errors.append(f'Товар #{idx}: некорректная строка')
+            continue
+        product_id = item.get('product_id')
+        quantity = item.get('quantity', 1)
+        if not product_id:
+            errors.append(f'Товар #{idx}: отсутствует product_id')
+            continue
+        try:
+            product_id = int(product_id)
+            quantity = int(quantity)
+        except (ValueError, TypeError) as e:
+            errors.append(f'Товар #{idx}: некорректный тип данных - {e}')
+            continue
+        if quantity <= 0:
+            errors.append(f'Товар {product_id}: некорректное количество {quantity}')
+            continue
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    if len(items) > MAX_ORDER_LINES:
+        errors.append(f'В заказе не больше {MAX_ORDER_LINES} позиций')
+    return dict(sorted(quantities.items())), errors
+
+
+def lock_products(cursor, product_ids):
+    """{product_id: (product_name, price, stock_quantity)} с блокировкой строк в порядке product_id"""
+    cursor.execute(LOCK_SQL, [list(product_ids)])
+    return {row[0]: row[1:] for row in cursor.fetchall()}
+
+
+def stock_errors(quantities, locked, held=None):
+    """Ошибки по позициям; held — {product_id: количество в чужих резервах}"""
+    held = held or {}
+    errors = []
+    for product_id, quantity in quantities.items():
+        if product_id not in locked:
+            errors.append(f'Товар {product_id}: товар не найден')
+            continue
+        product_name, _, stock_quantity = locked[product_id]
+        if stock_quantity is not None:
+            stock_quantity -= held.get(product_id, 0)
+        if stock_quantity is not None and stock_quantity < quantity:
+            errors.append(
+                f'Товар {product_name}: недостаточно товара на складе '
+                f'(доступно: {stock_quantity}, запрошено: {quantity})'
+            )
+    return errors
+
+
+def decrement_stock(cursor, quantities):
+    """Уменьшить остатки одним запросом; {product_id: новый остаток или None, если не хватило}"""
+    cursor.execute(DECREMENT_SQL, [list(quantities), list(quantities.values())])
+    return dict(cursor.fetchall())
+
+
+def take_stock(items, hold_key=None):
+    """
+    Проверить и списать остатки для строк заказа.
+    hold_key — ключ резерва из create_payment: его количества не считаются занятыми.
+
+    Returns:
+        [{'product_id', 'product_name', 'price', 'quantity', 'remaining'}] по возрастанию product_id
+        (price — базовая цена; цены со скидкой считает вызывающий код)
+
+    Raises:
+        CheckoutError: пустая корзина, некорректные строки, нет товара или остатка
+    """
+    from apps.orders.reservations import convert, held_quantities
+
+    if not items:
+        raise CheckoutError('Корзина пуста. Добавьте товары в корзину перед оформлением заказа.')
+    quantities, errors = parse_items(items)
+
+    with connection.cursor() as cursor:
+        locked = lock_products(cursor, quantities) if quantities else {}
+        held = held_quantities(cursor, quantities, hold_key) if quantities else {}
+        errors += stock_errors(quantities, locked, held)
+        if errors:
+            raise CheckoutError('Ошибки при проверке товаров: ' + '; '.join(errors[:5]), errors[:5])
+        if not quantities:
+            raise CheckoutError('Не удалось найти товары для заказа.')
+
+        remaining = decrement_stock(cursor, quantities)
+        if hold_key:
+            convert(cursor, hold_key)
+
+    short = [product_id for product_id, left in remaining.items() if left is None]
+    if short:
+        # Строки заблокированы, поэтому сюда попадает только товар без учёта остатка (NULL)
+        raise CheckoutError(f'Недостаточно товара для продукта {locked[short[0]][0]}. Попробуйте позже.')
+
+    logger.info(f"Списаны остатки по {len(quantities)} товарам: {quantities}")
+    return [
+        {
+            'product_id': product_id,
+            'product_name': locked[product_id][0],
+            'price': locked[product_id][1],
+            'quantity': quantity,
+            'remaining': remaining[product_id],
+        }
+        for product_id, quantity in quantities.items()
+    ]
+
+
+def create_order_items(order, lines, prices):
+    """
+    Вставить строки заказа одним bulk_create.
+    prices — {product_id: цена за единицу}. Возвращает (строки, сумма товаров).
+    """
+    from apps.orders.models import OrderItems
+
+    order_items = OrderItems.objects.bulk_create([
+        OrderItems(
+            order=order,
+            product_id=line['product_id'],
+            quantity=line['quantity'],
+            price_at_purchase=prices[line['product_id']],
+        )
+        for line in lines
+    ])
+    total = sum((prices[line['product_id']] * line['quantity'] for line in lines), Decimal('0'))
+    return order_items, total
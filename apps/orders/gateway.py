@@ -0,0 +1,315 @@
+# apps/orders/gateway.py
+"""
+Клиент платёжного шлюза ЮKassa (API v3) для create_payment / check_payment_status.
+
+Один requests.Session на процесс: TLS-соединения к шлюзу переиспользуются
+(keep-alive), пул ограничен PAYMENT_GATEWAY_POOL_SIZE и при нехватке
+соединений запрос ждёт свободное, а не открывает новое. Таймауты раздельные:
+соединение — 3 с, ответ — 10 с.
+
+Повторы с экспоненциальной задержкой — только для идемпотентных вызовов:
+GET и POST /payments с заголовком Idempotence-Key (повтор с тем же ключом
+ЮKassa не превращает во второй платёж). Повторяются обрывы соединения,
+429 и 5xx.
+
+CircuitBreaker после FAILURE_THRESHOLD подряд неудачных вызовов на
+RESET_TIMEOUT секунд отвечает GatewayUnavailable без сетевого запроса —
+воркеры не висят на таймаутах, пока шлюз лежит. Задержки и ошибки по
+каждой операции — в stats() (страница /admin-panel/payment-gateway/).
+
+PAYMENT_GATEWAY_MODE = 'mock' — MockGateway с тем же интерфейсом: платёж
+сразу считается оплаченным. Для нагрузочных прогонов без интернета есть
+локальная заглушка шлюза (apps/orders/gateway_stub.py, команды
+run_gateway_stub и benchmark_gateway).
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+RETRIES = 3
+BACKOFF_FACTOR = 0.2
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30
+# Сколько последних замеров хранить для перцентилей
+LATENCY_WINDOW = 512
+
+
+class GatewayError(Exception):
+    """Шлюз ответил ошибкой; status_code и text — ответ шлюза"""
+
+    def __init__(self, message, status_code=502, text=''):
+        super().__init__(message)
+        self.status_code = status_code
+        self.text = text
+
+
+class GatewayUnavailable(GatewayError):
+    """Шлюз недоступен: сеть, таймаут, 5xx или открытый CircuitBreaker"""
+
+    def __init__(self, message, text=''):
+        super().__init__(message, status_code=503, text=text)
+
+
+class CircuitBreaker:
+    """closed -> open после threshold ошибок подряд -> half_open через reset_timeout -> closed"""
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probe = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        """Можно ли делать вызов; в half_open пропускается один пробный"""
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._probe:
+                self._probe = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe = False
+            if self._opened_at is not None or self._failures >= self.threshold:
+                self._opened_at = self._clock()
+
+
+class LatencyStats:
+    """Число вызовов, ошибок, повторов и задержки по операциям текущего процесса"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._window = window
+        self._lock = threading.Lock()
+        self._ops = {}
+
+    def record(self, operation, elapsed_ms, ok, retries=0):
+        with self._lock:
+            op = self._ops.setdefault(operation, {
+                'calls': 0, 'errors': 0, 'retries': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'recent': deque(maxlen=self._window),
+            })
+            op['calls'] += 1
+            op['errors'] += 0 if ok else 1
+            op['retries'] += retries
+            op['total_ms'] += elapsed_ms
+            op['max_ms'] = max(op['max_ms'], elapsed_ms)
+            op['recent'].append(elapsed_ms)
+
+    def snapshot(self):
+        with self._lock:
+            ops = {name: dict(op, recent=sorted(op['recent'])) for name, op in self._ops.items()}
+        result = {}
+        for name, op in ops.items():
+            recent = op.pop('recent')
+            op['avg_ms'] = round(op['total_ms'] / op['calls'], 1) if op['calls'] else None
+            op['p50_ms'] = round(recent[len(recent) // 2], 1) if recent else None
+            op['p95_ms'] = round(recent[min(len(recent) - 1, int(len(recent) * 0.95))], 1) if recent else None
+            op['total_ms'] = round(op['total_ms'], 1)
+            op['max_ms'] = round(op['max_ms'], 1)
+            result[name] = op
+        return result
+
+
+def build_session(pool_size, retries=RETRIES, backoff_factor=BACKOFF_FACTOR):
+    """Session с ограниченным пулом keep-alive соединений и повторами GET/POST с backoff"""
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({'GET', 'POST'}),
+        raise_on_status=False,
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class YooKassaGateway:
+    """Вызовы API ЮKassa через общий пул соединений"""
+
+    test_mode = False
+
+    def __init__(self, base_url, account_id, secret_key, pool_size=10, retries=RETRIES,
+                 backoff_factor=BACKOFF_FACTOR, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyStats()
+        self.session = build_session(pool_size, retries, backoff_factor)
+        self.session.auth = (account_id, secret_key)
+        self.session.headers.update({'Content-Type': 'application/json'})
+
+    def create_payment(self, amount, description, metadata=None, return_url=None, idempotence_key=None):
+        """
+        POST /payments. idempotence_key связывает повторы одного платежа:
+        передавайте Idempotency-Key запроса клиента, если он есть.
+        """
+        payload = {
+            'amount': {'value': f'{amount:.2f}', 'currency': 'RUB'},
+            'confirmation': {'type': 'redirect', 'return_url': return_url or settings.PAYMENT_RETURN_URL},
+            'capture': True,
+            'description': description,
+            'metadata': metadata or {},
+        }
+        return self._call('create_payment', 'POST', '/payments', json=payload,
+                          headers={'Idempotence-Key': idempotence_key or str(uuid.uuid4())})
+
+    def get_payment(self, payment_id):
+        return self._call('get_payment', 'GET', f'/payments/{payment_id}')
+
+    def _call(self, operation, method, path, **kwargs):
+        if not self.breaker.allow():
+            self.latency.record(operation, 0.0, ok=False)
+            raise GatewayUnavailable('Платёжный сервис временно недоступен. Попробуйте через минуту.')
+
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            self.breaker.failure()
+            self.latency.record(operation, (time.perf_counter() - started) * 1000, ok=False)
+            logger.warning(f"Шлюз {operation}: {e}")
+            raise GatewayUnavailable(f'Платёжный сервис недоступен: {e.__class__.__name__}')
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        retries = len(getattr(getattr(response.raw, 'retries', None), 'history', ()) or ())
+        if response.status_code >= 500:
+            self.breaker.failure()
+            self.latency.record(operation, elapsed_ms, ok=False, retries=retries)
+            raise GatewayUnavailable(f'Платёжный сервис ответил {response.status_code}', text=response.text)
+
+        # 4xx — шлюз работает, ошибка в запросе
+        self.breaker.success()
+        ok = response.status_code < 400
+        self.latency.record(operation, elapsed_ms, ok=ok, retries=retries)
+        if not ok:
+            raise GatewayError(f'YooKassa error: {response.text}', status_code=response.status_code, text=response.text)
+        return response.json()
+
+    def stats(self):
+        return {
+            'mode': 'yookassa',
+            'base_url': self.base_url,
+            'breaker': self.breaker.state,
+            'operations': self.latency.snapshot(),
+        }
+
+    def close(self):
+        self.session.close()
+
+
+class MockGateway:
+    """Платежи без обращения к шлюзу: ответы в формате ЮKassa, платёж сразу оплачен"""
+
+    test_mode = True
+
+    def __init__(self):
+        self.latency = LatencyStats()
+        self._amounts = {}
+
+    def create_payment(self, amount, description, metadata=None, return_url=None, idempotence_key=None):
+        payment_id = f"mock_{uuid.uuid4().hex[:12]}"
+        self.latency.record('create_payment', 0.0, ok=True)
+        self._amounts[payment_id] = f'{amount:.2f}'
+        return {
+            'id': payment_id,
+            'status': 'succeeded',
+            'paid': True,
+            'amount': {'value': f'{amount:.2f}', 'currency': 'RUB'},
+            'confirmation': {
+                'type': 'redirect',
+                'confirmation_url': f"{return_url or settings.PAYMENT_RETURN_URL}?payment_id={payment_id}&mock=true",
+            },
+            'description': description,
+            'metadata': metadata or {},
+        }
+
+    def get_payment(self, payment_id):
+        self.latency.record('get_payment', 0.0, ok=True)
+        # Сумма известна только для платежей этого процесса; иначе 0.00 — «нет суммы» для parse_amount
+        amount = self._amounts.get(payment_id, '0.00')
+        return {'id': payment_id, 'status': 'succeeded', 'paid': True, 'amount': {'value': amount, 'currency': 'RUB'}}
+
+    def stats(self):
+        return {'mode': 'mock', 'operations': self.latency.snapshot()}
+
+    def close(self):
+        pass
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """Шлюз процесса по настройкам PAYMENT_GATEWAY_MODE / YOOKASSA_*"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                if settings.PAYMENT_GATEWAY_MODE == 'mock':
+                    _gateway = MockGateway()
+                else:
+                    _gateway = YooKassaGateway(
+                        settings.YOOKASSA_API_URL,
+                        settings.YOOKASSA_ACCOUNT_ID,
+                        settings.YOOKASSA_SECRET_KEY,
+                        pool_size=settings.PAYMENT_GATEWAY_POOL_SIZE,
+                    )
+    return _gateway
+
+
+def reset_gateway():
+    """Закрыть пул и пересоздать шлюз при следующем get_gateway (смена настроек, тесты)"""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is not None:
+            _gateway.close()
+        _gateway = None
+
+
+def stats():
+    return get_gateway().stats()
@@ -0,0 +1,186 @@
+# apps/orders/gateway_stub.py
+"""
+Локальная заглушка API ЮKassa v3 для тестов и нагрузочных прогонов без интернета.
+
+Поддерживает то, чем пользуется apps/orders/gateway.py:
+POST /payments (Basic-авторизация, Idempotence-Key: повтор с тем же ключом
+возвращает тот же платёж) и GET /payments/<id>. Платёж считается оплаченным
+через paid_after секунд после создания.
+
+latency — искусственная задержка ответа; fail_next(n, status) — следующие n
+запросов получат ошибку (проверка повторов и CircuitBreaker).
+
+    with GatewayStub(latency=0.05) as stub:
+        gateway = YooKassaGateway(stub.url, 'shop', 'secret')
+"""
+import json
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'GatewayStub/1.0'
+
+    def setup(self):
+        super().setup()
+        # Заголовки и тело уходят отдельными пакетами — без NODELAY ответ ждёт delayed ACK клиента
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.stub.count('connections')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _prepare(self):
+        """Общая часть запросов: тело, задержка, ошибки и авторизация; None — ответ уже отправлен"""
+        stub = self.server.stub
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        stub.count('requests')
+        if stub.latency:
+            time.sleep(stub.latency)
+        failure = stub.take_failure()
+        if failure:
+            self._send(failure, {'type': 'error', 'code': 'internal_server_error'})
+            return None
+        if not self.headers.get('Authorization', '').startswith('Basic '):
+            self._send(401, {'type': 'error', 'code': 'invalid_credentials'})
+            return None
+        return body
+
+    def do_POST(self):
+        body = self._prepare()
+        if body is None:
+            return
+        if self.path.rstrip('/') != '/payments':
+            self._send(404, {'type': 'error', 'code': 'not_found'})
+            return
+        key = self.headers.get('Idempotence-Key') or self.headers.get('Idempotency-Key')
+        if not key:
+            self._send(400, {'type': 'error', 'code': 'invalid_request', 'parameter': 'Idempotence-Key'})
+            return
+        try:
+            data = json.loads(body or b'{}')
+            amount = data['amount']
+        except (ValueError, KeyError, TypeError):
+            self._send(400, {'type': 'error', 'code': 'invalid_request', 'parameter': 'amount'})
+            return
+        self._send(200, self.server.stub.create(key, amount, data))
+
+    def do_GET(self):
+        if self._prepare() is None:
+            return
+        prefix = '/payments/'
+        payment = self.server.stub.get(self.path[len(prefix):]) if self.path.startswith(prefix) else None
+        if payment is None:
+            self._send(404, {'type': 'error', 'code': 'not_found'})
+            return
+        self._send(200, payment)
+
+
+class GatewayStub:
+    """HTTP-сервер заглушки в фоновом потоке; port=0 — свободный порт"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, paid_after=0.0):
+        self.latency = latency
+        self.paid_after = paid_after
+        self.counters = {'connections': 0, 'requests': 0, 'created': 0, 'replayed': 0}
+        self._lock = threading.Lock()
+        self._payments = {}
+        self._keys = {}
+        self._failures = []
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def fail_next(self, count=1, status=503):
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def take_failure(self):
+        with self._lock:
+            return self._failures.pop(0) if self._failures else None
+
+    def create(self, key, amount, data):
+        with self._lock:
+            if key in self._keys:
+                self.counters['replayed'] += 1
+                return self._payment(self._keys[key])
+            payment_id = uuid.uuid4().hex
+            self._payments[payment_id] = {
+                'id': payment_id,
+                'created': time.monotonic(),
+                'created_at': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+                'amount': amount,
+                'description': data.get('description', ''),
+                'metadata': data.get('metadata') or {},
+                'return_url': (data.get('confirmation') or {}).get('return_url', ''),
+            }
+            self._keys[key] = payment_id
+            self.counters['created'] += 1
+            return self._payment(payment_id)
+
+    def get(self, payment_id):
+        with self._lock:
+            return self._payment(payment_id) if payment_id in self._payments else None
+
+    def _payment(self, payment_id):
+        stored = self._payments[payment_id]
+        paid = time.monotonic() - stored['created'] >= self.paid_after
+        separator = '&' if '?' in stored['return_url'] else '?'
+        return {
+            'id': payment_id,
+            'status': 'succeeded' if paid else 'pending',
+            'paid': paid,
+            'amount': stored['amount'],
+            'created_at': stored['created_at'],
+            'description': stored['description'],
+            'metadata': stored['metadata'],
+            'test': True,
+            'confirmation': {
+                'type': 'redirect',
+                'confirmation_url': f"{stored['return_url']}{separator}payment_id={payment_id}",
+            },
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join(5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,50 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from apps.orders.gateway import YooKassaGateway
+from apps.orders.gateway_stub import GatewayStub
+
+
+class Command(BaseCommand):
+    help = (
+        'Пропускная способность клиента платёжного шлюза: create_payment + get_payment '
+        'против локальной заглушки ЮKassa (или --url) в несколько потоков'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Сколько платежей создать')
+        parser.add_argument('--concurrency', type=int, default=10, help='Потоков (как воркеров сайта)')
+        parser.add_argument('--pool-size', type=int, default=10)
+        parser.add_argument('--latency-ms', type=float, default=20, help='Задержка ответа заглушки')
+        parser.add_argument('--url', help='Готовый шлюз вместо встроенной заглушки')
+
+    def handle(self, *args, **options):
+        stub = None
+        url = options['url']
+        if not url:
+            stub = GatewayStub(latency=options['latency_ms'] / 1000).start()
+            url = stub.url
+        gateway = YooKassaGateway(url, 'benchmark', 'benchmark', pool_size=options['pool_size'])
+
+        def pay(index):
+            payment = gateway.create_payment(100 + index % 50, f'Нагрузочный платёж {index}')
+            gateway.get_payment(payment['id'])
+
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                list(pool.map(pay, range(options['requests'])))
+        finally:
+            elapsed = time.perf_counter() - started
+            gateway.close()
+            if stub:
+                stub.stop()
+
+        self.stdout.write(json.dumps(gateway.stats(), ensure_ascii=False, indent=2))
+        self.stdout.write(self.style.SUCCESS(
+            f"{options['requests']} платежей за {elapsed:.2f} с: "
+            f"{options['requests'] * 2 / elapsed:.0f} вызовов шлюза в секунду"
+        ))
@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from apps.orders.reservations import RESERVATION_RETENTION, StockReservationService
+
+
+class Command(BaseCommand):
+    help = 'Пометить просроченные резервы остатков и удалить старые завершённые (запускать по cron раз в минуту)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-days', type=int, default=RESERVATION_RETENTION.days,
+            help='Сколько дней хранить завершённые и просроченные резервы',
+        )
+
+    def handle(self, *args, **options):
+        expired, deleted = StockReservationService.expire(timedelta(days=options['retention_days']))
+        self.stdout.write(self.style.SUCCESS(f'Резервы остатков: просрочено {expired}, удалено {deleted}'))
@@ -0,0 +1,56 @@
+import select
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from apps.orders.payment_events import BATCH_SIZE, CHANNEL, PaymentEventService
+
+
+class Command(BaseCommand):
+    help = (
+        'Перенести статусы из очереди уведомлений шлюза (payment_events) в заказы. '
+        'Без --loop обрабатывает накопившееся и завершается (cron), с --loop ждёт новые события по LISTEN'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно')
+        parser.add_argument('--interval', type=float, default=5, help='Проверка очереди без уведомлений, секунд')
+        parser.add_argument('--purge-days', type=int, help='Удалить обработанные события старше N дней и выйти')
+
+    def handle(self, *args, **options):
+        if options['purge_days'] is not None:
+            deleted = PaymentEventService.purge(timedelta(days=options['purge_days']))
+            self.stdout.write(self.style.SUCCESS(f'Удалено обработанных событий: {deleted}'))
+            return
+
+        processed = self._drain(options['batch_size'])
+        if not options['loop']:
+            self.stdout.write(self.style.SUCCESS(f'Обработано событий: {processed}'))
+            return
+
+        db = connections['default']
+        conn = db.get_new_connection(db.get_connection_params())
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN {CHANNEL}')
+        self.stdout.write(f'Ожидание уведомлений {CHANNEL} (Ctrl+C — остановить)')
+        try:
+            while True:
+                if select.select([conn], [], [], options['interval']) != ([], [], []):
+                    conn.poll()
+                    conn.notifies.clear()
+                self._drain(options['batch_size'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            conn.close()
+
+    def _drain(self, batch_size):
+        total = 0
+        while True:
+            processed = PaymentEventService.process_batch(batch_size)
+            total += processed
+            if processed < batch_size:
+                return total
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from apps.orders.gateway_stub import GatewayStub
+
+
+class Command(BaseCommand):
+    help = (
+        'Запустить локальную заглушку API ЮKassa. Для прогона сайта в реальном режиме без интернета: '
+        'PAYMENT_GATEWAY_MODE=yookassa YOOKASSA_API_URL=http://127.0.0.1:<port>'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8099)
+        parser.add_argument('--latency-ms', type=float, default=0, help='Задержка каждого ответа')
+        parser.add_argument('--paid-after', type=float, default=0, help='Через сколько секунд платёж оплачен')
+
+    def handle(self, *args, **options):
+        stub = GatewayStub(
+            host=options['host'], port=options['port'],
+            latency=options['latency_ms'] / 1000, paid_after=options['paid_after'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Заглушка ЮKassa: {stub.url} (Ctrl+C — остановить)'))
+        try:
+            stub.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stub.stop()
+            self.stdout.write(f'Запросов: {stub.counters}')
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservations',
+            fields=[
+                ('reservation_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('hold_key', models.CharField(max_length=64)),
+                ('quantity', models.IntegerField()),
+                ('status', models.CharField(max_length=20)),
+                ('created_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'stock_reservations',
+                'managed': False,
+            },
+        ),
+    ]
@@ -73,3 +73,18 @@ class Payments(models.Model):
     class Meta:
         managed = False
         db_table = 'payments'
+
+
+class StockReservations(models.Model):
+    reservation_id = models.BigAutoField(primary_key=True)
+    hold_key = models.CharField(max_length=64)
+    product = models.ForeignKey(Products, models.DO_NOTHING)
+    quantity = models.IntegerField()
+    customer = models.ForeignKey(Customers, models.DO_NOTHING, blank=True, null=True)
+    status = models.CharField(max_length=20)
+    created_at = models.DateTimeField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = 'stock_reservations'
@@ -0,0 +1,265 @@
+# apps/orders/payment_events.py
+"""
+Статусы платежей из уведомлений шлюза (webhook) вместо опроса шлюза браузером.
+
+POST /api/payment/webhook/ проверяет адрес отправителя (YOOKASSA_WEBHOOK_IPS)
+и формат уведомления и только ставит событие в очередь payment_events
+(РАЗДЕЛ 15 dbSNDshop.sql): повтор того же события по тому же платежу
+отбрасывается уникальным ключом. Команда process_payment_events забирает
+очередь пачками (FOR UPDATE SKIP LOCKED — воркеров может быть несколько),
+сводит события к последнему статусу каждого платежа и одним запросом на
+таблицу обновляет gateway_payments, orders.payment_status и payments.
+
+Итоговые статусы (succeeded, canceled) не перезаписываются, поэтому порядок
+доставки и повторы уведомлений не важны. Онлайн-заказ создаётся в статусе pending,
+create_order привязывает его к платежу, только если платёж ещё ни к чему не
+привязан и его сумма совпадает с суммой заказа; completed ставят только
+подтверждённый платёж или уведомление шлюза. check_payment_status читает статус
+из gateway_payments; к шлюзу обращается, только если платежа нет в таблице
+или он дольше STALE_AFTER ждёт уведомления. Ответы тестового шлюза
+(MockGateway) в таблицу не записываются.
+"""
+import ipaddress
+import json
+import logging
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+# Сколько ждать уведомления, прежде чем один раз спросить шлюз
+STALE_AFTER = timedelta(seconds=60)
+CHANNEL = 'payment_events'
+
+FINAL_STATUSES = ('succeeded', 'canceled')
+# Порядок статусов платежа ЮKassa: из пачки событий берётся самый поздний
+STATUS_RANK = {'pending': 0, 'waiting_for_capture': 1, 'succeeded': 2, 'canceled': 2}
+# Статус платежа шлюза -> orders.payment_status
+ORDER_PAYMENT_STATUS = {'succeeded': 'completed', 'canceled': 'failed'}
+
+ENQUEUE_SQL = """
+    INSERT INTO payment_events (payment_id, event, status, amount, payload)
+    VALUES (%s, %s, %s, %s, %s::jsonb)
+    ON CONFLICT (payment_id, event) DO NOTHING
+"""
+
+CLAIM_SQL = """
+    SELECT event_id, payment_id, status, amount
+    FROM payment_events
+    WHERE processed_at IS NULL
+    ORDER BY event_id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+"""
+
+UPSERT_SQL = """
+    INSERT INTO gateway_payments (gateway_payment_id, status, amount, created_at, updated_at)
+    SELECT v.payment_id, v.status, v.amount, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+    FROM unnest(%s::varchar[], %s::varchar[], %s::numeric[]) AS v (payment_id, status, amount)
+    ON CONFLICT (gateway_payment_id) DO UPDATE SET
+        status = CASE
+            WHEN gateway_payments.status IN ('succeeded', 'canceled') THEN gateway_payments.status
+            ELSE EXCLUDED.status
+        END,
+        amount = COALESCE(EXCLUDED.amount, gateway_payments.amount),
+        updated_at = CURRENT_TIMESTAMP
+    RETURNING gateway_payment_id, status, order_id
+"""
+
+UPDATE_ORDERS_SQL = """
+    UPDATE orders o
+    SET payment_status = v.payment_status
+    FROM unnest(%s::int[], %s::varchar[]) AS v (order_id, payment_status)
+    WHERE o.order_id = v.order_id AND o.payment_status IS DISTINCT FROM v.payment_status
+"""
+
+# Привязка только свободного (или уже своего — повтор create_order) платежа с суммой заказа
+LINK_ORDER_SQL = """
+    UPDATE gateway_payments g
+    SET order_id = o.order_id
+    FROM orders o
+    WHERE g.gateway_payment_id = %s
+      AND o.order_id = %s
+      AND (g.order_id IS NULL OR g.order_id = o.order_id)
+      AND g.amount = o.total_amount
+    RETURNING g.status, g.amount
+"""
+
+INSERT_PAYMENTS_SQL = """
+    INSERT INTO payments (order_id, amount, method, payment_date)
+    SELECT o.order_id, COALESCE(g.amount, o.total_amount), COALESCE(o.payment_method, 'card'), CURRENT_TIMESTAMP
+    FROM gateway_payments g
+    JOIN orders o ON o.order_id = g.order_id
+    WHERE g.gateway_payment_id = ANY(%s) AND g.status = 'succeeded'
+    ON CONFLICT (order_id) DO NOTHING
+"""
+
+
+def parse_notification(data):
+    """
+    Уведомление ЮKassa {'type': 'notification', 'event': 'payment.succeeded', 'object': {...}}
+    -> (payment_id, event, status, amount). Raises ValueError для некорректного уведомления.
+    """
+    if not isinstance(data, dict) or data.get('type') != 'notification':
+        raise ValueError('Ожидается уведомление с type=notification')
+    event = data.get('event')
+    payment = data.get('object')
+    if not isinstance(event, str) or not isinstance(payment, dict):
+        raise ValueError('Нет event или object')
+    payment_id = payment.get('id')
+    status = payment.get('status')
+    if not payment_id or not isinstance(payment_id, str) or len(payment_id) > 64:
+        raise ValueError('Некорректный object.id')
+    if event.startswith('payment.') and status not in STATUS_RANK:
+        raise ValueError(f'Неизвестный статус платежа: {status}')
+    return payment_id, event, status, parse_amount(payment.get('amount'))
+
+
+def parse_amount(amount):
+    """{'value': '1349.00', ...} -> Decimal; нет суммы или 0 -> None (payments.amount > 0)"""
+    try:
+        value = Decimal(str((amount or {}).get('value')))
+    except (InvalidOperation, AttributeError):
+        return None
+    return value if value.is_finite() and value > 0 else None
+
+
+def is_trusted_source(ip):
+    """Адрес отправителя входит в YOOKASSA_WEBHOOK_IPS"""
+    try:
+        address = ipaddress.ip_address(ip)
+    except (TypeError, ValueError):
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in settings.YOOKASSA_WEBHOOK_IPS)
+
+
+def latest_statuses(events):
+    """[(payment_id, status, amount)] -> {payment_id: (status, amount)} с самым поздним статусом каждого платежа"""
+    latest = {}
+    for payment_id, status, amount in events:
+        current = latest.get(payment_id)
+        if current is None or STATUS_RANK.get(status, -1) >= STATUS_RANK.get(current[0], -1):
+            latest[payment_id] = (status, amount if amount is not None else (current[1] if current else None))
+    return latest
+
+
+class PaymentEventService:
+    """Очередь уведомлений шлюза и статусы платежей в нашей БД"""
+
+    @staticmethod
+    def enqueue(payment_id, event, status, amount, payload):
+        """Поставить уведомление в очередь; False — такое событие по платежу уже было"""
+        with connection.cursor() as cursor:
+            cursor.execute(ENQUEUE_SQL, [
+                payment_id, event, status, amount, json.dumps(payload, ensure_ascii=False, default=str),
+            ])
+            return cursor.rowcount == 1
+
+    @staticmethod
+    def apply_statuses(cursor, statuses):
+        """
+        {payment_id: (status, amount)} -> gateway_payments, orders.payment_status и payments.
+        Возвращает {payment_id: сохранённый статус}.
+        """
+        if not statuses:
+            return {}
+        ids = sorted(statuses)
+        cursor.execute(UPSERT_SQL, [
+            ids, [statuses[pid][0] for pid in ids], [statuses[pid][1] for pid in ids],
+        ])
+        rows = cursor.fetchall()
+        linked = [(order_id, ORDER_PAYMENT_STATUS[status]) for _, status, order_id in rows
+                  if order_id is not None and status in ORDER_PAYMENT_STATUS]
+        if linked:
+            cursor.execute(UPDATE_ORDERS_SQL, [[row[0] for row in linked], [row[1] for row in linked]])
+        succeeded = [payment_id for payment_id, status, order_id in rows if order_id is not None and status == 'succeeded']
+        if succeeded:
+            cursor.execute(INSERT_PAYMENTS_SQL, [succeeded])
+        return {payment_id: status for payment_id, status, _ in rows}
+
+    @staticmethod
+    def record_payment(payment_id, status, amount=None):
+        """Платёж, только что созданный в шлюзе (create_payment)"""
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                return PaymentEventService.apply_statuses(cursor, {payment_id: (status, amount)}).get(payment_id)
+
+    @staticmethod
+    def process_batch(limit=BATCH_SIZE):
+        """Обработать до limit событий очереди одной транзакцией; количество обработанных событий"""
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(CLAIM_SQL, [limit])
+                events = cursor.fetchall()
+                if not events:
+                    return 0
+                statuses = latest_statuses(
+                    (payment_id, status, amount) for _, payment_id, status, amount in events
+                    if status in STATUS_RANK
+                )
+                PaymentEventService.apply_statuses(cursor, statuses)
+                cursor.execute(
+                    'UPDATE payment_events SET processed_at = CURRENT_TIMESTAMP WHERE event_id = ANY(%s)',
+                    [[row[0] for row in events]],
+                )
+        logger.info(f"Уведомления шлюза: обработано {len(events)} событий по {len(statuses)} платежам")
+        return len(events)
+
+    @staticmethod
+    def link_order(payment_id, order_id):
+        """
+        Привязать заказ к платежу (create_order). Онлайн-заказ создаётся в статусе pending;
+        если уведомление пришло раньше заказа, статус оплаты сразу берётся из него.
+        Платёж чужого заказа или с другой суммой не привязывается — заказ остаётся pending.
+        Возвращает статус платежа или None.
+        """
+        if not payment_id:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(LINK_ORDER_SQL, [payment_id, order_id])
+            row = cursor.fetchone()
+            if row is None:
+                logger.warning(f"Платёж {payment_id} не привязан к заказу {order_id}: "
+                               f"нет в gateway_payments, привязан к другому заказу или сумма не совпадает")
+                return None
+            PaymentEventService.apply_statuses(cursor, {payment_id: row})
+            return row[0]
+
+    @staticmethod
+    def get_status(payment_id, gateway):
+        """
+        {'payment_id', 'status', 'amount'} из gateway_payments.
+        Шлюз спрашивается, только если платежа нет в таблице или он дольше STALE_AFTER не в итоговом статусе.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT status, amount, updated_at < CURRENT_TIMESTAMP - %s FROM gateway_payments '
+                'WHERE gateway_payment_id = %s',
+                [STALE_AFTER, payment_id],
+            )
+            row = cursor.fetchone()
+        if row is not None and (row[0] in FINAL_STATUSES or not row[2]):
+            return {'payment_id': payment_id, 'status': row[0], 'amount': row[1]}
+
+        payment = gateway.get_payment(payment_id)
+        amount = parse_amount(payment.get('amount'))
+        if gateway.test_mode:
+            # Тестовый шлюз «оплачивает» любой id — такие ответы в БД не попадают
+            return {'payment_id': payment['id'], 'status': payment['status'], 'amount': amount}
+        status = PaymentEventService.record_payment(payment['id'], payment['status'], amount)
+        return {'payment_id': payment['id'], 'status': status, 'amount': amount}
+
+    @staticmethod
+    def purge(retention=timedelta(days=30)):
+        """Удалить обработанные события старше retention"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM payment_events WHERE processed_at IS NOT NULL AND processed_at < %s',
+                [timezone.now() - retention],
+            )
+            return cursor.rowcount
@@ -0,0 +1,164 @@
+# apps/orders/reservations.py
+"""
+Резервирование остатков между созданием платежа и созданием заказа
+(таблица stock_reservations, РАЗДЕЛ 13 dbSNDshop.sql).
+
+create_payment резервирует количества короткой транзакцией: блокировка строк
+товаров в порядке product_id, сумма активных резервов и вставка резерва.
+Резерв живёт RESERVATION_TTL; create_order по reservation_key превращает его
+в строки заказа (apps/orders/checkout.py) — остаток под резервом не может
+уйти другому покупателю, пока клиент платит. Резервирует только
+авторизованный покупатель, у него не больше одного активного резерва (новый
+снимает предыдущий), а по строке держится не больше MAX_RESERVED_PER_LINE
+штук — одна корзина не может заморозить весь остаток. Просроченные резервы сразу
+перестают учитываться в запросах (expires_at), а команда
+expire_stock_reservations помечает их и удаляет старые записи.
+"""
+import logging
+import uuid
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from apps.orders.checkout import CheckoutError, lock_products, parse_items, stock_errors
+
+logger = logging.getLogger(__name__)
+
+RESERVATION_TTL = timedelta(minutes=15)
+# Сколько хранить завершённые и просроченные резервы
+RESERVATION_RETENTION = timedelta(days=7)
+# Больше этого количество по строке проверяется, но не держится в резерве
+MAX_RESERVED_PER_LINE = 10
+
+ACTIVE = 'active'
+CONVERTED = 'converted'
+EXPIRED = 'expired'
+RELEASED = 'released'
+
+HELD_SQL = """
+    SELECT product_id, SUM(quantity)
+    FROM stock_reservations
+    WHERE product_id = ANY(%s)
+      AND status = 'active'
+      AND expires_at > CURRENT_TIMESTAMP
+      AND hold_key IS DISTINCT FROM %s
+    GROUP BY product_id
+"""
+
+INSERT_SQL = """
+    INSERT INTO stock_reservations (hold_key, product_id, quantity, customer_id, status, created_at, expires_at)
+    SELECT %s, v.product_id, v.quantity, %s, 'active', CURRENT_TIMESTAMP, %s
+    FROM unnest(%s::int[], %s::int[]) AS v (product_id, quantity)
+"""
+
+
+RELEASE_CUSTOMER_SQL = """
+    UPDATE stock_reservations SET status = 'released'
+    WHERE customer_id = %s AND status = 'active'
+"""
+
+
+def held_quantities(cursor, product_ids, exclude_key=None):
+    """
+    {product_id: количество в чужих активных резервах}.
+    Вызывается после lock_products: новый снимок видит резервы, закоммиченные до блокировки.
+    """
+    cursor.execute(HELD_SQL, [list(product_ids), exclude_key])
+    return dict(cursor.fetchall())
+
+
+def convert(cursor, hold_key):
+    """Отметить резерв оформленным (вызывается из take_stock при списании остатков)"""
+    cursor.execute(
+        "UPDATE stock_reservations SET status = 'converted' WHERE hold_key = %s AND status = 'active'",
+        [hold_key],
+    )
+    return cursor.rowcount
+
+
+class StockReservationService:
+    """Резервы остатков на время оплаты"""
+
+    @staticmethod
+    def reserve(items, customer_id, ttl=RESERVATION_TTL):
+        """
+        Зарезервировать строки корзины [{product_id, quantity}] целиком или не резервировать ничего.
+        Предыдущий активный резерв покупателя снимается в той же транзакции.
+
+        Returns:
+            {'reservation_key', 'expires_at', 'items': {product_id: зарезервированное количество}}
+
+        Raises:
+            CheckoutError: пустая корзина, некорректные строки, не хватает свободного остатка
+        """
+        if not items:
+            raise CheckoutError('Корзина пуста. Добавьте товары в корзину перед оформлением заказа.')
+        quantities, errors = parse_items(items)
+        hold_key = uuid.uuid4().hex
+        expires_at = timezone.now() + ttl
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # Параллельные create_payment одного покупателя выполняются по очереди
+                cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [f'reservation:{customer_id}'])
+                cursor.execute(RELEASE_CUSTOMER_SQL, [customer_id])
+                released = cursor.rowcount
+                locked = lock_products(cursor, quantities) if quantities else {}
+                held = held_quantities(cursor, quantities) if quantities else {}
+                errors += stock_errors(quantities, locked, held)
+                if errors:
+                    raise CheckoutError('Ошибки при проверке товаров: ' + '; '.join(errors[:5]), errors[:5])
+                reserved = {pid: min(quantity, MAX_RESERVED_PER_LINE) for pid, quantity in quantities.items()}
+                cursor.execute(INSERT_SQL, [
+                    hold_key, customer_id, expires_at, list(reserved), list(reserved.values()),
+                ])
+
+        logger.info(
+            f"Резерв {hold_key} покупателя {customer_id} до {expires_at:%H:%M:%S}: {reserved}"
+            + (f" (снято строк прежнего резерва: {released})" if released else '')
+        )
+        return {'reservation_key': hold_key, 'expires_at': expires_at, 'items': reserved}
+
+    @staticmethod
+    def release(hold_key):
+        """Снять активный резерв (платёж не создан или отменён)"""
+        if not hold_key:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE stock_reservations SET status = 'released' WHERE hold_key = %s AND status = 'active'",
+                [hold_key],
+            )
+            return cursor.rowcount
+
+    @staticmethod
+    def expire(retention=RESERVATION_RETENTION):
+        """Пометить просроченные резервы и удалить старые неактивные; (просрочено, удалено)"""
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                UPDATE stock_reservations SET status = 'expired'
+                WHERE status = 'active' AND expires_at <= CURRENT_TIMESTAMP
+            """)
+            expired = cursor.rowcount
+            cursor.execute(
+                "DELETE FROM stock_reservations WHERE status <> 'active' AND expires_at < %s",
+                [timezone.now() - retention],
+            )
+            deleted = cursor.rowcount
+        if expired or deleted:
+            logger.info(f"Резервы остатков: просрочено {expired}, удалено {deleted}")
+        return expired, deleted
+
+    @staticmethod
+    def availability(product_ids):
+        """{product_id: (stock_quantity, reserved, available)} из v_product_availability"""
+        if not product_ids:
+            return {}
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT product_id, stock_quantity, reserved, available
+                FROM v_product_availability
+                WHERE product_id = ANY(%s)
+            """, [list(product_ids)])
+            return {row[0]: row[1:] for row in cursor.fetchall()}
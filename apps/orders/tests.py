@@ -1,3 +1,392 @@
-from django.test import TestCase
+import os
+import threading
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.db import connection, connections, transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIRequestFactory
+
+from apps.orders.checkout import (
+    DECREMENT_SQL, LOCK_SQL, CheckoutError, create_order_items, parse_items, take_stock,
+)
+from apps.orders.gateway import CircuitBreaker, GatewayError, GatewayUnavailable, MockGateway, YooKassaGateway
+from apps.orders.gateway_stub import GatewayStub
+from apps.orders.models import Orders
+from apps.orders.payment_events import (
+    LINK_ORDER_SQL, PaymentEventService, latest_statuses, parse_amount, parse_notification,
+)
+from apps.orders.reservations import HELD_SQL, MAX_RESERVED_PER_LINE, RELEASE_CUSTOMER_SQL, StockReservationService
+
+# Тест конкурентного оформления нужен настоящий PostgreSQL (тестовая БД создаётся из settings)
+CONCURRENCY_DB = bool(os.environ.get('CHECKOUT_CONCURRENCY_TEST'))
+
+
+class CheckoutStockTest(SimpleTestCase):
+    "Списание остатков заказа: блокировка, списание и вставка строк — по одному запросу"
+
+    def test_items_are_merged_and_sorted_by_product_id(self):
+        quantities, errors = parse_items([
+            {'product_id': 9, 'quantity': 1},
+            {'product_id': '3', 'quantity': '2'},
+            {'product_id': 9, 'quantity': 2},
+            {'quantity': 1},
+            {'product_id': 4, 'quantity': 0},
+        ])
+
+        self.assertEqual(list(quantities.items()), [(3, 2), (9, 3)])
+        self.assertEqual(errors, ['Товар #3: отсутствует product_id', 'Товар 4: некорректное количество 0'])
+
+    def test_locks_are_taken_in_product_id_order(self):
+        self.assertIn('ORDER BY product_id\n    FOR UPDATE', LOCK_SQL)
+        self.assertIn('p.stock_quantity >= v.quantity', DECREMENT_SQL)
+        self.assertIn('LEFT JOIN updated', DECREMENT_SQL)
+
+    def _take(self, items, locked, remaining, held=(), hold_key=None):
+        with mock.patch('apps.orders.checkout.connection') as conn:
+            cursor = conn.cursor.return_value.__enter__.return_value
+            cursor.fetchall.side_effect = [locked, list(held), remaining]
+            return take_stock(items, hold_key=hold_key), cursor
+
+    def test_three_statements_for_whole_order(self):
+        lines, cursor = self._take(
+            [{'product_id': 5, 'quantity': 1}, {'product_id': 2, 'quantity': 3}],
+            locked=[(2, 'Мышь', Decimal('990.00'), 3), (5, 'Коврик', Decimal('100.00'), 10)],
+            remaining=[(2, 0), (5, 9)],
+        )
+
+        self.assertEqual(cursor.execute.call_count, 3)
+        self.assertEqual(cursor.execute.call_args_list[0].args[1], [[2, 5]])
+        self.assertEqual(cursor.execute.call_args_list[1].args[1], [[2, 5], None])
+        self.assertEqual(cursor.execute.call_args_list[2].args[1], [[2, 5], [3, 1]])
+        self.assertEqual([(line['product_id'], line['remaining']) for line in lines], [(2, 0), (5, 9)])
+
+        with mock.patch('apps.orders.models.OrderItems.objects') as objects:
+            objects.bulk_create.side_effect = lambda rows: rows
+            created, total = create_order_items(Orders(order_id=1), lines, {2: Decimal('900.00'), 5: Decimal('100.00')})
+
+        objects.bulk_create.assert_called_once()
+        self.assertEqual((len(created), total), (2, Decimal('2800.00')))
+
+    def test_shortage_is_reported_per_product_without_decrement(self):
+        with self.assertRaises(CheckoutError) as raised:
+            self._take(
+                [{'product_id': 2, 'quantity': 4}, {'product_id': 7, 'quantity': 1}],
+                locked=[(2, 'Мышь', Decimal('990.00'), 3)],
+                remaining=[],
+            )
+
+        self.assertEqual(raised.exception.details, [
+            'Товар Мышь: недостаточно товара на складе (доступно: 3, запрошено: 4)',
+            'Товар 7: товар не найден',
+        ])
+
+    def test_empty_cart(self):
+        with self.assertRaisesMessage(CheckoutError, 'Корзина пуста'):
+            take_stock([])
+
+
+class StockReservationTest(SimpleTestCase):
+    "Резервы на время оплаты: чужие резервы уменьшают свободный остаток, свой — нет"
+
+    LOCKED = [(2, 'Мышь', Decimal('990.00'), 5)]
+
+    def _reserve(self, items, held, locked=None):
+        with mock.patch('apps.orders.reservations.connection') as conn, \
+                mock.patch('apps.orders.reservations.transaction'):
+            cursor = conn.cursor.return_value.__enter__.return_value
+            cursor.rowcount = 0
+            cursor.fetchall.side_effect = [locked or self.LOCKED, held]
+            return StockReservationService.reserve(items, 7), cursor
+
+    def test_active_unexpired_holds_of_others_are_counted(self):
+        self.assertIn("status = 'active'", HELD_SQL)
+        self.assertIn('expires_at > CURRENT_TIMESTAMP', HELD_SQL)
+        self.assertIn('hold_key IS DISTINCT FROM %s', HELD_SQL)
+
+    def test_reserve_inserts_all_lines_in_one_statement(self):
+        reservation, cursor = self._reserve([{'product_id': 2, 'quantity': 2}], held=[(2, 3)])
+
+        self.assertEqual(cursor.execute.call_count, 5)
+        insert_params = cursor.execute.call_args_list[4].args[1]
+        self.assertEqual(insert_params[0], reservation['reservation_key'])
+        self.assertEqual((insert_params[1], insert_params[3:]), (7, [[2], [2]]))
+        self.assertEqual(reservation['items'], {2: 2})
+
+    def test_previous_hold_of_customer_is_released_first(self):
+        _, cursor = self._reserve([{'product_id': 2, 'quantity': 1}], held=[])
+
+        self.assertIn('pg_advisory_xact_lock', cursor.execute.call_args_list[0].args[0])
+        self.assertEqual(cursor.execute.call_args_list[1].args, (RELEASE_CUSTOMER_SQL, [7]))
+
+    def test_reserved_quantity_is_capped_per_line(self):
+        reservation, cursor = self._reserve(
+            [{'product_id': 2, 'quantity': MAX_RESERVED_PER_LINE + 5}], held=[],
+            locked=[(2, 'Мышь', Decimal('990.00'), 100)],
+        )
+
+        self.assertEqual(reservation['items'], {2: MAX_RESERVED_PER_LINE})
+        self.assertEqual(cursor.execute.call_args_list[4].args[1][4], [MAX_RESERVED_PER_LINE])
+
+    def test_reserve_fails_when_held_by_others(self):
+        with self.assertRaises(CheckoutError) as raised:
+            self._reserve([{'product_id': 2, 'quantity': 3}], held=[(2, 3)])
+
+        self.assertEqual(raised.exception.details, [
+            'Товар Мышь: недостаточно товара на складе (доступно: 2, запрошено: 3)',
+        ])
+
+    def test_take_stock_converts_own_reservation(self):
+        with mock.patch('apps.orders.checkout.connection') as conn:
+            cursor = conn.cursor.return_value.__enter__.return_value
+            cursor.fetchall.side_effect = [self.LOCKED, [], [(2, 2)]]
+            take_stock([{'product_id': 2, 'quantity': 3}], hold_key='abc')
+
+        self.assertEqual(cursor.execute.call_args_list[1].args[1], [[2], 'abc'])
+        self.assertIn("SET status = 'converted'", cursor.execute.call_args_list[3].args[0])
+        self.assertEqual(cursor.execute.call_args_list[3].args[1], ['abc'])
+
+
+class PaymentGatewayTest(SimpleTestCase):
+    "Клиент шлюза против локальной заглушки ЮKassa: пул, повторы, метрики и CircuitBreaker"
+
+    def setUp(self):
+        self.stub = GatewayStub().start()
+        self.gateway = YooKassaGateway(self.stub.url, 'shop', 'secret', pool_size=2, backoff_factor=0)
+
+    def tearDown(self):
+        self.gateway.close()
+        self.stub.stop()
+
+    def test_create_and_get_reuse_connection(self):
+        payment = self.gateway.create_payment(Decimal('1349.00'), 'Заказ', return_url='http://shop/ok/')
+        fetched = self.gateway.get_payment(payment['id'])
+
+        self.assertEqual(payment['amount'], {'value': '1349.00', 'currency': 'RUB'})
+        self.assertTrue(payment['confirmation']['confirmation_url'].startswith('http://shop/ok/?payment_id='))
+        self.assertEqual((fetched['id'], fetched['status']), (payment['id'], 'succeeded'))
+        self.assertEqual((self.stub.counters['connections'], self.stub.counters['requests']), (1, 2))
+
+    def test_post_is_retried_with_same_idempotence_key(self):
+        self.stub.fail_next(2, status=503)
+
+        first = self.gateway.create_payment(100, 'Заказ', idempotence_key='key-1')
+        again = self.gateway.create_payment(100, 'Заказ', idempotence_key='key-1')
+
+        self.assertEqual(first['id'], again['id'])
+        self.assertEqual(
+            (self.stub.counters['requests'], self.stub.counters['created'], self.stub.counters['replayed']), (4, 1, 1)
+        )
+        operation = self.gateway.stats()['operations']['create_payment']
+        self.assertEqual((operation['calls'], operation['retries'], operation['errors']), (2, 2, 0))
+
+    def test_client_errors_are_not_retried(self):
+        with self.assertRaises(GatewayError) as raised:
+            self.gateway.get_payment('missing')
+
+        self.assertEqual((raised.exception.status_code, self.stub.counters['requests']), (404, 1))
+        self.assertEqual(self.gateway.breaker.state, 'closed')
+
+    def test_breaker_opens_and_skips_network(self):
+        now = [0.0]
+        self.gateway.breaker = CircuitBreaker(threshold=2, reset_timeout=30, clock=lambda: now[0])
+        self.stub.fail_next(8, status=500)
+
+        for _ in range(2):
+            with self.assertRaises(GatewayUnavailable):
+                self.gateway.get_payment('x')
+        requests_made = self.stub.counters['requests']
+        with self.assertRaisesMessage(GatewayUnavailable, 'временно недоступен'):
+            self.gateway.get_payment('x')
+
+        self.assertEqual(self.stub.counters['requests'], requests_made)
+        self.assertEqual(self.gateway.breaker.state, 'open')
+        now[0] = 31.0
+        payment = self.gateway.create_payment(10, 'Пробный')
+        self.assertEqual((payment['status'], self.gateway.breaker.state), ('succeeded', 'closed'))
+
+
+def notification(payment_id='2f1a', event='payment.succeeded', status='succeeded', value='1349.00'):
+    return {
+        'type': 'notification',
+        'event': event,
+        'object': {'id': payment_id, 'status': status, 'amount': {'value': value, 'currency': 'RUB'}},
+    }
+
+
+class PaymentEventsTest(SimpleTestCase):
+    "Уведомления шлюза: очередь, пакетное обновление статусов и чтение статуса из БД"
+
+    def test_notification_is_parsed_and_validated(self):
+        self.assertEqual(parse_notification(notification()), ('2f1a', 'payment.succeeded', 'succeeded', Decimal('1349.00')))
+        for bad in ({'type': 'notification'}, notification(status='paid'), notification(payment_id='')):
+            with self.assertRaises(ValueError):
+                parse_notification(bad)
+
+    def test_batch_keeps_latest_status_per_payment(self):
+        statuses = latest_statuses([
+            ('a', 'pending', Decimal('10')),
+            ('a', 'succeeded', None),
+            ('b', 'waiting_for_capture', Decimal('5')),
+            ('a', 'pending', Decimal('10')),
+        ])
+
+        self.assertEqual(statuses, {'a': ('succeeded', Decimal('10')), 'b': ('waiting_for_capture', Decimal('5'))})
+
+    @override_settings(YOOKASSA_WEBHOOK_IPS=['185.71.76.0/27'])
+    def test_webhook_checks_sender_and_only_enqueues(self):
+        from api.views import payment_webhook
+
+        factory = APIRequestFactory()
+        with mock.patch.object(PaymentEventService, 'enqueue', return_value=True) as enqueue:
+            foreign = payment_webhook(factory.post('/api/payment/webhook/', notification(), format='json'))
+            trusted = payment_webhook(factory.post(
+                '/api/payment/webhook/', notification(), format='json', REMOTE_ADDR='185.71.76.5'
+            ))
+            invalid = payment_webhook(factory.post(
+                '/api/payment/webhook/', {'type': 'other'}, format='json', REMOTE_ADDR='185.71.76.5'
+            ))
+
+        self.assertEqual((foreign.status_code, trusted.status_code, invalid.status_code), (403, 200, 400))
+        enqueue.assert_called_once()
+        self.assertEqual(enqueue.call_args.args[:4], ('2f1a', 'payment.succeeded', 'succeeded', Decimal('1349.00')))
+
+    def test_batch_updates_each_table_once(self):
+        with mock.patch('apps.orders.payment_events.connection') as conn, \
+                mock.patch('apps.orders.payment_events.transaction'):
+            cursor = conn.cursor.return_value.__enter__.return_value
+            cursor.fetchall.side_effect = [
+                [(1, 'a', 'pending', Decimal('10')), (2, 'a', 'succeeded', Decimal('10')), (3, 'b', 'canceled', None)],
+                [('a', 'succeeded', 41), ('b', 'canceled', None)],
+            ]
+            processed = PaymentEventService.process_batch()
+
+        statements = [call.args for call in cursor.execute.call_args_list]
+        self.assertEqual(processed, 3)
+        self.assertEqual(len(statements), 5)
+        self.assertEqual(statements[1][1], [['a', 'b'], ['succeeded', 'canceled'], [Decimal('10'), None]])
+        self.assertEqual(statements[2][1], [[41], ['completed']])
+        self.assertEqual(statements[3][1], [['a']])
+        self.assertEqual(statements[4][1], [[1, 2, 3]])
+
+    def test_status_is_read_from_db_until_stale(self):
+        gateway = mock.Mock(test_mode=False)
+        gateway.get_payment.return_value = {'id': 'a', 'status': 'succeeded', 'amount': {'value': '10.00'}}
+        with mock.patch('apps.orders.payment_events.connection') as conn, \
+                mock.patch.object(PaymentEventService, 'record_payment', return_value='succeeded'):
+            cursor = conn.cursor.return_value.__enter__.return_value
+            cursor.fetchone.side_effect = [('pending', Decimal('10'), False), ('pending', Decimal('10'), True)]
+            fresh = PaymentEventService.get_status('a', gateway)
+            gateway.get_payment.assert_not_called()
+            stale = PaymentEventService.get_status('a', gateway)
+
+        self.assertEqual((fresh['status'], stale['status']), ('pending', 'succeeded'))
+        gateway.get_payment.assert_called_once_with('a')
+
+
+    def test_mock_gateway_lookups_are_not_stored(self):
+        gateway = MockGateway()
+        created = gateway.create_payment(Decimal('1349'), 'Заказ', return_url='http://shop/ok/')
+        with mock.patch('apps.orders.payment_events.connection') as conn, \
+                mock.patch.object(PaymentEventService, 'record_payment') as record:
+            conn.cursor.return_value.__enter__.return_value.fetchone.return_value = None
+            known = PaymentEventService.get_status(created['id'], gateway)
+            unknown = PaymentEventService.get_status('mock_forged', gateway)
+
+        record.assert_not_called()
+        self.assertEqual((known['amount'], unknown['amount']), (Decimal('1349.00'), None))
+        self.assertIsNone(parse_amount({'value': '0.00'}))
+
+    def test_order_is_linked_only_to_free_payment_with_its_amount(self):
+        self.assertIn('g.order_id IS NULL OR g.order_id = o.order_id', LINK_ORDER_SQL)
+        self.assertIn('g.amount = o.total_amount', LINK_ORDER_SQL)
+        with mock.patch('apps.orders.payment_events.connection') as conn, \
+                mock.patch.object(PaymentEventService, 'apply_statuses') as apply_statuses:
+            cursor = conn.cursor.return_value.__enter__.return_value
+            cursor.fetchone.return_value = None
+            status = PaymentEventService.link_order('a', 41)
+
+        self.assertIsNone(status)
+        apply_statuses.assert_not_called()
+        # Заказ создан в pending и не трогается
+        self.assertEqual(cursor.execute.call_count, 1)
+
+    @override_settings(PAYMENT_GATEWAY_MODE='yookassa')
+    def test_mock_flag_is_ignored_outside_mock_mode(self):
+        from api.views import check_payment_status
+
+        gateway = mock.Mock(test_mode=False)
+        request = APIRequestFactory().get('/api/payment/status/', {'payment_id': 'a', 'mock': 'true'})
+        with mock.patch('api.views.get_gateway', return_value=gateway), \
+                mock.patch.object(PaymentEventService, 'get_status', return_value={
+                    'payment_id': 'a', 'status': 'pending', 'amount': None,
+                }) as get_status:
+            response = check_payment_status(request)
+
+        self.assertEqual((response.status_code, response.data['paid']), (200, False))
+        self.assertIs(get_status.call_args.args[1], gateway)
+
+
+@skipUnless(CONCURRENCY_DB, 'CHECKOUT_CONCURRENCY_TEST=1 и доступный PostgreSQL')
+class CheckoutConcurrencyTest(TransactionTestCase):
+    "Встречные заказы с общими товарами не взаимоблокируются и не продают больше остатка"
+
+    databases = {'default'} if CONCURRENCY_DB else set()
+    STOCK = 5
+    BUYERS = 12
+
+    def setUp(self):
+        # products не управляется миграциями — в тестовой БД нужна минимальная таблица
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS products (
+                    product_id INT PRIMARY KEY,
+                    product_name VARCHAR(100),
+                    price NUMERIC(10, 2),
+                    stock_quantity INT
+                )
+            """)
+            cursor.execute('DELETE FROM products')
+            cursor.execute(
+                "INSERT INTO products VALUES (1, 'Мышь', 990, %s), (2, 'Коврик', 100, %s)",
+                [self.STOCK, self.STOCK],
+            )
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS products')
+
+    def test_no_oversell_and_no_deadlock(self):
+        barrier = threading.Barrier(self.BUYERS)
+        results = []
+
+        def buy(index):
+            # Половина покупателей перечисляет товары в обратном порядке
+            items = [{'product_id': 1, 'quantity': 1}, {'product_id': 2, 'quantity': 1}]
+            if index % 2:
+                items.reverse()
+            try:
+                barrier.wait()
+                with transaction.atomic():
+                    take_stock(items)
+                results.append('ok')
+            except CheckoutError:
+                results.append('short')
+            except Exception as e:
+                results.append(repr(e))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=buy, args=(i,)) for i in range(self.BUYERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT product_id, stock_quantity FROM products ORDER BY product_id')
+            stock = cursor.fetchall()
+
+        self.assertEqual(sorted(set(results)), ['ok', 'short'])
+        self.assertEqual(results.count('ok'), self.STOCK)
+        self.assertEqual(stock, [(1, 0), (2, 0)])
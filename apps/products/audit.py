@@ -0,0 +1,82 @@
+# apps/products/audit.py
+"""
+Пакетная запись audit_log для массовых изменений товаров (импорт, bulk-update).
+
+Вместо AuditLog.objects.create() на каждый товар — один INSERT ... SELECT
+внутри того же запроса, что меняет products. Формат записей совпадает с
+ProductViewSet._log_product_change ("Было: Цена: 'x' → 'y'") и с триггером
+fn_audit_product_price_change (PRICE_CHANGE в JSON), который на время
+массовой операции отключается флагом app.skip_row_audit (РАЗДЕЛ 9).
+"""
+
+# Поля, изменения которых попадают в audit_log
+AUDITED_FIELDS = (
+    ('product_name', 'Название'),
+    ('price', 'Цена'),
+    ('stock_quantity', 'Количество'),
+    ('status', 'Статус'),
+)
+
+
+def disable_row_audit(cursor):
+    """Отключить построчный триггер аудита цен до конца текущей транзакции"""
+    cursor.execute("SELECT set_config('app.skip_row_audit', 'on', true)")
+
+
+def _any_changed_sql():
+    return '(' + ' OR '.join(f'c.old_{field} IS DISTINCT FROM c.new_{field}' for field, _ in AUDITED_FIELDS) + ')'
+
+
+def _changes_sql(prefix):
+    parts = [
+        f"CASE WHEN c.old_{field} IS DISTINCT FROM c.new_{field} "
+        f"THEN '{label}: ''' || COALESCE(c.old_{field}::text, '') || ''' → ''' "
+        f"|| COALESCE(c.new_{field}::text, '') || '''' END"
+        for field, label in AUDITED_FIELDS
+    ]
+    return f"'{prefix}' || concat_ws('; ', {', '.join(parts)})"
+
+
+def audit_insert_sql(source, label):
+    """
+    INSERT в audit_log для всех строк CTE source.
+
+    source должен содержать product_id, created (bool) и пары old_<поле>/new_<поле>
+    для AUDITED_FIELDS (old_* — NULL для новых товаров). Пользователь — первый
+    параметр запроса (%s). label — пометка источника: 'импорт', 'массовое обновление'.
+
+    Результат — тело CTE: WITH ..., audit AS (<это>) SELECT ...
+    """
+    return f"""
+        INSERT INTO audit_log (user_id, action_type, table_name, record_id, old_value, new_value, timestamp)
+        SELECT %s, action_type, 'products', product_id, old_value, new_value, CURRENT_TIMESTAMP
+        FROM (
+            SELECT
+                c.product_id,
+                CASE WHEN c.created THEN 'CREATE' ELSE 'UPDATE' END AS action_type,
+                CASE WHEN c.created THEN '' ELSE {_changes_sql(f'Было ({label}): ')} END AS old_value,
+                CASE WHEN c.created
+                     THEN 'Создан товар ({label}): ' || c.new_product_name || ' (Цена: ' || c.new_price
+                          || ', Кол-во: ' || COALESCE(c.new_stock_quantity, 0) || ')'
+                     ELSE {_changes_sql(f'Стало ({label}): ')} END AS new_value
+            FROM {source} c
+            WHERE c.created OR {_any_changed_sql()}
+            UNION ALL
+            SELECT
+                c.product_id,
+                'PRICE_CHANGE',
+                JSONB_BUILD_OBJECT(
+                    'product_id', c.product_id,
+                    'product_name', c.old_product_name,
+                    'old_price', c.old_price,
+                    'change_amount', c.new_price - c.old_price
+                )::TEXT,
+                JSONB_BUILD_OBJECT(
+                    'product_id', c.product_id,
+                    'product_name', c.new_product_name,
+                    'new_price', c.new_price
+                )::TEXT
+            FROM {source} c
+            WHERE NOT c.created AND c.old_price IS DISTINCT FROM c.new_price
+        ) rows
+    """
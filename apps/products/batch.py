@@ -0,0 +1,45 @@
+# apps/products/batch.py
+"""
+Облегчённые карточки товаров по списку id для корзины и оформления заказа.
+
+Один запрос по первичному ключу и только нужные колонки — стоимость
+загрузки корзины зависит от числа товаров в ней, а не от размера каталога.
+price — цена с учётом акции (apps/promotions/pricing.py), base_price — без неё.
+"""
+from apps.products.models import Products
+from apps.promotions.pricing import PriceResolver
+
+MAX_BATCH_IDS = 200
+
+BATCH_FIELDS = ('product_id', 'product_name', 'price', 'stock_quantity', 'images', 'image_url')
+
+
+def slim_product(row, price=None, promotion=None):
+    images = row['images'] or []
+    return {
+        'product_id': row['product_id'],
+        'product_name': row['product_name'],
+        'price': str(row['price'] if price is None else price),
+        'base_price': str(row['price']),
+        'discount': str(promotion.discount) if promotion else None,
+        'stock_quantity': row['stock_quantity'] or 0,
+        'image': images[0] if images else row['image_url'],
+        'is_in_stock': (row['stock_quantity'] or 0) > 0,
+    }
+
+
+def batch_products(ids, resolver=None):
+    """Товары в порядке ids; отсутствующие id пропускаются"""
+    if not ids:
+        return []
+    rows = {
+        row['product_id']: row
+        for row in Products.objects.filter(product_id__in=ids).values(*BATCH_FIELDS)
+    }
+    resolver = resolver or PriceResolver()
+    prices = resolver.prices({product_id: row['price'] for product_id, row in rows.items()})
+    promotions = resolver.promotions(list(rows))
+    return [
+        slim_product(rows[product_id], prices[product_id], promotions.get(product_id))
+        for product_id in ids if product_id in rows
+    ]
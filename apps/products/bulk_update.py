@@ -0,0 +1,175 @@
+# apps/products/bulk_update.py
+"""
+Массовое изменение цен и остатков (выгрузки склада и системы ценообразования).
+
+Все строки применяются одним UPDATE ... FROM (VALUES ...) в одной транзакции.
+Строки товаров блокируются заранее в порядке product_id, поэтому встречные
+пакеты не взаимоблокируются. Если в строке передан row_version, она
+применяется только к этой версии товара (оптимистичная блокировка).
+Аудит — одна вставка в том же запросе (apps/products/audit.py).
+"""
+import logging
+
+from django.db import connection, transaction
+
+from apps.products.audit import AUDITED_FIELDS, audit_insert_sql, disable_row_audit
+from apps.products.importer import BIGINT_MAX, RowError, parse_int, parse_price
+from apps.products.signals import products_bulk_changed
+
+logger = logging.getLogger(__name__)
+
+MAX_BULK_ITEMS = 5000
+
+# Статусы строк в ответе
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+NOT_FOUND = 'not_found'
+CONFLICT = 'conflict'
+SUPERSEDED = 'superseded'
+INVALID = 'invalid'
+
+
+def clean_item(item):
+    """{sku|product_id, price, stock_quantity, row_version} -> кортеж для VALUES"""
+    if not isinstance(item, dict):
+        raise RowError('ожидается объект')
+    product_id = parse_int(item.get('product_id'), 'product_id', minimum=1)
+    sku = item.get('sku')
+    sku = str(sku).strip() if sku not in (None, '') else None
+    if product_id is None and not sku:
+        raise RowError('нужен product_id или sku')
+    price = parse_price(item.get('price'))
+    stock_quantity = parse_int(item.get('stock_quantity'), 'stock_quantity', minimum=0)
+    if price is None and stock_quantity is None:
+        raise RowError('нужны price и/или stock_quantity')
+    row_version = parse_int(item.get('row_version'), 'row_version', maximum=BIGINT_MAX)
+    return product_id, sku, price, stock_quantity, row_version
+
+
+def build_bulk_update_sql(count):
+    """UPDATE для count строк VALUES; параметры — 6 на строку, затем user_id для аудита"""
+    first = '(%s::int, %s::int, %s::varchar, %s::numeric, %s::int, %s::bigint)'
+    values = ', '.join([first] + ['(%s, %s, %s, %s, %s, %s)'] * (count - 1))
+    audited = [field for field, _ in AUDITED_FIELDS]
+
+    return f"""
+        WITH v (idx, product_id, sku, price, stock_quantity, row_version) AS (
+            VALUES {values}
+        ),
+        resolved AS (
+            SELECT v.*, COALESCE(by_id.product_id, by_sku.product_id) AS target_id
+            FROM v
+            LEFT JOIN products by_id ON by_id.product_id = v.product_id
+            LEFT JOIN products by_sku ON v.product_id IS NULL AND by_sku.sku = v.sku
+        ),
+        locked AS (
+            SELECT p.product_id, p.row_version, {', '.join(f'p.{field}' for field in audited)}
+            FROM products p
+            WHERE p.product_id IN (SELECT target_id FROM resolved)
+            ORDER BY p.product_id
+            FOR UPDATE
+        ),
+        targets AS (
+            SELECT DISTINCT ON (r.target_id) r.idx, r.target_id, r.price, r.stock_quantity
+            FROM resolved r
+            JOIN locked l ON l.product_id = r.target_id
+            WHERE r.row_version IS NULL OR r.row_version = l.row_version
+            ORDER BY r.target_id, r.idx DESC
+        ),
+        updated AS (
+            UPDATE products p
+            SET price = COALESCE(t.price, p.price),
+                stock_quantity = COALESCE(t.stock_quantity, p.stock_quantity)
+            FROM targets t
+            WHERE p.product_id = t.target_id
+              AND (p.price IS DISTINCT FROM COALESCE(t.price, p.price)
+                   OR p.stock_quantity IS DISTINCT FROM COALESCE(t.stock_quantity, p.stock_quantity))
+            RETURNING p.product_id, t.idx, p.row_version, {', '.join(f'p.{field}' for field in audited)}
+        ),
+        changes AS (
+            SELECT u.product_id, FALSE AS created,
+                {', '.join(f'l.{field} AS old_{field}, u.{field} AS new_{field}' for field in audited)}
+            FROM updated u
+            JOIN locked l ON l.product_id = u.product_id
+        ),
+        audit AS ({audit_insert_sql('changes', 'массовое обновление')})
+        SELECT r.idx, r.target_id, l.row_version, t.idx IS NOT NULL, u.row_version
+        FROM resolved r
+        LEFT JOIN locked l ON l.product_id = r.target_id
+        LEFT JOIN targets t ON t.idx = r.idx
+        LEFT JOIN updated u ON u.idx = r.idx
+        ORDER BY r.idx
+    """
+
+
+def _row_result(target_id, current_version, applied, new_version, expected_version):
+    if target_id is None:
+        return {'status': NOT_FOUND}
+    if new_version is not None:
+        return {'status': UPDATED, 'product_id': target_id, 'row_version': new_version}
+    if applied:
+        return {'status': UNCHANGED, 'product_id': target_id, 'row_version': current_version}
+    if expected_version is not None and expected_version != current_version:
+        return {'status': CONFLICT, 'product_id': target_id, 'row_version': current_version}
+    # Товар встретился в пакете несколько раз — применена последняя строка
+    return {'status': SUPERSEDED, 'product_id': target_id}
+
+
+class ProductBulkUpdateService:
+    """Пакетное обновление price/stock_quantity одним запросом"""
+
+    @staticmethod
+    def apply(items, user_id=None, all_or_nothing=False):
+        """
+        Args:
+            items: список {sku|product_id, price, stock_quantity, row_version}
+            all_or_nothing: откатить всё, если хоть одна строка не применена
+
+        Returns:
+            {'results': [{'index', 'status', ...}], 'summary': {статус: количество}, 'applied': bool}
+        """
+        if not isinstance(items, list):
+            raise ValueError('Ожидается список строк')
+        if len(items) > MAX_BULK_ITEMS:
+            raise ValueError(f'Не больше {MAX_BULK_ITEMS} строк за запрос')
+
+        results = [None] * len(items)
+        params = []
+        expected_versions = {}
+        for index, item in enumerate(items):
+            try:
+                cleaned = clean_item(item)
+            except RowError as e:
+                results[index] = {'index': index, 'status': INVALID, 'error': str(e)}
+                continue
+            params.extend((index,) + cleaned)
+            expected_versions[index] = cleaned[-1]
+
+        applied = True
+        if expected_versions:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    disable_row_audit(cursor)
+                    cursor.execute(build_bulk_update_sql(len(expected_versions)), params + [user_id])
+                    for index, target_id, current_version, row_applied, new_version in cursor.fetchall():
+                        results[index] = {
+                            'index': index,
+                            **_row_result(target_id, current_version, row_applied, new_version, expected_versions[index]),
+                        }
+
+                if all_or_nothing and any(r['status'] not in (UPDATED, UNCHANGED) for r in results):
+                    transaction.set_rollback(True)
+                    applied = False
+                else:
+                    changed = [r['product_id'] for r in results if r['status'] == UPDATED]
+                    if changed:
+                        products_bulk_changed.send(sender=ProductBulkUpdateService, product_ids=changed)
+        elif all_or_nothing and results:
+            applied = False
+
+        summary = {}
+        for result in results:
+            summary[result['status']] = summary.get(result['status'], 0) + 1
+
+        logger.info(f"Массовое обновление товаров: {len(items)} строк, {summary}, applied={applied}")
+        return {'results': results, 'summary': summary, 'applied': applied}
@@ -0,0 +1,139 @@
+# apps/products/categories.py
+"""
+Дерево категорий на материализованном пути (РАЗДЕЛ 11 dbSNDshop.sql).
+
+categories.path — '/1/5/12/' (id предков и самой категории), поэтому
+«товары в поддереве» — один подзапрос с диапазоном по индексу path
+независимо от глубины, а всё дерево читается одним запросом ORDER BY path.
+Путь поддерживают триггеры; rebuild_paths() пересобирает его рекурсивным
+CTE (команда rebuild_category_paths).
+"""
+import logging
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+
+logger = logging.getLogger(__name__)
+
+TREE_CACHE_KEY = 'categories:tree'
+TREE_CACHE_TTL = 3600
+
+# Категории из поддеревьев; сами категории добавляются и без path (до пересборки)
+SUBTREE_SQL = """
+    SELECT c.category_id
+    FROM categories r
+    JOIN categories c ON c.path >= r.path AND c.path < r.path || '~'
+    WHERE r.category_id = ANY(%s)
+    UNION
+    SELECT unnest(%s::int[])
+"""
+
+REBUILD_SQL = """
+    WITH RECURSIVE tree AS (
+        SELECT category_id, '/' || category_id || '/' AS path, 0 AS depth
+        FROM categories
+        WHERE parent_id IS NULL
+        UNION ALL
+        SELECT c.category_id, t.path || c.category_id || '/', t.depth + 1
+        FROM categories c
+        JOIN tree t ON c.parent_id = t.category_id
+    ),
+    updated AS (
+        UPDATE categories c
+        SET path = t.path, depth = t.depth
+        FROM tree t
+        WHERE c.category_id = t.category_id
+          AND (c.path IS DISTINCT FROM t.path OR c.depth IS DISTINCT FROM t.depth)
+        RETURNING c.category_id
+    )
+    SELECT
+        (SELECT COUNT(*) FROM updated),
+        ARRAY(
+            SELECT category_id FROM categories
+            WHERE category_id NOT IN (SELECT category_id FROM tree)
+            ORDER BY category_id
+        )
+"""
+
+
+def subtree_filter(queryset, category_ids):
+    """Товары категорий category_ids и всех их подкатегорий"""
+    category_ids = list(category_ids)
+    return queryset.filter(category_id__in=RawSQL(SUBTREE_SQL, [category_ids, category_ids]))
+
+
+def rebuild_paths():
+    """
+    Пересчитать path/depth всех категорий от корней.
+
+    Returns:
+        {'updated': число изменённых строк, 'unreachable': [id категорий в цикле parent_id]}
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(REBUILD_SQL)
+            updated, unreachable = cursor.fetchone()
+    if updated:
+        invalidate_tree()
+    if unreachable:
+        logger.warning(f"Категории вне дерева (цикл parent_id): {unreachable}")
+    logger.info(f"Пути категорий пересобраны: изменено {updated}")
+    return {'updated': updated, 'unreachable': list(unreachable)}
+
+
+def build_tree(rows):
+    """
+    Строки (category_id, category_name, parent_id, template, depth), упорядоченные
+    по path, -> вложенный список; родитель всегда идёт раньше потомков.
+    """
+    nodes = {}
+    roots = []
+    for category_id, category_name, parent_id, template, depth in rows:
+        node = {
+            'category_id': category_id,
+            'category_name': category_name,
+            'template': template,
+            'depth': depth,
+            'children': [],
+        }
+        nodes[category_id] = node
+        parent = nodes.get(parent_id)
+        if parent is not None:
+            parent['children'].append(node)
+        else:
+            roots.append(node)
+    return roots
+
+
+def get_tree():
+    tree = cache.get(TREE_CACHE_KEY)
+    if tree is None:
+        from apps.products.models import Categories
+
+        rows = (
+            Categories.objects
+            .order_by('path', 'category_id')
+            .values_list('category_id', 'category_name', 'parent_id', 'template', 'depth')
+        )
+        tree = build_tree(rows)
+        cache.set(TREE_CACHE_KEY, tree, TREE_CACHE_TTL)
+    return tree
+
+
+def invalidate_tree(**kwargs):
+    """Сбросить кэш дерева (принимает аргументы сигналов)"""
+    cache.delete(TREE_CACHE_KEY)
+
+
+def on_category_changed(**kwargs):
+    transaction.on_commit(invalidate_tree)
+
+
+def connect_signals():
+    from django.db.models.signals import post_delete, post_save
+
+    from apps.products.models import Categories
+
+    post_save.connect(on_category_changed, sender=Categories, dispatch_uid='category_tree_saved')
+    post_delete.connect(on_category_changed, sender=Categories, dispatch_uid='category_tree_deleted')
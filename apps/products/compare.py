@@ -0,0 +1,155 @@
+# apps/products/compare.py
+"""
+Сравнение товаров (/api/products/compare/?ids=).
+
+Товары загружаются одним запросом, их specifications выравниваются по
+ключам шаблона категории (static/json_templates, facets.load_spec_templates)
+и складываются в матрицу «характеристика × товар» с пометкой отличающихся
+строк. Товары разных шаблонов сравниваются в отдельных группах.
+
+Ответ кэшируется по отсортированному набору id и версиям товаров
+(row_version и агрегаты отзывов): любое изменение товара даёт новый ключ,
+а старая запись просто истекает. Тот же отпечаток служит ETag (вместе с
+pricing_token: цены со скидками дописываются к ответу после кэша).
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+
+from apps.products.facets import load_spec_templates
+from apps.products.filters import SPEC_KEY_ALIASES
+from apps.products.models import Products
+from apps.promotions.pricing import pricing_token
+
+MAX_COMPARE_IDS = 10
+COMPARE_CACHE_PREFIX = 'product_compare'
+COMPARE_CACHE_TTL = 600
+NO_TEMPLATE = 'other'
+# Ключи спецификаций, которые показываются отдельными полями карточки
+EXCLUDED_SPEC_KEYS = {'brand'}
+
+COMPARE_FIELDS = (
+    'product_id', 'product_name', 'price', 'stock_quantity', 'images', 'image_url', 'specifications',
+    'category__category_name', 'category__template', 'brand__brand_name',
+    'rating_stats__review_count', 'rating_stats__rating_sum',
+)
+VERSION_FIELDS = ('product_id', 'row_version', 'rating_stats__review_count', 'rating_stats__rating_sum')
+
+
+def compare_signature(versions):
+    """Отпечаток набора: строки (product_id, row_version, review_count, rating_sum) в любом порядке"""
+    raw = ','.join(
+        f'{product_id}:{row_version or 0}:{review_count or 0}.{rating_sum or 0}'
+        for product_id, row_version, review_count, rating_sum in sorted(versions)
+    )
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def _spec_value(value):
+    if isinstance(value, str):
+        value = value.strip()
+    return None if value in ('', None, [], {}) else value
+
+
+def _comparable(value):
+    if isinstance(value, str):
+        return value.casefold()
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+def _normalized_specs(specifications):
+    if not isinstance(specifications, dict):
+        return {}
+    specs = {}
+    for key, value in specifications.items():
+        key = SPEC_KEY_ALIASES.get(key, key)
+        value = _spec_value(value)
+        if key not in EXCLUDED_SPEC_KEYS and value is not None:
+            specs.setdefault(key, value)
+    return specs
+
+
+def _card(row):
+    images = row['images'] or []
+    review_count = row['rating_stats__review_count'] or 0
+    return {
+        'product_id': row['product_id'],
+        'product_name': row['product_name'],
+        'price': str(row['price']),
+        'image': images[0] if images else row['image_url'],
+        'is_in_stock': (row['stock_quantity'] or 0) > 0,
+        'brand_name': row['brand__brand_name'],
+        'category_name': row['category__category_name'],
+        'rating': round(float(row['rating_stats__rating_sum']) / review_count, 1) if review_count else None,
+        'review_count': review_count,
+    }
+
+
+def _attribute_rows(keys, specs_list):
+    rows = []
+    for key in keys:
+        values = [specs.get(key) for specs in specs_list]
+        if all(value is None for value in values):
+            continue
+        distinct = {None if value is None else _comparable(value) for value in values}
+        rows.append({'key': key, 'values': values, 'differs': len(distinct) > 1})
+    return rows
+
+
+def build_comparison(rows, ids):
+    """
+    Строки Products.values(*COMPARE_FIELDS) -> {'products': [...], 'groups': [...]}
+
+    Группа — товары одного шаблона: ключи шаблона в его порядке, затем
+    остальные встреченные ключи по алфавиту; в values — значения в порядке
+    product_ids (None, если у товара характеристики нет).
+    """
+    templates = load_spec_templates()
+    by_id = {row['product_id']: row for row in rows}
+    ordered = [by_id[product_id] for product_id in ids if product_id in by_id]
+
+    groups = {}
+    for row in ordered:
+        template = (row['category__template'] or NO_TEMPLATE).lower()
+        groups.setdefault(template, []).append(row)
+
+    result = []
+    for template, members in groups.items():
+        specs_list = [_normalized_specs(row['specifications']) for row in members]
+        keys = [key for key in templates.get(template, ()) if key not in EXCLUDED_SPEC_KEYS]
+        extra = sorted({key for specs in specs_list for key in specs} - set(keys))
+        attributes = _attribute_rows(keys + extra, specs_list)
+        prices = {row['price'] for row in members}
+        result.append({
+            'template': template,
+            'product_ids': [row['product_id'] for row in members],
+            'price_differs': len(prices) > 1,
+            'attributes': attributes,
+            'differing_count': sum(1 for attribute in attributes if attribute['differs']),
+        })
+
+    return {'products': [_card(row) for row in ordered], 'groups': result}
+
+
+def get_comparison(ids):
+    """
+    (данные, etag) для сравнения товаров ids; etag None, если ни одного товара нет.
+    Проверка версий — один запрос по первичному ключу, при промахе кэша —
+    ещё один запрос за данными.
+    """
+    if not ids:
+        return {'products': [], 'groups': []}, None
+    versions = list(Products.objects.filter(product_id__in=ids).values_list(*VERSION_FIELDS))
+    if not versions:
+        return {'products': [], 'groups': []}, None
+
+    signature = compare_signature(versions)
+    # Порядок колонок задаёт клиент: он входит в ключ, но не в отпечаток товаров
+    key = f"{COMPARE_CACHE_PREFIX}:{signature}:{','.join(map(str, ids))}"
+    data = cache.get(key)
+    if data is None:
+        rows = Products.objects.filter(product_id__in=ids).values(*COMPARE_FIELDS)
+        data = build_comparison(rows, ids)
+        cache.set(key, data, COMPARE_CACHE_TTL)
+    return data, f'"c{signature}-{pricing_token()}"'
@@ -0,0 +1,107 @@
+# apps/products/conditional.py
+"""
+Условные GET-запросы для /api/products/ (ETag / Last-Modified).
+
+Карточка товара получает сильный ETag из row_version, который увеличивает
+триггер trg_update_product_row_version, и агрегатов отзывов. Список получает
+слабый ETag из состояния каталога — max(updated_at) товаров и агрегатов
+отзывов и счётчика catalog_version (удаления, бренды, категории; РАЗДЕЛ 16
+dbSNDshop.sql) — и набора параметров запроса. Снимок каталога в памяти
+(apps/products/snapshot.py) хранит то же состояние и считает ETag той же
+функцией list_etag, поэтому URL получает один ETag на обоих путях.
+В оба входит pricing_token(): цены со скидками меняются вместе с датой и акциями.
+Проверка стоит один запрос по индексу; при совпадении ответ 304 отдаётся
+без сериализации.
+"""
+import hashlib
+import json
+
+from django.db import connection
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from apps.promotions.pricing import pricing_token
+
+
+def _timestamp(value):
+    return int(value.timestamp()) if value else None
+
+
+def _params_signature(params):
+    signature = sorted((name, sorted(values)) for name, values in params.lists())
+    return json.dumps(signature, ensure_ascii=False)
+
+
+def product_validators(queryset, pk):
+    """
+    (etag, last_modified) карточки товара или (None, None), если товара нет.
+    В ETag входят агрегаты отзывов: рейтинг — часть ответа, но не строки products.
+    """
+    try:
+        pk = int(pk)
+    except (TypeError, ValueError):
+        return None, None
+    row = queryset.model.objects.filter(pk=pk).values_list(
+        'row_version', 'updated_at', 'rating_stats__review_count', 'rating_stats__rating_sum'
+    ).first()
+    if row is None:
+        return None, None
+    row_version, updated_at, review_count, rating_sum = row
+    etag = f'"p{pk}-v{row_version or 0}-r{review_count or 0}.{rating_sum or 0}-{pricing_token()}"'
+    return etag, _timestamp(updated_at)
+
+
+CATALOG_STATE_SQL = """
+    SELECT
+        (SELECT max(updated_at) FROM products),
+        (SELECT max(updated_at) FROM product_rating_stats),
+        v.version,
+        v.updated_at
+    FROM catalog_version v
+    WHERE v.id = 1
+"""
+
+
+def catalog_state():
+    """(max updated_at товаров, max updated_at отзывов, версия, время версии) — три чтения по индексу"""
+    with connection.cursor() as cursor:
+        cursor.execute(CATALOG_STATE_SQL)
+        return cursor.fetchone()
+
+
+def list_etag(state, params):
+    """(etag, last_modified) списка по состоянию каталога и параметрам запроса"""
+    if state is None:
+        return None, None
+    fingerprint = '|'.join([str(value) for value in state] + [_params_signature(params), pricing_token()])
+    etag = f'W/"{hashlib.md5(fingerprint.encode("utf-8")).hexdigest()}"'
+    products_modified, ratings_modified, _, version_modified = state
+    newest = max(filter(None, [products_modified, ratings_modified, version_modified]), default=None)
+    return etag, _timestamp(newest)
+
+
+def list_validators(params):
+    """(etag, last_modified) списка товаров по текущему состоянию каталога в БД"""
+    return list_etag(catalog_state(), params)
+
+
+def not_modified(request, etag, last_modified):
+    """HttpResponseNotModified (304), если у клиента актуальная версия, иначе None"""
+    if etag is None:
+        return None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    """Заголовки ETag/Last-Modified; no-cache заставляет браузер перепроверять ответ"""
+    if etag is None or response.status_code != 200:
+        return response
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    return response
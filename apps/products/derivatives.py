@@ -0,0 +1,160 @@
+# apps/products/derivatives.py
+"""
+Уменьшенные копии изображений товаров (WebP фиксированной ширины).
+
+Загрузка сохраняет только оригинал; копии строятся Pillow в пуле процессов
+после COMMIT, вне запроса. Имена копий содержат sha256 оригинала, поэтому
+одинаковые файлы обрабатываются один раз, а готовые копии не пересоздаются.
+
+Результат хранится в products.image_variants:
+    {"/media/products/a.jpg": {"320": "/media/derivatives/ab/ab…-320.webp", ...}}
+и отдаётся в API как image_srcset — готовая строка для <img srcset>.
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_WIDTHS = (320, 640, 1024)
+WEBP_QUALITY = 80
+DERIVATIVES_DIR = 'derivatives'
+POOL_WORKERS = 2
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_pool = None
+_pool_pid = None
+
+
+def file_digest(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def build_derivatives(source_path, output_root, widths=DERIVATIVE_WIDTHS, quality=WEBP_QUALITY, force=False):
+    """
+    Построить WebP-копии файла. Выполняется в дочернем процессе, поэтому
+    не трогает Django: на входе и выходе только пути.
+
+    Копии шире оригинала не создаются — вместо них одна копия исходной ширины.
+    Уже существующие файлы пропускаются, force=True перезаписывает их.
+
+    Returns:
+        {ширина: путь относительно output_root}
+    """
+    from PIL import Image, ImageOps
+
+    digest = file_digest(source_path)
+    subdir = os.path.join(DERIVATIVES_DIR, digest[:2])
+    os.makedirs(os.path.join(output_root, subdir), exist_ok=True)
+
+    result = {}
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if image.mode in ('LA', 'P', 'PA') else 'RGB')
+
+        for width in sorted(widths):
+            target_width = min(width, image.width)
+            relative = os.path.join(subdir, f'{digest}-{target_width}.webp')
+            absolute = os.path.join(output_root, relative)
+            if force or not os.path.exists(absolute):
+                height = max(1, round(image.height * target_width / image.width))
+                resized = image if target_width == image.width else image.resize((target_width, height), Image.LANCZOS)
+                tmp_path = f'{absolute}.{os.getpid()}.tmp'
+                resized.save(tmp_path, 'WEBP', quality=quality, method=4)
+                os.replace(tmp_path, absolute)
+            result[target_width] = relative
+            if target_width == image.width:
+                break
+    return result
+
+
+def media_path(url):
+    """URL из MEDIA_URL -> путь к файлу; внешние ссылки -> None"""
+    if not isinstance(url, str) or not url.startswith(settings.MEDIA_URL):
+        return None
+    path = os.path.normpath(os.path.join(settings.MEDIA_ROOT, url[len(settings.MEDIA_URL):]))
+    if not path.startswith(os.path.normpath(str(settings.MEDIA_ROOT)) + os.sep):
+        return None
+    return path
+
+
+def variants_for(url):
+    """
+    Синхронно построить копии для одного URL (команда дозаполнения).
+    Returns: {"320": "/media/...webp", ...} или None
+    """
+    path = media_path(url)
+    if not path or not os.path.exists(path):
+        return None
+    return _to_urls(build_derivatives(path, str(settings.MEDIA_ROOT)))
+
+
+def _to_urls(derivatives):
+    media_url = settings.MEDIA_URL
+    return {str(width): f"{media_url}{relative.replace(os.sep, '/')}" for width, relative in derivatives.items()}
+
+
+def srcset(variants):
+    """{"320": url, "640": url} -> 'url 320w, url 640w'"""
+    if not variants:
+        return None
+    return ', '.join(f'{url} {width}w' for width, url in sorted(variants.items(), key=lambda item: int(item[0])))
+
+
+def get_pool():
+    """Пул процессов текущего воркера (spawn: дочерние процессы не наследуют соединения с БД)"""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def store_product_variants(product_id, url, variants):
+    """Дописать копии одного изображения в products.image_variants, если оно ещё у товара"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            UPDATE products
+            SET image_variants = COALESCE(image_variants, '{}'::jsonb) || jsonb_build_object(%s::text, %s::jsonb)
+            WHERE product_id = %s AND images ? %s
+        """, [url, json.dumps(variants), product_id, url])
+
+
+def _on_built(product_id, url, future):
+    try:
+        store_product_variants(product_id, url, _to_urls(future.result()))
+    except Exception as e:
+        logger.error(f"Не удалось построить копии {url} для товара {product_id}: {e}")
+    finally:
+        # Колбэк выполняется в служебном потоке пула — своё соединение закрываем сразу
+        connection.close()
+
+
+def schedule_product_derivatives(product_id, urls):
+    """
+    Поставить в очередь построение копий после COMMIT текущей транзакции.
+    Запрос не ждёт Pillow: копии появятся в image_variants через секунды.
+    """
+    jobs = [(url, media_path(url)) for url in urls]
+    jobs = [(url, path) for url, path in jobs if path]
+    if not jobs:
+        return
+
+    def submit():
+        pool = get_pool()
+        for url, path in jobs:
+            future = pool.submit(build_derivatives, path, str(settings.MEDIA_ROOT))
+            future.add_done_callback(lambda f, url=url: _on_built(product_id, url, f))
+
+    transaction.on_commit(submit)
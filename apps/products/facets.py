@@ -0,0 +1,193 @@
+# apps/products/facets.py
+"""
+Счётчики для фильтров каталога (/api/products/facets/).
+
+Для текущего набора фильтров (те же параметры, что у /api/products/)
+одним сгруппированным запросом считается количество товаров по брендам,
+категориям, ценовым диапазонам, наличию и ключам спецификаций из шаблонов
+static/json_templates/*.json. Результат кэшируется по сигнатуре фильтров.
+"""
+import hashlib
+import json
+import logging
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+
+from apps.products.filters import SPEC_KEY_ALIASES, _split_strings, filter_products
+
+logger = logging.getLogger(__name__)
+
+FACETS_CACHE_PREFIX = 'product_facets'
+FACETS_CACHE_TIMEOUT = 60
+# Границы ценовых диапазонов, ₽
+PRICE_BUCKETS = (5000, 10000, 25000, 50000, 100000, 200000)
+# Ключи шаблонов, для которых счётчики не нужны (бренд считается отдельно)
+EXCLUDED_SPEC_KEYS = {'brand'}
+MAX_VALUES_PER_FACET = 50
+# Параметры, которые не меняют набор товаров
+IGNORED_PARAMS = {'cursor', 'page_size', 'sort', 'limit'}
+
+TEMPLATES_DIR = settings.BASE_DIR / 'static' / 'json_templates'
+
+
+@lru_cache(maxsize=1)
+def load_spec_templates():
+    """{template: (ключи спецификаций)} из static/json_templates/*.json"""
+    templates = {}
+    for path in sorted(TEMPLATES_DIR.glob('*.json')):
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать шаблон {path.name}: {e}")
+            continue
+        template = str(data.get('type') or path.stem).lower()
+        templates[template] = tuple(
+            key for key in (data.get('specs') or {}) if key not in EXCLUDED_SPEC_KEYS
+        )
+    return templates
+
+
+def spec_keys_for(params):
+    """Ключи спецификаций для выбранных шаблонов (?template=), иначе — всех шаблонов"""
+    templates = load_spec_templates()
+    selected = _split_strings(params.get('template')) or list(templates)
+    keys = []
+    for template in selected:
+        for key in templates.get(template.lower(), ()):
+            if key not in keys:
+                keys.append(key)
+    return keys
+
+
+def cache_key(params):
+    """Ключ кэша: отсортированные значимые параметры запроса"""
+    signature = sorted(
+        (name, sorted(values))
+        for name, values in params.lists()
+        if name not in IGNORED_PARAMS
+    )
+    digest = hashlib.md5(json.dumps(signature, ensure_ascii=False).encode('utf-8')).hexdigest()
+    return f'{FACETS_CACHE_PREFIX}:{digest}'
+
+
+def _facets_sql(queryset, spec_keys):
+    """
+    SQL подсчёта: отфильтрованные товары разворачиваются в пары
+    (facet, value, label) через LATERAL и группируются один раз.
+    Массивы в спецификациях (ports) считаются по элементам.
+    """
+    filtered = (
+        queryset.order_by()
+        .annotate(facet_brand_name=F('brand__brand_name'), facet_category_name=F('category__category_name'))
+        .values('brand_id', 'category_id', 'price', 'stock_quantity', 'specifications',
+                'facet_brand_name', 'facet_category_name')
+    )
+    filtered_sql, filtered_params = filtered.query.sql_with_params()
+    # Ключи спецификаций вместе со старыми синонимами (size -> diagonal)
+    lookup_keys = list(spec_keys) + [old for old, new in SPEC_KEY_ALIASES.items() if new in spec_keys]
+
+    sql = f"""
+        WITH filtered AS ({filtered_sql})
+        SELECT f.facet, f.value, MAX(f.label) AS label, COUNT(*) AS cnt
+        FROM filtered p
+        CROSS JOIN LATERAL (
+            SELECT 'brand', p.brand_id::text, p.facet_brand_name
+            WHERE p.brand_id IS NOT NULL
+            UNION ALL
+            SELECT 'category', p.category_id::text, p.facet_category_name
+            WHERE p.category_id IS NOT NULL
+            UNION ALL
+            SELECT 'price', width_bucket(p.price, %s::numeric[])::text, NULL
+            UNION ALL
+            SELECT 'stock', CASE WHEN p.stock_quantity > 0 THEN 'in_stock' ELSE 'out_of_stock' END, NULL
+            UNION ALL
+            SELECT 'spec:' || s.key, NULLIF(BTRIM(v.value, ' "'''), ''), NULL
+            FROM jsonb_each(COALESCE(p.specifications, '{{}}'::jsonb)) AS s(key, val)
+            CROSS JOIN LATERAL (
+                SELECT jsonb_array_elements_text(s.val)
+                WHERE jsonb_typeof(s.val) = 'array'
+                UNION ALL
+                SELECT s.val #>> '{{}}'
+                WHERE jsonb_typeof(s.val) IN ('string', 'number', 'boolean')
+            ) AS v(value)
+            WHERE s.key = ANY(%s)
+        ) AS f(facet, value, label)
+        WHERE f.value IS NOT NULL
+        GROUP BY f.facet, f.value
+    """
+    return sql, list(filtered_params) + [list(PRICE_BUCKETS), lookup_keys]
+
+
+def _price_range(bucket):
+    """Номер диапазона width_bucket -> границы {min, max}"""
+    bounds = (0,) + PRICE_BUCKETS + (None,)
+    return {'min': bounds[bucket], 'max': bounds[bucket + 1]}
+
+
+def _build_facets(rows, spec_keys):
+    brands, categories, prices = [], [], []
+    stock = {'in_stock': 0, 'out_of_stock': 0}
+    specs = {key: {} for key in spec_keys}
+
+    for facet, value, label, count in rows:
+        if facet == 'brand':
+            brands.append({'id': int(value), 'name': label, 'count': count})
+        elif facet == 'category':
+            categories.append({'id': int(value), 'name': label, 'count': count})
+        elif facet == 'price':
+            prices.append({**_price_range(int(value)), 'count': count})
+        elif facet == 'stock':
+            stock[value] = count
+        else:
+            key = facet[len('spec:'):]
+            key = SPEC_KEY_ALIASES.get(key, key)
+            values = specs.setdefault(key, {})
+            values[value] = values.get(value, 0) + count
+
+    by_count = lambda item: (-item['count'], item['name'] or '')
+    return {
+        'brand': sorted(brands, key=by_count),
+        'category': sorted(categories, key=by_count),
+        'price': sorted(prices, key=lambda item: item['min']),
+        'stock': stock,
+        'specs': {
+            key: [
+                {'value': value, 'count': count}
+                for value, count in sorted(values.items(), key=lambda item: (-item[1], item[0]))[:MAX_VALUES_PER_FACET]
+            ]
+            for key, values in specs.items()
+            if values
+        },
+    }
+
+
+def get_facets(queryset, params):
+    """
+    Счётчики фильтров для товаров, подходящих под params.
+
+    Счётчики считаются с учётом всех выбранных фильтров, включая фильтры
+    по спецификациям (?specs.ram=16GB).
+
+    Returns:
+        dict: {'total', 'brand', 'category', 'price', 'stock', 'specs'}
+    """
+    key = cache_key(params)
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    spec_keys = spec_keys_for(params)
+    sql, sql_params = _facets_sql(filter_products(queryset, params), spec_keys)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, sql_params)
+        rows = cursor.fetchall()
+
+    result = _build_facets(rows, spec_keys)
+    result['total'] = result['stock']['in_stock'] + result['stock']['out_of_stock']
+    cache.set(key, result, FACETS_CACHE_TIMEOUT)
+    return result
@@ -0,0 +1,212 @@
+# apps/products/filters.py
+"""
+Серверная фильтрация и сортировка списка товаров (/api/products/).
+
+Все фильтры превращаются в условия WHERE по колонкам products, покрытым
+индексами idx_products_category_status, idx_products_price,
+idx_products_brand_price и idx_products_category_price, и сочетаются
+с курсорной пагинацией (api.pagination.ProductCursorPagination).
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+
+from apps.products.categories import subtree_filter
+from apps.products.importer import MAX_PRICE
+from apps.products.search import filter_by_text, normalize_query
+
+
+# sort -> порядок сортировки; последний ключ уникален, чтобы порядок был стабильным
+SORT_ORDERINGS = {
+    'price-asc': ('price', 'product_id'),
+    'price-desc': ('-price', '-product_id'),
+    'name': ('product_name', 'product_id'),
+    'new': ('-product_id',),
+}
+DEFAULT_ORDERING = ('product_id',)
+# Сколько значений ?ids= / тела запроса разбирать при любом limit
+MAX_ID_PARTS = 1000
+# Числа в параметрах длиннее этого не бывают ни в ценах, ни в спецификациях
+MAX_DECIMAL_DIGITS = 15
+
+# ?specs.<ключ>=значение — фильтр по products.specifications
+SPEC_PARAM_PREFIX = 'specs.'
+# Старые ключи спецификаций мониторов, которые каталог считает синонимами
+SPEC_KEY_ALIASES = {
+    'size': 'diagonal',
+    'panel_type': 'matrix',
+}
+
+
+def _split_ints(value):
+    """'1, 2,x' -> [1, 2]; некорректные значения пропускаются"""
+    result = []
+    for part in (value or '').split(','):
+        try:
+            result.append(int(part))
+        except (ValueError, TypeError):
+            continue
+    return result
+
+
+def parse_ids(value, limit):
+    """
+    '3,1,3' или [3, 1, 3] -> [3, 1]: без повторов, в исходном порядке, не больше limit.
+    Разбираются только первые MAX_ID_PARTS значений — длинный ввод не обходится целиком.
+    """
+    if isinstance(value, (list, tuple)):
+        parts = value[:MAX_ID_PARTS]
+    else:
+        # Хвост после MAX_ID_PARTS-й запятой остаётся одной строкой и отбрасывается
+        parts = (value or '').split(',', MAX_ID_PARTS)[:MAX_ID_PARTS]
+    result = []
+    seen = set()
+    for part in parts:
+        try:
+            product_id = int(part)
+        except (ValueError, TypeError):
+            continue
+        if product_id > 0 and product_id not in seen:
+            seen.add(product_id)
+            result.append(product_id)
+            if len(result) >= limit:
+                break
+    return result
+
+
+def _split_strings(value):
+    return [part.strip() for part in (value or '').split(',') if part.strip()]
+
+
+def _parse_decimal(value):
+    """Конечное число не длиннее 15 знаков до запятой, иначе None (NaN, Infinity, 1e999999)"""
+    try:
+        number = Decimal(value) if value not in (None, '') else None
+    except (InvalidOperation, TypeError):
+        return None
+    if number is None or not number.is_finite() or number.adjusted() >= MAX_DECIMAL_DIGITS:
+        return None
+    return number
+
+
+def _parse_price(value):
+    """Граница цены для ?min_price/?max_price, приведённая к диапазону NUMERIC(10,2)"""
+    number = _parse_decimal(value)
+    if number is None:
+        return None
+    return max(-MAX_PRICE, min(MAX_PRICE, number))
+
+
+def _parse_bool(value):
+    if value is None:
+        return None
+    value = value.strip().lower()
+    if value in ('1', 'true', 'yes', 'on'):
+        return True
+    if value in ('0', 'false', 'no', 'off'):
+        return False
+    return None
+
+
+def spec_filters(params):
+    """
+    {ключ: [значения]} из параметров ?specs.ram=16GB&specs.ram=32GB.
+    Ключи старых шаблонов приводятся к актуальным (size -> diagonal).
+    """
+    result = {}
+    for name, values in params.lists():
+        if not name.startswith(SPEC_PARAM_PREFIX):
+            continue
+        key = name[len(SPEC_PARAM_PREFIX):].strip()
+        if not key.isidentifier():
+            continue
+        key = SPEC_KEY_ALIASES.get(key, key)
+        for value in values:
+            value = value.strip()
+            if value and value not in result.setdefault(key, []):
+                result[key].append(value)
+    return {key: values for key, values in result.items() if values}
+
+
+def _spec_condition(key, values):
+    """
+    OR по значениям одного ключа. Каждое значение — проверка вхождения
+    specifications @> {...}, которую обслуживает GIN-индекс
+    idx_products_specifications. Значение может храниться строкой, числом
+    или элементом массива (ports).
+    """
+    keys = [key] + [old for old, new in SPEC_KEY_ALIASES.items() if new == key]
+    condition = Q()
+    for value in values:
+        candidates = [value]
+        number = _parse_decimal(value)
+        if number is not None:
+            candidates.append(int(number) if number == number.to_integral_value() else float(number))
+        for spec_key in keys:
+            for candidate in candidates:
+                condition |= Q(specifications__contains={spec_key: candidate})
+                condition |= Q(specifications__contains={spec_key: [candidate]})
+    return condition
+
+
+def get_ordering(params):
+    """Порядок сортировки по параметру ?sort= (неизвестные значения -> по product_id)"""
+    return SORT_ORDERINGS.get(params.get('sort', ''), DEFAULT_ORDERING)
+
+
+def filter_products(queryset, params):
+    """
+    Применить параметры запроса к queryset товаров.
+
+    Поддерживаемые параметры:
+        q          - поиск по search_vector (слова по префиксу)
+        category   - ID категорий через запятую (включая подкатегории)
+        template   - шаблоны категорий через запятую (laptop, monitor, ...)
+        brand      - ID брендов через запятую
+        min_price  - минимальная цена
+        max_price  - максимальная цена
+        in_stock   - true/false: только в наличии / только отсутствующие
+        status     - статусы через запятую
+        specs.<ключ> - значение спецификации (можно повторять: specs.ram=8GB&specs.ram=16GB)
+        sort       - price-asc, price-desc, name, new
+
+    Некорректные значения игнорируются, как и в остальных фильтрах API.
+    """
+    q = normalize_query(params.get('q'))
+    if q:
+        queryset = filter_by_text(queryset, q)
+
+    category_ids = _split_ints(params.get('category'))
+    if category_ids:
+        queryset = subtree_filter(queryset, category_ids)
+
+    templates = _split_strings(params.get('template'))
+    if templates:
+        queryset = queryset.filter(category__template__in=templates)
+
+    brand_ids = _split_ints(params.get('brand'))
+    if brand_ids:
+        queryset = queryset.filter(brand_id__in=brand_ids)
+
+    min_price = _parse_price(params.get('min_price'))
+    if min_price is not None:
+        queryset = queryset.filter(price__gte=min_price)
+
+    max_price = _parse_price(params.get('max_price'))
+    if max_price is not None:
+        queryset = queryset.filter(price__lte=max_price)
+
+    in_stock = _parse_bool(params.get('in_stock'))
+    if in_stock is True:
+        queryset = queryset.filter(stock_quantity__gt=0)
+    elif in_stock is False:
+        queryset = queryset.exclude(stock_quantity__gt=0)
+
+    statuses = _split_strings(params.get('status'))
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+
+    for key, values in spec_filters(params).items():
+        queryset = queryset.filter(_spec_condition(key, values))
+
+    return queryset.order_by(*get_ordering(params))
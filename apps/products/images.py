@@ -0,0 +1,54 @@
+# apps/products/images.py
+"""
+Приведение products.images к каноническому виду: плоский список URL-строк
+без blob:-ссылок и повторов, не больше MAX_PRODUCT_IMAGES.
+
+Выполняется один раз при записи (ProductSerializer.create/update) и
+командой normalize_product_images для уже сохранённых товаров; при чтении
+список отдаётся как есть.
+"""
+import json
+
+MAX_PRODUCT_IMAGES = 5
+# Защита от бесконечной вложенности JSON-строк в старых данных
+MAX_DEPTH = 5
+
+
+def _collect(data, result, depth):
+    if depth > MAX_DEPTH or data is None:
+        return
+    if isinstance(data, (list, tuple)):
+        for item in data:
+            _collect(item, result, depth + 1)
+        return
+    if not isinstance(data, str):
+        return
+
+    value = data.strip()
+    if not value or value.startswith('blob:'):
+        return
+    # FormData и старые версии админки присылали список, сериализованный в строку
+    if value.startswith('[') or value.startswith('"'):
+        try:
+            _collect(json.loads(value), result, depth + 1)
+            return
+        except ValueError:
+            pass
+    result.append(value)
+
+
+def normalize_images(data, limit=MAX_PRODUCT_IMAGES):
+    """
+    Любое из исторических представлений images -> список URL.
+
+    >>> normalize_images(['["/media/a.jpg", "blob:x"]', '/media/a.jpg', ' /media/b.jpg '])
+    ['/media/a.jpg', '/media/b.jpg']
+    """
+    collected = []
+    _collect(data, collected, 0)
+
+    result = []
+    for url in collected:
+        if url not in result:
+            result.append(url)
+    return result[:limit] if limit is not None else result
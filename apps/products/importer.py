@@ -0,0 +1,395 @@
+# apps/products/importer.py
+"""
+Массовый импорт товаров из CSV/XLSX.
+
+Строки читаются потоково и проверяются частями по CHUNK_SIZE; корректные
+сразу уходят через COPY во временную таблицу tmp_product_import. Затем один
+SQL-запрос делает upsert по sku (INSERT ... ON CONFLICT) и одной вставкой
+пишет записи audit_log по всем созданным и изменённым товарам.
+
+Обновляются только колонки, которые есть в файле: файл с колонками sku и
+stock_quantity меняет остатки и не трогает цены и описания.
+"""
+import csv
+import io
+import json
+import logging
+import os
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+
+from apps.products.audit import AUDITED_FIELDS, audit_insert_sql, disable_row_audit
+from apps.products.signals import products_bulk_changed
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+PRODUCT_STATUSES = ('pending', 'approved', 'rejected')
+
+# Заголовок файла -> колонка staging-таблицы. Понимает и выгрузку
+# admin_export_products_csv (Product Name, Price, Category, Brand, ...)
+HEADER_ALIASES = {
+    'sku': 'sku',
+    'product_name': 'product_name', 'product name': 'product_name', 'name': 'product_name', 'название': 'product_name',
+    'description': 'description', 'описание': 'description',
+    'price': 'price', 'цена': 'price',
+    'stock_quantity': 'stock_quantity', 'stock quantity': 'stock_quantity', 'stock': 'stock_quantity',
+    'количество': 'stock_quantity',
+    'category_id': 'category_id',
+    'category': 'category_name', 'category_name': 'category_name', 'категория': 'category_name',
+    'brand_id': 'brand_id',
+    'brand': 'brand_name', 'brand_name': 'brand_name', 'бренд': 'brand_name',
+    'supplier_id': 'supplier_id',
+    'status': 'status', 'статус': 'status',
+    'specifications': 'specifications',
+}
+
+STAGING_COLUMNS = (
+    'row_num', 'sku', 'product_name', 'description', 'price', 'stock_quantity',
+    'category_id', 'category_name', 'brand_id', 'brand_name', 'supplier_id', 'status', 'specifications',
+)
+
+# Колонка products -> колонки файла, из которых она берётся
+TARGET_COLUMNS = {
+    'product_name': ('product_name',),
+    'description': ('description',),
+    'price': ('price',),
+    'stock_quantity': ('stock_quantity',),
+    'category_id': ('category_id', 'category_name'),
+    'brand_id': ('brand_id', 'brand_name'),
+    'supplier_id': ('supplier_id',),
+    'status': ('status',),
+    'specifications': ('specifications',),
+}
+
+# Значения по умолчанию для новых товаров, если в файле колонки нет или ячейка пустая
+INSERT_DEFAULTS = {
+    'stock_quantity': '0',
+    'status': "'pending'",
+}
+
+
+# Границы колонок products: INT и NUMERIC(10,2) — больше не поместится в COPY/upsert
+INT_MAX = 2 ** 31 - 1
+BIGINT_MAX = 2 ** 63 - 1
+MAX_PRICE = Decimal('99999999.99')
+
+
+class RowError(ValueError):
+    """Ошибка в строке файла"""
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and value.strip() in ('', 'N/A'))
+
+
+def _text(value, name=None, max_length=None):
+    if _blank(value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        # XLSX отдаёт числовые артикулы как 12345.0
+        value = int(value)
+    value = str(value).strip()
+    if max_length and len(value) > max_length:
+        raise RowError(f'{name}: длиннее {max_length} символов')
+    return value
+
+
+def parse_int(value, name, minimum=None, maximum=INT_MAX):
+    if _blank(value):
+        return None
+    try:
+        number = Decimal(str(value).strip())
+        if not number.is_finite() or number != number.to_integral_value():
+            raise InvalidOperation
+        number = int(number)
+    except (InvalidOperation, ValueError, OverflowError):
+        raise RowError(f'{name}: ожидается целое число')
+    if minimum is not None and number < minimum:
+        raise RowError(f'{name}: не меньше {minimum}')
+    if maximum is not None and number > maximum:
+        raise RowError(f'{name}: не больше {maximum}')
+    return number
+
+
+def parse_price(value):
+    if _blank(value):
+        return None
+    try:
+        price = Decimal(str(value).strip().replace(' ', '').replace(',', '.'))
+        if not price.is_finite():
+            raise InvalidOperation
+        price = price.quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError, OverflowError):
+        raise RowError('price: ожидается число')
+    if price <= 0:
+        raise RowError('price: должна быть больше 0')
+    if price > MAX_PRICE:
+        raise RowError(f'price: не больше {MAX_PRICE}')
+    return price
+
+
+def _specifications(value):
+    if _blank(value):
+        return None
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False)
+    try:
+        parsed = json.loads(str(value))
+    except ValueError:
+        raise RowError('specifications: ожидается JSON-объект')
+    if not isinstance(parsed, dict):
+        raise RowError('specifications: ожидается JSON-объект')
+    return json.dumps(parsed, ensure_ascii=False)
+
+
+def clean_row(raw):
+    """Строка файла {колонка: значение} -> значения staging-таблицы (без row_num)"""
+    sku = _text(raw.get('sku'), 'sku', 50)
+    if not sku:
+        raise RowError('не указан sku')
+    status = _text(raw.get('status'))
+    if status is not None and status not in PRODUCT_STATUSES:
+        raise RowError(f"status: одно из {', '.join(PRODUCT_STATUSES)}")
+    return (
+        sku,
+        _text(raw.get('product_name'), 'product_name', 100),
+        _text(raw.get('description')),
+        parse_price(raw.get('price')),
+        parse_int(raw.get('stock_quantity'), 'stock_quantity', minimum=0),
+        parse_int(raw.get('category_id'), 'category_id'),
+        _text(raw.get('category_name'), 'category_name', 100),
+        parse_int(raw.get('brand_id'), 'brand_id'),
+        _text(raw.get('brand_name'), 'brand_name', 100),
+        parse_int(raw.get('supplier_id'), 'supplier_id'),
+        status,
+        _specifications(raw.get('specifications')),
+    )
+
+
+def _map_header(header):
+    return [HEADER_ALIASES.get(str(name or '').strip().lower()) for name in header]
+
+
+def iter_file_rows(file, filename):
+    """
+    Потоковое чтение CSV или XLSX.
+    Первой выдаётся список колонок, затем (номер строки, {колонка: значение}).
+    """
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext == '.xlsx':
+        from openpyxl import load_workbook
+        workbook = load_workbook(file, read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+    elif ext in ('.csv', '.txt', ''):
+        text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+        sample = text.read(4096)
+        text.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        rows = csv.reader(text, dialect)
+    else:
+        raise ValueError('Поддерживаются файлы .csv и .xlsx')
+
+    header = _map_header(next(rows, []))
+    if 'sku' not in header:
+        raise ValueError('В файле нет колонки sku')
+    yield [name for name in header if name]
+
+    for row_num, values in enumerate(rows, start=2):
+        if not values or all(_blank(value) for value in values):
+            continue
+        yield row_num, {name: value for name, value in zip(header, values) if name}
+
+
+def _copy_chunk(cursor, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if value is None else value for value in row])
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY tmp_product_import ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+        buffer,
+    )
+
+
+def build_upsert_sql(columns):
+    """
+    Один запрос: upsert по sku из staging + пакетная запись audit_log.
+
+    columns — колонки products, присутствующие в файле. Пустая ячейка
+    у существующего товара значение не меняет.
+    """
+    insert_columns = ['sku'] + list(columns)
+    select_values = ['s.sku'] + [
+        f"COALESCE(s.{column}, {INSERT_DEFAULTS[column]})" if column in INSERT_DEFAULTS else f's.{column}'
+        for column in columns
+    ]
+    new_values = {column: f'COALESCE(EXCLUDED.{column}, p.{column})' for column in columns}
+    updates = ', '.join(f'{column} = {value}' for column, value in new_values.items()) or 'sku = EXCLUDED.sku'
+    changed = ' OR '.join(f'p.{column} IS DISTINCT FROM {value}' for column, value in new_values.items()) or 'FALSE'
+    audited = [field for field, _ in AUDITED_FIELDS]
+
+    return f"""
+        WITH src AS (
+            SELECT DISTINCT ON (t.sku)
+                t.row_num, t.sku, t.product_name, t.description, t.price, t.stock_quantity,
+                COALESCE(t.category_id, c.category_id) AS category_id,
+                COALESCE(t.brand_id, b.brand_id) AS brand_id,
+                t.supplier_id, t.status, t.specifications
+            FROM tmp_product_import t
+            LEFT JOIN categories c ON t.category_id IS NULL AND c.category_name = t.category_name
+            LEFT JOIN brands b ON t.brand_id IS NULL AND b.brand_name = t.brand_name
+            ORDER BY t.sku, t.row_num DESC
+        ),
+        old AS (
+            SELECT p.product_id, {', '.join(f'p.{field}' for field in audited)}
+            FROM products p
+            JOIN src s ON s.sku = p.sku
+        ),
+        upserted AS (
+            INSERT INTO products AS p ({', '.join(insert_columns)})
+            SELECT {', '.join(select_values)} FROM src s
+            ON CONFLICT (sku) DO UPDATE SET {updates}
+            WHERE {changed}
+            RETURNING p.product_id, (p.xmax = 0) AS created, {', '.join(f'p.{field}' for field in audited)}
+        ),
+        changes AS (
+            SELECT u.product_id, u.created,
+                {', '.join(f'o.{field} AS old_{field}, u.{field} AS new_{field}' for field in audited)}
+            FROM upserted u
+            LEFT JOIN old o ON o.product_id = u.product_id
+        ),
+        audit AS ({audit_insert_sql('changes', 'импорт')})
+        SELECT
+            COUNT(*) FILTER (WHERE created),
+            COUNT(*) FILTER (WHERE NOT created)
+        FROM upserted
+    """
+
+
+class ProductImportService:
+    """Импорт каталога из файла: COPY в staging + upsert одним запросом"""
+
+    @staticmethod
+    def import_file(file, filename, user_id=None, dry_run=False):
+        """
+        Returns:
+            {'rows', 'created', 'updated', 'unchanged', 'error_count', 'errors': [{'row', 'sku', 'error'}]}
+        """
+        errors = []
+        error_count = 0
+        total = 0
+
+        def add_error(row_num, sku, message):
+            nonlocal error_count
+            error_count += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'row': row_num, 'sku': sku, 'error': message})
+
+        rows = iter_file_rows(file, filename)
+        file_columns = set(next(rows))
+        columns = [
+            column for column, sources in TARGET_COLUMNS.items()
+            if file_columns.intersection(sources)
+        ]
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    CREATE TEMP TABLE tmp_product_import (
+                        row_num INT,
+                        sku VARCHAR(50),
+                        product_name VARCHAR(100),
+                        description TEXT,
+                        price NUMERIC(10,2),
+                        stock_quantity INT,
+                        category_id INT,
+                        category_name VARCHAR(100),
+                        brand_id INT,
+                        brand_name VARCHAR(100),
+                        supplier_id INT,
+                        status VARCHAR(20),
+                        specifications JSONB
+                    ) ON COMMIT DROP
+                """)
+
+                chunk = []
+                for row_num, raw in rows:
+                    total += 1
+                    try:
+                        chunk.append((row_num,) + clean_row(raw))
+                    except RowError as e:
+                        add_error(row_num, _text(raw.get('sku')), str(e))
+                    if len(chunk) >= CHUNK_SIZE:
+                        _copy_chunk(cursor, chunk)
+                        chunk = []
+                if chunk:
+                    _copy_chunk(cursor, chunk)
+
+                # Ссылки на несуществующие категории/бренды/поставщиков и новые товары без обязательных полей.
+                # CASE проверяет те же условия, что и WHERE, чтобы причина совпадала с фактической
+                cursor.execute("""
+                    DELETE FROM tmp_product_import t
+                    WHERE (t.category_id IS NULL AND t.category_name IS NOT NULL
+                           AND NOT EXISTS (SELECT 1 FROM categories c WHERE c.category_name = t.category_name))
+                       OR (t.category_id IS NOT NULL
+                           AND NOT EXISTS (SELECT 1 FROM categories c WHERE c.category_id = t.category_id))
+                       OR (t.brand_id IS NULL AND t.brand_name IS NOT NULL
+                           AND NOT EXISTS (SELECT 1 FROM brands b WHERE b.brand_name = t.brand_name))
+                       OR (t.brand_id IS NOT NULL
+                           AND NOT EXISTS (SELECT 1 FROM brands b WHERE b.brand_id = t.brand_id))
+                       OR (t.supplier_id IS NOT NULL
+                           AND NOT EXISTS (SELECT 1 FROM suppliers s WHERE s.supplier_id = t.supplier_id))
+                       OR ((t.product_name IS NULL OR t.price IS NULL)
+                           AND NOT EXISTS (SELECT 1 FROM products p WHERE p.sku = t.sku))
+                    RETURNING t.row_num, t.sku,
+                        CASE
+                            WHEN (t.category_id IS NULL AND t.category_name IS NOT NULL
+                                  AND NOT EXISTS (SELECT 1 FROM categories c WHERE c.category_name = t.category_name))
+                              OR (t.category_id IS NOT NULL
+                                  AND NOT EXISTS (SELECT 1 FROM categories c WHERE c.category_id = t.category_id))
+                                THEN 'неизвестная категория'
+                            WHEN (t.brand_id IS NULL AND t.brand_name IS NOT NULL
+                                  AND NOT EXISTS (SELECT 1 FROM brands b WHERE b.brand_name = t.brand_name))
+                              OR (t.brand_id IS NOT NULL
+                                  AND NOT EXISTS (SELECT 1 FROM brands b WHERE b.brand_id = t.brand_id))
+                                THEN 'неизвестный бренд'
+                            WHEN t.supplier_id IS NOT NULL
+                                  AND NOT EXISTS (SELECT 1 FROM suppliers s WHERE s.supplier_id = t.supplier_id)
+                                THEN 'неизвестный поставщик'
+                            ELSE 'новый товар: нужны product_name и price'
+                        END
+                """)
+                for row_num, sku, message in cursor.fetchall():
+                    add_error(row_num, sku, message)
+
+                # Аудит пишется одной вставкой в том же запросе, построчный триггер цен не нужен
+                disable_row_audit(cursor)
+                cursor.execute(build_upsert_sql(columns), [user_id])
+                created, updated = cursor.fetchone()
+                cursor.execute("SELECT COUNT(DISTINCT sku) FROM tmp_product_import")
+                distinct_skus = cursor.fetchone()[0]
+
+            if dry_run:
+                transaction.set_rollback(True)
+            elif created or updated:
+                products_bulk_changed.send(sender=ProductImportService, product_ids=None)
+
+        result = {
+            'rows': total,
+            'created': created,
+            'updated': updated,
+            'unchanged': distinct_skus - created - updated,
+            'error_count': error_count,
+            'errors': errors,
+            'dry_run': dry_run,
+        }
+        logger.info(f"Импорт товаров {filename}: {result['rows']} строк, создано {created}, "
+                    f"обновлено {updated}, ошибок {error_count}")
+        return result
@@ -0,0 +1,43 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.products.derivatives import POOL_WORKERS, _to_urls, build_derivatives, media_path, store_product_variants
+from apps.products.models import Products
+
+
+class Command(BaseCommand):
+    help = 'Строит WebP-копии для уже загруженных изображений товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=POOL_WORKERS)
+        parser.add_argument('--force', action='store_true', help='Пересобрать копии даже если они уже есть')
+
+    def handle(self, *args, **options):
+        jobs = []
+        for product in Products.objects.only('product_id', 'images', 'image_variants').iterator():
+            variants = product.image_variants or {}
+            for url in product.images or []:
+                path = media_path(url)
+                if path and (options['force'] or url not in variants):
+                    jobs.append((product.product_id, url, path))
+
+        built = failed = 0
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=options['workers'], mp_context=context) as pool:
+            futures = {
+                pool.submit(build_derivatives, path, str(settings.MEDIA_ROOT), force=options['force']): (product_id, url)
+                for product_id, url, path in jobs
+            }
+            for future in as_completed(futures):
+                product_id, url = futures[future]
+                try:
+                    store_product_variants(product_id, url, _to_urls(future.result()))
+                    built += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"Товар {product_id}, {url}: {e}")
+
+        self.stdout.write(self.style.SUCCESS(f"Изображений обработано: {built}, ошибок: {failed}"))
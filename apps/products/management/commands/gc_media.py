@@ -0,0 +1,49 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.products.storage import TMP_DIR, iter_managed_files, referenced_media_paths
+
+
+class Command(BaseCommand):
+    help = 'Удаляет файлы media, на которые больше не ссылаются товары и бренды'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет удалено')
+        parser.add_argument(
+            '--min-age-hours', type=float, default=24,
+            help='Не трогать файлы моложе (загрузка могла ещё не попасть в БД)'
+        )
+
+    def handle(self, *args, **options):
+        referenced = referenced_media_paths()
+        cutoff = time.time() - options['min_age_hours'] * 3600
+        removed = freed = kept = 0
+
+        for relative, absolute in iter_managed_files():
+            if relative in referenced and not relative.startswith(f'{TMP_DIR}/'):
+                kept += 1
+                continue
+            try:
+                stat = os.stat(absolute)
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime > cutoff:
+                kept += 1
+                continue
+
+            if options['dry_run']:
+                self.stdout.write(f'  {relative}')
+            else:
+                try:
+                    os.remove(absolute)
+                except FileNotFoundError:
+                    continue
+            removed += 1
+            freed += stat.st_size
+
+        action = 'будет удалено' if options['dry_run'] else 'удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f"Файлов {action}: {removed} ({freed / 1024 / 1024:.1f} МБ), оставлено: {kept}"
+        ))
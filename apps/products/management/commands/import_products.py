@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.products.importer import ProductImportService
+
+
+class Command(BaseCommand):
+    help = 'Массовый импорт товаров из CSV/XLSX (создание и обновление по sku)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу .csv или .xlsx')
+        parser.add_argument('--dry-run', action='store_true', help='Проверить файл и откатить изменения')
+        parser.add_argument('--user-id', type=int, default=None, help='customer_id для записей audit_log')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            with open(path, 'rb') as f:
+                result = ProductImportService.import_file(
+                    f, path, user_id=options['user_id'], dry_run=options['dry_run'],
+                )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for error in result['errors']:
+            self.stderr.write(f"Строка {error['row']} ({error['sku'] or '-'}): {error['error']}")
+
+        prefix = 'Проверка (изменения откатены)' if result['dry_run'] else 'Импорт завершён'
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}: строк {result['rows']}, создано {result['created']}, обновлено {result['updated']}, "
+            f"без изменений {result['unchanged']}, ошибок {result['error_count']}"
+        ))
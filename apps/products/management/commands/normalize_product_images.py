@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.products.images import normalize_images
+from apps.products.models import Products
+
+
+class Command(BaseCommand):
+    help = 'Приводит products.images к плоскому списку URL (однократная миграция данных)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, сколько товаров изменится')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        checked = 0
+        changed = []
+
+        products = Products.objects.only('product_id', 'images', 'image_url').order_by('product_id')
+        for product in products.iterator(chunk_size=batch_size):
+            checked += 1
+            images = normalize_images(product.images)
+            image_url = images[0] if images else product.image_url
+            if images != product.images or image_url != product.image_url:
+                product.images = images
+                product.image_url = image_url
+                changed.append(product)
+
+        if not dry_run:
+            with transaction.atomic():
+                Products.objects.bulk_update(changed, ['images', 'image_url'], batch_size=batch_size)
+
+        action = 'будет изменено' if dry_run else 'изменено'
+        self.stdout.write(self.style.SUCCESS(f"Проверено товаров: {checked}, {action}: {len(changed)}"))
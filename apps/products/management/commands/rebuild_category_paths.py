@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.categories import rebuild_paths
+
+
+class Command(BaseCommand):
+    help = 'Пересобрать материализованные пути категорий (categories.path/depth) рекурсивным CTE'
+
+    def handle(self, *args, **options):
+        result = rebuild_paths()
+        if result['unreachable']:
+            self.stderr.write(
+                'Категории с циклом в parent_id (путь не построен): '
+                + ', '.join(str(category_id) for category_id in result['unreachable'])
+            )
+        self.stdout.write(self.style.SUCCESS(f"Пути категорий пересобраны: изменено строк {result['updated']}"))
@@ -6,6 +6,7 @@
 #   * Remove `managed = False` lines if you wish to allow Django to create, modify, and delete the table
 # Feel free to rename the models, but don't rename db_table values or field names.
 from django.db import models
+from django.contrib.postgres.search import SearchVectorField
 
 
 class Categories(models.Model):
@@ -14,6 +15,9 @@ class Categories(models.Model):
     description = models.TextField(blank=True, null=True)
     parent = models.ForeignKey('self', models.DO_NOTHING, blank=True, null=True)
     template = models.CharField(max_length=50, blank=True, null=True)
+    # Материализованный путь '/1/5/12/' и глубина; заполняются триггером (РАЗДЕЛ 11 dbSNDshop.sql)
+    path = models.TextField(blank=True, null=True, editable=False)
+    depth = models.IntegerField(blank=True, null=True, editable=False)
     class Meta:
         managed = False
         db_table = 'categories'
@@ -58,6 +62,8 @@ class Products(models.Model):
     created_at = models.DateTimeField(blank=True, null=True)
     updated_at = models.DateTimeField(blank=True, null=True) 
     images = models.JSONField(blank=True, null=True)  # массив картинок JSONB
+    image_variants = models.JSONField(blank=True, null=True)  # {url: {ширина: url WebP}}, см. apps/products/derivatives.py
+    search_vector = SearchVectorField(blank=True, null=True)  # заполняется триггером trg_update_product_search_vector
     
     
     class Meta:
@@ -0,0 +1,84 @@
+# apps/products/search.py
+"""
+Поиск товаров по products.search_vector (GIN-индекс idx_products_search_vector)
+с нечётким запасным вариантом через pg_trgm (idx_products_name_trgm).
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import F
+
+SEARCH_CONFIG = 'russian'
+MAX_QUERY_LENGTH = 200
+
+
+def normalize_query(q):
+    return ' '.join((q or '').split())[:MAX_QUERY_LENGTH]
+
+
+def fulltext_query(q):
+    """Запрос в синтаксисе веб-поиска: слова, "фразы", -исключения"""
+    return SearchQuery(q, config=SEARCH_CONFIG, search_type='websearch')
+
+
+def prefix_query(q):
+    """
+    Запрос по началу слов (автодополнение, фильтр каталога).
+    'ноутбук asu' -> 'ноутбук:* & asu:*'
+    """
+    tokens = re.findall(r'\w+', q)
+    if not tokens:
+        return None
+    return SearchQuery(' & '.join(f'{token}:*' for token in tokens), config=SEARCH_CONFIG, search_type='raw')
+
+
+def filter_by_text(queryset, q):
+    """
+    Только условие совпадения, без ранжирования (фильтр ?q= в списке товаров).
+    Слова ищутся по префиксу, чтобы каталог находил товары по мере набора.
+    """
+    query = prefix_query(q)
+    if query is None:
+        return queryset.none()
+    return queryset.filter(search_vector=query)
+
+
+def search_products(queryset, q, limit):
+    """
+    Ранжированный поиск товаров.
+
+    Сначала полнотекстовый поиск с ранжированием ts_rank по весам
+    (название и SKU важнее бренда, бренд важнее описания). Если ничего не
+    найдено — поиск по похожести названия (pg_trgm), который прощает опечатки.
+
+    Returns:
+        (mode, products) где mode — 'fulltext' или 'trigram'
+    """
+    query = fulltext_query(q)
+    products = list(
+        queryset.filter(search_vector=query)
+        .annotate(rank=SearchRank(F('search_vector'), query))
+        .order_by('-rank', 'product_id')[:limit]
+    )
+    if products:
+        return 'fulltext', products
+
+    products = list(
+        queryset.filter(product_name__trigram_similar=q)
+        .annotate(similarity=TrigramSimilarity('product_name', q))
+        .order_by('-similarity', 'product_id')[:limit]
+    )
+    return 'trigram', products
+
+
+def autocomplete_products(queryset, q, limit):
+    """Подсказки по префиксу: только id и название, одним запросом по GIN-индексу"""
+    query = prefix_query(q)
+    if query is None:
+        return []
+    return list(
+        queryset.filter(search_vector=query)
+        .annotate(rank=SearchRank(F('search_vector'), query))
+        .order_by('-rank', 'product_id')
+        .values('product_id', 'product_name')[:limit]
+    )
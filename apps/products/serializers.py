@@ -1,11 +1,14 @@
 from rest_framework import serializers
 from .models import Categories, Brands, Suppliers, Products
-import os
-import json
-import time
-from django.conf import settings
-from apps.reviews.models import Reviews
-from django.db.models import Avg
+from .images import MAX_PRODUCT_IMAGES, normalize_images
+from .derivatives import schedule_product_derivatives, srcset
+from .storage import store_upload
+import logging
+from apps.reviews.models import ProductRatingStats
+from django.db.models import FloatField
+from django.db.models.functions import Cast, NullIf
+
+logger = logging.getLogger(__name__)
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -24,19 +27,8 @@ class BrandSerializer(serializers.ModelSerializer):
         brand.save()  # Сначала сохраняем без файла
 
         if logo_file:
-            # Путь: media/brands/название_файла.jpg
-            filename = logo_file.name
-            upload_dir = os.path.join(settings.MEDIA_ROOT, 'brands')
-            os.makedirs(upload_dir, exist_ok=True)
-            file_path = os.path.join(upload_dir, filename)
-
-            # Сохраняем файл
-            with open(file_path, 'wb+') as f:
-                for chunk in logo_file.chunks():
-                    f.write(chunk)
-
-            # Записываем путь в logo_url
-            brand.logo_url = f'{settings.MEDIA_URL}brands/{filename}'
+            # Файл сохраняется под именем по содержимому (apps/products/storage.py)
+            brand.logo_url = store_upload(logo_file, 'brands')
             brand.save()
 
         return brand
@@ -47,24 +39,9 @@ class BrandSerializer(serializers.ModelSerializer):
         instance.brand_name = validated_data.get('brand_name', instance.brand_name)
 
         if logo_file:
-            # Удаляем старый файл (по желанию)
-            if instance.logo_url:
-                old_path = instance.logo_url.replace(settings.MEDIA_URL, '')
-                old_full_path = os.path.join(settings.MEDIA_ROOT, old_path)
-                if os.path.exists(old_full_path):
-                    os.remove(old_full_path)
-
-            # Сохраняем новый
-            filename = logo_file.name
-            upload_dir = os.path.join(settings.MEDIA_ROOT, 'brands')
-            os.makedirs(upload_dir, exist_ok=True)
-            file_path = os.path.join(upload_dir, filename)
-
-            with open(file_path, 'wb+') as f:
-                for chunk in logo_file.chunks():
-                    f.write(chunk)
-
-            instance.logo_url = f'{settings.MEDIA_URL}brands/{filename}'
+            # Старый файл не удаляем: он может быть общим с другим брендом,
+            # неиспользуемые файлы убирает команда gc_media
+            instance.logo_url = store_upload(logo_file, 'brands')
 
         instance.save()
         return instance
@@ -91,6 +68,7 @@ class ProductSerializer(serializers.ModelSerializer):
     category_name = serializers.SerializerMethodField(read_only=True)
     template = serializers.SerializerMethodField(read_only=True)
     is_in_stock = serializers.SerializerMethodField(read_only=True)
+    image_srcset = serializers.SerializerMethodField(read_only=True)
 
     category_id = serializers.IntegerField(write_only=True, required=False, allow_null=True)
     brand_id = serializers.IntegerField(write_only=True, required=False, allow_null=True)
@@ -102,45 +80,35 @@ class ProductSerializer(serializers.ModelSerializer):
             'product_id', 'sku', 'product_name', 'description', 'price',
             'stock_quantity', 'image_url', 'status', 'specifications',
             'category_id', 'brand_id', 'supplier_id', 'images', 'image_files',
-            'brand_name', 'brand_logo_url', 'rating', 'category_name', 'template', 'is_in_stock'
+            'brand_name', 'brand_logo_url', 'rating', 'category_name', 'template', 'is_in_stock',
+            'image_srcset'
         ]
         extra_kwargs = {'image_url': {'read_only': True}}
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Готовит queryset так, чтобы список товаров отдавался одним SQL-запросом:
+        бренд, категория и агрегаты отзывов (product_rating_stats) подтягиваются
+        JOIN-ом, средний рейтинг считается прямо в SELECT. Служебный
+        search_vector не выбирается.
+        """
+        return queryset.select_related('brand', 'category').defer('search_vector').annotate(
+            avg_rating=Cast('rating_stats__rating_sum', FloatField()) / NullIf('rating_stats__review_count', 0)
+        )
+
     def _save_product_images(self, image_files, existing_urls):
         """Save uploaded image files and combine with existing URLs. Max 5 images total."""
-        saved_urls = []
-        
-        # Clean existing URLs first
-        if existing_urls:
-            if isinstance(existing_urls, str):
-                try:
-                    parsed = json.loads(existing_urls)
-                    existing_urls = parsed if isinstance(parsed, list) else [existing_urls]
-                except:
-                    existing_urls = [existing_urls]
-            
-            if isinstance(existing_urls, list):
-                # Use the same cleaning logic as to_representation
-                cleaned = self._flatten_and_clean_images(existing_urls)
-                saved_urls.extend(cleaned[:5])
-        
-        # Add new uploaded files (up to 5 total)
+        # Существующие URL приводятся к каноническому списку один раз при записи
+        saved_urls = normalize_images(existing_urls)
+
+        # Add new uploaded files (up to 5 total); одинаковые файлы хранятся один раз
         if image_files:
-            upload_dir = os.path.join(settings.MEDIA_ROOT, 'products')
-            os.makedirs(upload_dir, exist_ok=True)
-            
-            remaining_slots = 5 - len(saved_urls)
+            remaining_slots = MAX_PRODUCT_IMAGES - len(saved_urls)
             for image_file in image_files[:remaining_slots]:
-                filename = f"{int(time.time())}_{image_file.name}"
-                file_path = os.path.join(upload_dir, filename)
-                
-                with open(file_path, 'wb+') as f:
-                    for chunk in image_file.chunks():
-                        f.write(chunk)
-                
-                saved_urls.append(f'{settings.MEDIA_URL}products/{filename}')
-        
-        return saved_urls[:5]  # Ensure max 5 images
+                saved_urls.append(store_upload(image_file, 'products'))
+
+        return normalize_images(saved_urls)
 
     def get_brand_name(self, obj):
         try:
@@ -156,9 +124,14 @@ class ProductSerializer(serializers.ModelSerializer):
 
     def get_rating(self, obj):
         try:
-            agg = Reviews.objects.filter(product=obj).aggregate(avg=Avg('rating'))
-            if agg and agg.get('avg') is not None:
-                return round(float(agg.get('avg')), 1)
+            # Из setup_eager_loading приходит готовое значение — без запроса на товар
+            if hasattr(obj, 'avg_rating'):
+                avg = obj.avg_rating
+            else:
+                stats = ProductRatingStats.objects.filter(product_id=obj.pk).first()
+                avg = stats.avg_rating if stats else None
+            if avg is not None:
+                return round(float(avg), 1)
             return None
         except Exception:
             return None
@@ -182,91 +155,24 @@ class ProductSerializer(serializers.ModelSerializer):
         except Exception:
             return False
 
+    def get_image_srcset(self, obj):
+        """{url оригинала: 'копия 320w, копия 640w, ...'} для изображений, у которых копии уже готовы"""
+        variants = obj.image_variants or {}
+        return {url: srcset(variants[url]) for url in (obj.images or []) if variants.get(url)}
+
     def to_representation(self, instance):
-        """Ensure images field is always a clean list of URLs"""
+        """images хранится уже нормализованным (см. apps/products/images.py)"""
         ret = super().to_representation(instance)
-        
-        # Clean up images field - recursively parse and flatten all URLs
-        if 'images' in ret and ret['images']:
-            images_data = ret['images']
-            clean_images = self._flatten_and_clean_images(images_data)
-            ret['images'] = clean_images if clean_images else []
-        else:
-            ret['images'] = []
-        
+        ret['images'] = ret.get('images') or []
         return ret
 
-    def _flatten_and_clean_images(self, data, depth=0):
-        """Recursively flatten and clean image URLs from nested JSON structures"""
-        if depth > 5:  # Prevent infinite recursion
-            return []
-        
-        result = []
-        
-        if isinstance(data, str):
-            # Try to parse as JSON
-            data_str = data.strip()
-            if data_str.startswith('[') or data_str.startswith('"'):
-                try:
-                    parsed = json.loads(data_str)
-                    return self._flatten_and_clean_images(parsed, depth + 1)
-                except:
-                    # Not valid JSON, treat as URL if not blob
-                    if not data_str.startswith('blob:'):
-                        result.append(data_str)
-            elif not data_str.startswith('blob:') and data_str:
-                result.append(data_str)
-        
-        elif isinstance(data, list):
-            for item in data:
-                if isinstance(item, str):
-                    item_str = item.strip()
-                    # Skip blob URLs
-                    if item_str.startswith('blob:'):
-                        continue
-                    # Try to parse nested JSON
-                    if item_str.startswith('[') or item_str.startswith('"'):
-                        try:
-                            parsed = json.loads(item_str)
-                            result.extend(self._flatten_and_clean_images(parsed, depth + 1))
-                            continue
-                        except:
-                            pass
-                    # Add as URL if valid
-                    if item_str and not item_str.startswith('blob:'):
-                        result.append(item_str)
-                elif isinstance(item, list):
-                    result.extend(self._flatten_and_clean_images(item, depth + 1))
-        
-        # Remove duplicates while preserving order
-        seen = set()
-        unique_result = []
-        for url in result:
-            if url not in seen:
-                seen.add(url)
-                unique_result.append(url)
-        
-        return unique_result
-
     def create(self, validated_data):
-        import sys
-        
         image_files = validated_data.pop('image_files', [])
         images = validated_data.pop('images', [])
         category_id = validated_data.pop('category_id', None)
         brand_id = validated_data.pop('brand_id', None)
         supplier_id = validated_data.pop('supplier_id', None)
 
-        # ✅ ПАРСИМ JSON-строку если нужно
-        if isinstance(images, str):
-            try:
-                images = json.loads(images)
-            except json.JSONDecodeError:
-                images = [images] if images else []
-        
-        if not isinstance(images, list):
-            images = list(images) if images else []
-
         product = Products(**validated_data)
 
         if category_id:
@@ -276,66 +182,35 @@ class ProductSerializer(serializers.ModelSerializer):
         if supplier_id:
             product.supplier_id = int(supplier_id) if isinstance(supplier_id, str) else supplier_id
 
-        # Save uploaded images and combine with any URLs
+        # Save uploaded images and combine with any URLs (JSON-строки из FormData разбираются здесь)
         saved_images = self._save_product_images(image_files, images)
-        product.images = saved_images if saved_images else None
-        
+        product.images = saved_images
+
         # ✅ ВАЖНО: Устанавливаем первую картинку как главное изображение (image_url)
-        if saved_images and len(saved_images) > 0:
+        if saved_images:
             product.image_url = saved_images[0]
-        
+
         product.save()
+        schedule_product_derivatives(product.product_id, saved_images)
         return product
 
     def update(self, instance, validated_data):
-        import sys
-        
         image_files = validated_data.pop('image_files', [])
         images = validated_data.pop('images', None)
         category_id = validated_data.pop('category_id', None)
         brand_id = validated_data.pop('brand_id', None)
         supplier_id = validated_data.pop('supplier_id', None)
-        
-        # DEBUG ЛОГИРОВАНИЕ
-        print(f"\n{'='*60}", file=sys.stderr)
-        print(f"UPDATE PRODUCT {instance.product_id}", file=sys.stderr)
-        print(f"image_files type: {type(image_files)}, count: {len(image_files) if image_files else 0}", file=sys.stderr)
-        print(f"images type: {type(images)}", file=sys.stderr)
-        print(f"images raw: {images}", file=sys.stderr)
-        print(f"category_id: {category_id} (type: {type(category_id).__name__})", file=sys.stderr)
-        print(f"brand_id: {brand_id} (type: {type(brand_id).__name__})", file=sys.stderr)
-        print(f"supplier_id: {supplier_id} (type: {type(supplier_id).__name__})", file=sys.stderr)
-        
-        # ✅ ПАРСИМ JSON-строку если нужно
-        # FormData может отправить JSON-строку внутри списка
-        if isinstance(images, list) and len(images) == 1 and isinstance(images[0], str):
-            if images[0].startswith('['):
-                try:
-                    images = json.loads(images[0])
-                    print(f"✓ Parsed images from nested JSON list: {len(images)} items", file=sys.stderr)
-                except json.JSONDecodeError as e:
-                    print(f"✗ Failed to parse JSON: {e}", file=sys.stderr)
-                    images = []
-            else:
-                images = [images[0]] if images[0] else []
-        elif isinstance(images, str):
-            try:
-                images = json.loads(images)
-                print(f"✓ Parsed images from JSON string: {len(images)} items", file=sys.stderr)
-            except json.JSONDecodeError as e:
-                print(f"✗ Failed to parse JSON string: {e}", file=sys.stderr)
-                images = [images] if images else []
-        
-        if not isinstance(images, list):
-            images = list(images) if images else []
-        
-        print(f"Final images: {len(images)} items", file=sys.stderr)
-        print(f"Current DB image_url: {instance.image_url}", file=sys.stderr)
-        
+
+        logger.debug(
+            f"Update product {instance.product_id}: images={images!r}, "
+            f"image_files={len(image_files) if image_files else 0}, "
+            f"category_id={category_id!r}, brand_id={brand_id!r}, supplier_id={supplier_id!r}"
+        )
+
         instance.sku = validated_data.get('sku', instance.sku)
         instance.product_name = validated_data.get('product_name', instance.product_name)
         instance.description = validated_data.get('description', instance.description)
-        
+
         # Обрабатываем цену (может прийти как строка из FormData)
         price = validated_data.get('price', instance.price)
         if price is not None:
@@ -343,7 +218,7 @@ class ProductSerializer(serializers.ModelSerializer):
                 instance.price = float(price)
             except (ValueError, TypeError):
                 instance.price = instance.price
-        
+
         # Обрабатываем stock_quantity
         stock = validated_data.get('stock_quantity', instance.stock_quantity)
         if stock is not None:
@@ -351,7 +226,7 @@ class ProductSerializer(serializers.ModelSerializer):
                 instance.stock_quantity = int(stock) if stock else 0
             except (ValueError, TypeError):
                 instance.stock_quantity = instance.stock_quantity
-        
+
         instance.status = validated_data.get('status', instance.status)
         instance.specifications = validated_data.get('specifications', instance.specifications)
 
@@ -362,29 +237,20 @@ class ProductSerializer(serializers.ModelSerializer):
         if supplier_id is not None:
             instance.supplier_id = int(supplier_id) if isinstance(supplier_id, str) and supplier_id else supplier_id
 
-        print(f"After processing IDs:", file=sys.stderr)
-        print(f"  instance.category_id = {instance.category_id}", file=sys.stderr)
-        print(f"  instance.brand_id = {instance.brand_id}", file=sys.stderr)
-        print(f"  instance.supplier_id = {instance.supplier_id}", file=sys.stderr)
-
         # Handle images: combine existing URLs with newly uploaded files
-        if images or image_files:
-            print(f"→ Processing images (images={len(images)} items, image_files={len(image_files)})", file=sys.stderr)
-            existing_urls = images if isinstance(images, list) else []
-            saved_images = self._save_product_images(image_files, existing_urls)
-            print(f"→ Saved: {len(saved_images)} total images", file=sys.stderr)
-            instance.images = saved_images if saved_images else None
-            
-            # ✅ ВАЖНО: Устанавливаем первую картинку как главное изображение (image_url)
-            if saved_images and len(saved_images) > 0:
-                instance.image_url = saved_images[0]
-                print(f"→ Set image_url = {instance.image_url[:80]}...", file=sys.stderr)
-        elif images == []:
-            print(f"→ Clearing all images", file=sys.stderr)
-            instance.images = []
-            instance.image_url = None
+        if images is not None or image_files:
+            saved_images = self._save_product_images(image_files, images)
+            instance.images = saved_images
+            # ✅ ВАЖНО: первая картинка — главное изображение (image_url)
+            instance.image_url = saved_images[0] if saved_images else None
+            # Копии удалённых изображений больше не нужны, для новых строятся в фоне
+            variants = instance.image_variants or {}
+            instance.image_variants = {url: variants[url] for url in saved_images if url in variants}
+            new_images = [url for url in saved_images if url not in variants]
+        else:
+            new_images = []
 
         instance.save()
-        print(f"✓ SAVED Product {instance.product_id}", file=sys.stderr)
-        print(f"{'='*60}\n", file=sys.stderr)
+        schedule_product_derivatives(instance.product_id, new_images)
+        logger.debug(f"Product {instance.product_id} saved with {len(instance.images or [])} images")
         return instance
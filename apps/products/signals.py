@@ -0,0 +1,10 @@
+# apps/products/signals.py
+"""
+Сигналы об изменениях товаров в обход ORM (сырые UPDATE/INSERT), когда
+post_save не срабатывает: массовый импорт, bulk-update, списание остатков
+при заказе. Отправляются внутри транзакции; получатели сами решают, ждать ли COMMIT.
+"""
+from django.dispatch import Signal
+
+# product_ids: список id или None, если изменённые товары неизвестны
+products_bulk_changed = Signal()
@@ -0,0 +1,416 @@
+# apps/products/snapshot.py
+"""
+Снимок каталога в памяти процесса для /api/products/ (включается
+CATALOG_SNAPSHOT_ENABLED в settings).
+
+Каждый воркер держит компактные строки товаров (__slots__) с уже
+сериализованным ответом, дерево категорий и акции товаров (цены со
+скидками считаются на дату запроса). Список без сложных фильтров
+отдаётся из памяти без обращения к БД — целиком или курсорными страницами
+(ProductCursorPagination листает строки снимка через SnapshotRows).
+
+Актуальность поддерживается через LISTEN/NOTIFY: триггеры
+fn_notify_catalog_change на products, brands, categories, reviews и promotions шлют
+в канал catalog_changes таблицу и id изменённой строки, а фоновый поток
+перечитывает только затронутые товары. Пока поток не подтверждает связь
+с БД дольше MAX_STALENESS секунд, запросы идут в БД как обычно.
+"""
+import json
+import logging
+import os
+import select
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import connection, connections
+from rest_framework.exceptions import NotFound
+
+from apps.products.conditional import catalog_state, list_etag
+from apps.products.filters import (
+    DEFAULT_ORDERING,
+    SORT_ORDERINGS,
+    _parse_bool,
+    _parse_price,
+    _split_ints,
+    _split_strings,
+)
+from apps.products.models import Categories, Products
+from apps.products.serializers import ProductSerializer
+from apps.promotions.models import Promotions
+from apps.promotions.pricing import ActivePromotion
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'catalog_changes'
+# Ожидание уведомлений за один цикл, сек
+POLL_INTERVAL = 0.5
+# Снимок старше этого (нет связи с БД) не используется
+MAX_STALENESS = 5
+# Столько изменённых товаров за цикл дешевле перечитать целиком
+FULL_RELOAD_THRESHOLD = 500
+RECONNECT_DELAY = 2
+# Параметры списка, которые снимок умеет применять сам; остальные (q, specs.*) обслуживает БД
+SUPPORTED_PARAMS = {
+    'category', 'template', 'brand', 'min_price', 'max_price', 'in_stock', 'status', 'sort',
+    'cursor', 'page_size',
+}
+# Тип поля сортировки: позиция курсора приходит строкой
+POSITION_TYPES = {'product_id': int, 'price': Decimal, 'product_name': str}
+
+
+class ProductRow:
+    """Товар в снимке: поля для фильтров и готовый ответ сериализатора"""
+    __slots__ = (
+        'product_id', 'product_name', 'price', 'stock_quantity', 'status',
+        'brand_id', 'category_id', 'template', 'payload',
+    )
+
+    def __init__(self, product):
+        self.product_id = product.product_id
+        self.product_name = product.product_name or ''
+        self.price = product.price
+        self.stock_quantity = product.stock_quantity or 0
+        self.status = product.status
+        self.brand_id = product.brand_id
+        self.category_id = product.category_id
+        self.template = product.category.template if product.category else None
+        self.payload = dict(ProductSerializer(product).data)
+
+
+def sort_rows(rows, ordering):
+    """Сортировка строк снимка как ORDER BY ordering: по ключам с конца, sort() устойчива"""
+    for field in reversed(ordering):
+        rows.sort(key=lambda row: getattr(row, field.lstrip('-')), reverse=field.startswith('-'))
+    return rows
+
+
+class SnapshotRows:
+    """
+    Строки снимка с тем подмножеством интерфейса QuerySet, которым пользуется
+    CursorPagination: order_by, filter(<поле>__gt/__lt=позиция) и срез.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def order_by(self, *ordering):
+        return SnapshotRows(sort_rows(list(self.rows), ordering))
+
+    def filter(self, **kwargs):
+        (lookup, position), = kwargs.items()
+        field, operator = lookup.rsplit('__', 1)
+        try:
+            position = POSITION_TYPES[field](position)
+        except (KeyError, ValueError, InvalidOperation):
+            raise NotFound('Invalid cursor')
+        if operator == 'gt':
+            return SnapshotRows([row for row in self.rows if getattr(row, field) > position])
+        return SnapshotRows([row for row in self.rows if getattr(row, field) < position])
+
+    def __getitem__(self, item):
+        return self.rows[item]
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def _load_rows(queryset):
+    queryset = ProductSerializer.setup_eager_loading(queryset)
+    return {product.product_id: ProductRow(product) for product in queryset}
+
+
+class CatalogSnapshot:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.products = {}
+        self.children = {}
+        self.promotions = {}
+        # Состояние каталога для ETag (conditional.catalog_state), прочитанное до строк снимка
+        self.state = None
+        self.ready = False
+        self.loaded_at = None
+        self.synced_at = None
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.patched_rows = 0
+
+    # ---------- загрузка и обновление ----------
+
+    def _load_categories(self):
+        children = {}
+        for category_id, parent_id in Categories.objects.values_list('category_id', 'parent_id'):
+            children.setdefault(parent_id, []).append(category_id)
+        return children
+
+    def _load_promotions(self):
+        """{product_id: [(start_date, end_date, ActivePromotion)]} — все акции со скидкой"""
+        promotions = {}
+        rows = Promotions.objects.filter(product__isnull=False, discount__gt=0).values_list(
+            'product_id', 'promotion_id', 'promotion_name', 'discount', 'start_date', 'end_date'
+        )
+        for product_id, promotion_id, promotion_name, discount, start_date, end_date in rows:
+            promotions.setdefault(product_id, []).append(
+                (start_date, end_date, ActivePromotion(promotion_id, promotion_name, discount, end_date))
+            )
+        return promotions
+
+    def active_promotions(self, product_ids, on_date):
+        """То же, что apps.promotions.pricing.active_promotions, но из памяти (для PriceResolver)"""
+        with self._lock:
+            promotions = self.promotions
+        result = {}
+        for product_id in product_ids:
+            active = [
+                promotion for start_date, end_date, promotion in promotions.get(product_id, ())
+                if (start_date is None or start_date <= on_date) and (end_date is None or on_date <= end_date)
+            ]
+            if active:
+                # Наибольшая скидка, при равенстве — меньший promotion_id (как ORDER BY в SQL)
+                result[product_id] = min(active, key=lambda p: (-p.discount, p.promotion_id))
+        return result
+
+    def load(self):
+        """Полная перезагрузка (старт, переподключение, массовые изменения)"""
+        # Состояние читается раньше строк: изменение между чтениями даст новый ETag позже, а не устаревший ответ
+        state = catalog_state()
+        products = _load_rows(Products.objects.all())
+        children = self._load_categories()
+        promotions = self._load_promotions()
+        with self._lock:
+            self.products = products
+            self.children = children
+            self.promotions = promotions
+            self.state = state
+            self.ready = True
+            self.loaded_at = self.synced_at = time.time()
+            self.reloads += 1
+        logger.info(f"Снимок каталога загружен: {len(products)} товаров")
+
+    def refresh_products(self, product_ids):
+        """Перечитать указанные товары; удалённые из БД убираются из снимка"""
+        product_ids = set(product_ids)
+        if not product_ids:
+            return
+        rows = _load_rows(Products.objects.filter(product_id__in=product_ids))
+        with self._lock:
+            for product_id in product_ids:
+                if product_id in rows:
+                    self.products[product_id] = rows[product_id]
+                else:
+                    self.products.pop(product_id, None)
+            self.patched_rows += len(product_ids)
+
+    def apply(self, events):
+        """
+        Применить уведомления {'table', 'op', 'id'}.
+        Бренд и категория входят в ответ товара, поэтому их изменение
+        перечитывает товары этого бренда или категории.
+        """
+        state = catalog_state()
+        product_ids, brand_ids, category_ids = set(), set(), set()
+        promotions_changed = False
+        for event in events:
+            if event.get('table') == 'promotions':
+                # Акция без товара тоже приходит (id пустой): цены перечитываются целиком
+                promotions_changed = True
+                continue
+            try:
+                row_id = int(event.get('id'))
+            except (TypeError, ValueError):
+                continue
+            table = event.get('table')
+            if table in ('products', 'reviews'):
+                product_ids.add(row_id)
+            elif table == 'brands':
+                brand_ids.add(row_id)
+            elif table == 'categories':
+                category_ids.add(row_id)
+
+        if promotions_changed:
+            promotions = self._load_promotions()
+            with self._lock:
+                self.promotions = promotions
+
+        if category_ids:
+            children = self._load_categories()
+            with self._lock:
+                self.children = children
+
+        with self._lock:
+            for row in self.products.values():
+                if row.brand_id in brand_ids or row.category_id in category_ids:
+                    product_ids.add(row.product_id)
+
+        if len(product_ids) > FULL_RELOAD_THRESHOLD:
+            self.load()
+        else:
+            self.refresh_products(product_ids)
+            with self._lock:
+                self.state = state
+
+    def mark_synced(self):
+        self.synced_at = time.time()
+
+    def invalidate(self):
+        with self._lock:
+            self.ready = False
+
+    # ---------- чтение ----------
+
+    @property
+    def staleness(self):
+        return time.time() - self.synced_at if self.synced_at else None
+
+    def is_fresh(self):
+        staleness = self.staleness
+        return self.ready and staleness is not None and staleness <= MAX_STALENESS
+
+    def can_serve(self, params):
+        return self.is_fresh() and all(name in SUPPORTED_PARAMS for name in params.keys())
+
+    def _subtree(self, category_ids):
+        result, stack = set(), list(category_ids)
+        while stack:
+            category_id = stack.pop()
+            if category_id in result:
+                continue
+            result.add(category_id)
+            stack.extend(self.children.get(category_id, ()))
+        return result
+
+    def list(self, params):
+        """
+        Товары по фильтрам списка (те же правила, что в filter_products)
+        или None, если запрос должна обслужить БД.
+        """
+        if not self.can_serve(params):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            rows = list(self.products.values())
+            category_ids = _split_ints(params.get('category'))
+            subtree = self._subtree(category_ids) if category_ids else None
+
+        templates = set(_split_strings(params.get('template')))
+        brand_ids = set(_split_ints(params.get('brand')))
+        min_price = _parse_price(params.get('min_price'))
+        max_price = _parse_price(params.get('max_price'))
+        in_stock = _parse_bool(params.get('in_stock'))
+        statuses = set(_split_strings(params.get('status')))
+
+        if subtree is not None:
+            rows = [row for row in rows if row.category_id in subtree]
+        if templates:
+            rows = [row for row in rows if row.template in templates]
+        if brand_ids:
+            rows = [row for row in rows if row.brand_id in brand_ids]
+        if min_price is not None:
+            rows = [row for row in rows if row.price >= min_price]
+        if max_price is not None:
+            rows = [row for row in rows if row.price <= max_price]
+        if in_stock is not None:
+            rows = [row for row in rows if (row.stock_quantity > 0) == in_stock]
+        if statuses:
+            rows = [row for row in rows if row.status in statuses]
+
+        sort_rows(rows, SORT_ORDERINGS.get(params.get('sort', ''), DEFAULT_ORDERING))
+        with self._lock:
+            self.hits += 1
+        return rows
+
+    def validators(self, params):
+        """ETag/Last-Modified по состоянию каталога, на котором построен снимок — те же, что list_validators"""
+        return list_etag(self.state, params)
+
+    def stats(self):
+        staleness = self.staleness
+        return {
+            'ready': self.ready,
+            'products': len(self.products),
+            'hits': self.hits,
+            'misses': self.misses,
+            'reloads': self.reloads,
+            'patched_rows': self.patched_rows,
+            'staleness_seconds': round(staleness, 3) if staleness is not None else None,
+            'pid': os.getpid(),
+        }
+
+
+class CatalogListener(threading.Thread):
+    """Фоновый поток: LISTEN catalog_changes и применение изменений к снимку"""
+
+    def __init__(self, snapshot):
+        super().__init__(name='catalog-snapshot-listener', daemon=True)
+        self.snapshot = snapshot
+
+    def _connect(self):
+        db = connections['default']
+        conn = db.get_new_connection(db.get_connection_params())
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN {CHANNEL}')
+        return conn
+
+    def _listen(self, conn):
+        while True:
+            if select.select([conn], [], [], POLL_INTERVAL) != ([], [], []):
+                conn.poll()
+                events = []
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        events.append(json.loads(notify.payload))
+                    except ValueError:
+                        logger.warning(f"Некорректное уведомление {CHANNEL}: {notify.payload}")
+                if events:
+                    self.snapshot.apply(events)
+            self.snapshot.mark_synced()
+
+    def run(self):
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                # Загрузка после LISTEN: изменения во время загрузки не теряются
+                self.snapshot.load()
+                self._listen(conn)
+            except Exception as e:
+                logger.error(f"Снимок каталога: потеряна связь с БД: {e}")
+                self.snapshot.invalidate()
+                time.sleep(RECONNECT_DELAY)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                connection.close()
+
+
+_snapshot = None
+_snapshot_pid = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot():
+    """
+    Снимок текущего процесса или None, если он выключен.
+    Поток запускается лениво при первом обращении в каждом воркере
+    (после fork у gunicorn свой снимок в каждом процессе).
+    """
+    global _snapshot, _snapshot_pid
+    if not getattr(settings, 'CATALOG_SNAPSHOT_ENABLED', False):
+        return None
+    pid = os.getpid()
+    if _snapshot is None or _snapshot_pid != pid:
+        with _snapshot_lock:
+            if _snapshot is None or _snapshot_pid != pid:
+                _snapshot = CatalogSnapshot()
+                _snapshot_pid = pid
+                CatalogListener(_snapshot).start()
+    return _snapshot
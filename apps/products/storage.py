@@ -0,0 +1,105 @@
+# apps/products/storage.py
+"""
+Контентно-адресуемое хранилище загрузок в MEDIA_ROOT.
+
+Файл пишется во временный файл по частям с одновременным подсчётом sha256
+и сохраняется как <папка>/<h[:2]>/<sha256><расширение>. Одинаковые загрузки
+занимают место один раз, а содержимое по такому пути никогда не меняется —
+его можно кэшировать навсегда (см. main.media.serve_media).
+
+Файлы, на которые больше не ссылаются products.images, products.image_url,
+products.image_variants и brands.logo_url, удаляет команда gc_media.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from django.conf import settings
+
+ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg', '.avif'}
+DEFAULT_EXTENSION = '.bin'
+TMP_DIR = 'tmp'
+# Каталоги MEDIA_ROOT, которые обслуживает сборщик мусора
+MANAGED_DIRS = ('products', 'brands', 'derivatives')
+# Имя файла начинается с sha256 — содержимое неизменно
+HASHED_NAME_RE = re.compile(r'(?:^|/)[0-9a-f]{2}/[0-9a-f]{64}(?:-\d+)?\.[a-z0-9]+$')
+
+
+def _extension(filename):
+    ext = os.path.splitext(filename or '')[1].lower()
+    return ext if ext in ALLOWED_EXTENSIONS else DEFAULT_EXTENSION
+
+
+def store_upload(uploaded_file, folder):
+    """
+    Сохранить загруженный файл под именем по его содержимому.
+
+    Returns:
+        URL файла (MEDIA_URL + folder/ab/abcd….jpg)
+    """
+    media_root = str(settings.MEDIA_ROOT)
+    tmp_dir = os.path.join(media_root, TMP_DIR)
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    sha256 = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix='.upload')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in uploaded_file.chunks():
+                sha256.update(chunk)
+                f.write(chunk)
+
+        digest = sha256.hexdigest()
+        relative = f'{folder}/{digest[:2]}/{digest}{_extension(uploaded_file.name)}'
+        target = os.path.join(media_root, relative)
+        if os.path.exists(target):
+            # Такой файл уже есть — дубликат не сохраняем. Новая ссылка на него
+            # может ещё не попасть в БД: обновляем mtime, чтобы gc_media не удалил
+            # старый несвязанный файл до истечения --min-age-hours
+            os.remove(tmp_path)
+            os.utime(target)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return f'{settings.MEDIA_URL}{relative}'
+
+
+def is_immutable(relative_path):
+    return bool(HASHED_NAME_RE.search(relative_path.replace(os.sep, '/')))
+
+
+def referenced_media_paths():
+    """Относительные пути файлов MEDIA_ROOT, на которые ссылается БД"""
+    from apps.products.models import Brands, Products
+
+    media_url = settings.MEDIA_URL
+    urls = set()
+    for images, image_url, variants in Products.objects.values_list('images', 'image_url', 'image_variants').iterator():
+        urls.update(url for url in (images or []) if isinstance(url, str))
+        urls.add(image_url)
+        for sizes in (variants or {}).values():
+            urls.update((sizes or {}).values())
+    urls.update(Brands.objects.values_list('logo_url', flat=True))
+
+    return {
+        url[len(media_url):]
+        for url in urls
+        if isinstance(url, str) and url.startswith(media_url)
+    }
+
+
+def iter_managed_files():
+    """(относительный путь, абсолютный путь) файлов в MANAGED_DIRS и TMP_DIR"""
+    media_root = str(settings.MEDIA_ROOT)
+    for folder in MANAGED_DIRS + (TMP_DIR,):
+        for dirpath, _, filenames in os.walk(os.path.join(media_root, folder)):
+            for filename in filenames:
+                absolute = os.path.join(dirpath, filename)
+                yield os.path.relpath(absolute, media_root).replace(os.sep, '/'), absolute
@@ -0,0 +1,691 @@
+import io
+import os
+import tempfile
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.db.models.signals import post_save
+from django.http import QueryDict
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from PIL import Image
+
+from api.views import ProductViewSet
+from apps.products.batch import batch_products
+from apps.products.bulk_update import CONFLICT, SUPERSEDED, UNCHANGED, build_bulk_update_sql, clean_item, _row_result
+from apps.products.categories import REBUILD_SQL, TREE_CACHE_KEY, build_tree, get_tree
+from apps.products.compare import build_comparison, compare_signature, get_comparison
+from apps.products.conditional import CATALOG_STATE_SQL, _params_signature, list_validators
+from apps.products.derivatives import build_derivatives, schedule_product_derivatives
+from apps.products.facets import _build_facets, cache_key, get_facets, spec_keys_for
+from apps.products.filters import MAX_ID_PARTS, filter_products, get_ordering, parse_ids, spec_filters
+from apps.products.images import normalize_images
+from apps.products.importer import RowError, build_upsert_sql, clean_row, iter_file_rows
+from apps.products.models import Brands, Categories, Products
+from apps.products.search import normalize_query, prefix_query
+from apps.products.serializers import ProductSerializer
+from apps.products.snapshot import CatalogSnapshot, ProductRow
+from apps.promotions.pricing import PriceResolver
+
+
+class ProductListQueryBudgetTest(SimpleTestCase):
+    "Список товаров должен собираться одним SQL-запросом без N+1"
+
+    def _make_product(self, product_id, avg_rating):
+        product = Products(
+            product_id=product_id,
+            sku=f'SKU-{product_id}',
+            product_name=f'Товар {product_id}',
+            price=Decimal('1990.00'),
+            stock_quantity=3,
+            status='approved',
+            images=['/media/products/a.jpg'],
+        )
+        product.brand = Brands(brand_id=1, brand_name='Logitech', logo_url='/media/brands/logi.png')
+        product.category = Categories(category_id=2, category_name='Мыши', template='mouse')
+        product.avg_rating = avg_rating
+        return product
+
+    def test_queryset_joins_brand_category_and_rating_stats(self):
+        "queryset списка подтягивает бренд, категорию и агрегаты отзывов JOIN-ом"
+        queryset = ProductViewSet.queryset
+        self.assertEqual(set(queryset.query.select_related), {'brand', 'category'})
+        self.assertIn('avg_rating', queryset.query.annotations)
+
+        sql = str(queryset.query)
+        self.assertEqual(sql.count('SELECT'), 1)
+        self.assertNotIn('"reviews"', sql)
+        self.assertIn('JOIN "brands"', sql)
+        self.assertIn('JOIN "categories"', sql)
+        self.assertIn('JOIN "product_rating_stats"', sql)
+
+    def test_serializing_prefetched_products_runs_no_queries(self):
+        "Сериализация подготовленных товаров не обращается к БД (SimpleTestCase запрещает запросы)"
+        products = [self._make_product(i, avg) for i, avg in [(1, 4.25), (2, None), (3, 5)]]
+
+        data = ProductSerializer(products, many=True).data
+
+        self.assertEqual([item['rating'] for item in data], [4.2, None, 5.0])
+        self.assertEqual(data[0]['brand_name'], 'Logitech')
+        self.assertEqual(data[0]['brand_logo_url'], '/media/brands/logi.png')
+        self.assertEqual(data[0]['category_name'], 'Мыши')
+        self.assertEqual(data[0]['template'], 'mouse')
+        self.assertTrue(data[0]['is_in_stock'])
+
+
+class ProductFiltersTest(SimpleTestCase):
+    "Параметры /api/products/ превращаются в условия SQL, а не в фильтрацию в браузере"
+
+    def test_filters_build_where_clause(self):
+        "Цена, бренд, наличие и статус попадают в WHERE"
+        params = QueryDict('brand=3,x,5&min_price=100&max_price=2500.50&in_stock=true&status=approved')
+        sql = str(filter_products(Products.objects.all(), params).query)
+
+        self.assertIn('"products"."brand_id" IN (3, 5)', sql)
+        self.assertIn('"products"."price" >= 100', sql)
+        self.assertIn('"products"."price" <= 2500.50', sql)
+        self.assertIn('"products"."stock_quantity" > 0', sql)
+        self.assertIn('"products"."status" IN (approved)', sql)
+
+    def test_sort_parameter_sets_stable_ordering(self):
+        "Сортировка всегда заканчивается уникальным ключом, неизвестное значение -> по product_id"
+        self.assertEqual(get_ordering(QueryDict('sort=price-asc')), ('price', 'product_id'))
+        self.assertEqual(get_ordering(QueryDict('sort=price-desc')), ('-price', '-product_id'))
+        self.assertEqual(get_ordering(QueryDict('sort=bogus')), ('product_id',))
+
+        queryset = filter_products(Products.objects.all(), QueryDict('sort=name&min_price=abc'))
+        self.assertEqual(queryset.query.order_by, ('product_name', 'product_id'))
+        self.assertNotIn('WHERE', str(queryset.query))
+
+    def test_non_finite_and_huge_prices_are_not_passed_to_db(self):
+        for query in ('min_price=NaN', 'max_price=Infinity', 'min_price=-inf', 'max_price=1e999999'):
+            with self.subTest(query=query):
+                self.assertNotIn('WHERE', str(filter_products(Products.objects.all(), QueryDict(query)).query))
+
+        queryset = filter_products(Products.objects.all(), QueryDict('min_price=1e12'))
+        self.assertIn('>= 99999999.99', str(queryset.query))
+
+
+class ProductSearchTest(SimpleTestCase):
+    "Поиск идёт по search_vector (GIN-индекс), а не по ILIKE по всей таблице"
+
+    def test_q_filter_uses_prefix_tsquery(self):
+        "?q= в списке товаров превращается в to_tsquery с префиксами слов"
+        sql = str(filter_products(Products.objects.all(), QueryDict('q=ноут%20asu')).query)
+
+        self.assertIn('"products"."search_vector" @@', sql)
+        self.assertIn('to_tsquery', sql)
+        self.assertIn('ноут:* & asu:*', sql)
+        self.assertNotIn('LIKE', sql)
+
+    def test_query_normalization(self):
+        "Лишние пробелы схлопываются, длина ограничена, спецсимволы не попадают в tsquery"
+        self.assertEqual(normalize_query('  ноутбук   asus '), 'ноутбук asus')
+        self.assertEqual(len(normalize_query('x' * 1000)), 200)
+        self.assertIsNone(prefix_query('&|!'))
+        self.assertEqual(filter_products(Products.objects.all(), QueryDict('q=%26%21')).query.is_empty(), True)
+
+
+class ProductFacetsTest(SimpleTestCase):
+    "Счётчики фильтров каталога считаются в БД и кэшируются по набору фильтров"
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_spec_filter_uses_jsonb_containment(self):
+        "?specs.<ключ>= превращается в specifications @> (GIN idx_products_specifications)"
+        params = QueryDict('specs.ram=16GB&specs.ram=32GB&specs.size=27&specs.bad-key=1')
+        self.assertEqual(spec_filters(params), {'ram': ['16GB', '32GB'], 'diagonal': ['27']})
+
+        sql = str(filter_products(Products.objects.all(), params).query)
+        self.assertIn('"products"."specifications" @> \'{"ram": "16GB"}\'', sql)
+        self.assertIn('"products"."specifications" @> \'{"diagonal": 27}\'', sql)
+        self.assertIn('"products"."specifications" @> \'{"size": "27"}\'', sql)
+        self.assertNotIn('bad-key', sql)
+
+    def test_spec_keys_come_from_json_templates(self):
+        "Ключи берутся из static/json_templates для выбранного шаблона"
+        keys = spec_keys_for(QueryDict('template=laptop'))
+        self.assertIn('cpu', keys)
+        self.assertIn('ram', keys)
+        self.assertNotIn('brand', keys)
+        self.assertNotIn('dpi', keys)
+
+    def test_cache_key_ignores_paging_and_param_order(self):
+        self.assertEqual(
+            cache_key(QueryDict('brand=1&specs.ram=8GB&specs.ram=16GB&cursor=abc&sort=name')),
+            cache_key(QueryDict('specs.ram=16GB&specs.ram=8GB&brand=1')),
+        )
+        self.assertNotEqual(cache_key(QueryDict('brand=1')), cache_key(QueryDict('brand=2')))
+
+    def test_build_facets_merges_legacy_spec_keys(self):
+        facets = _build_facets([
+            ('brand', '1', 'LG', 3),
+            ('price', '2', None, 3),
+            ('stock', 'in_stock', None, 3),
+            ('spec:size', '27', None, 1),
+            ('spec:diagonal', '27', None, 2),
+        ], ['diagonal'])
+
+        self.assertEqual(facets['brand'], [{'id': 1, 'name': 'LG', 'count': 3}])
+        self.assertEqual(facets['price'], [{'min': 10000, 'max': 25000, 'count': 3}])
+        self.assertEqual(facets['stock'], {'in_stock': 3, 'out_of_stock': 0})
+        self.assertEqual(facets['specs'], {'diagonal': [{'value': '27', 'count': 3}]})
+
+    def test_cached_facets_do_not_hit_database(self):
+        "Повторный запрос с той же сигнатурой отдаётся из кэша (SimpleTestCase запрещает запросы)"
+        params = QueryDict('template=mouse&sort=price-asc')
+        cached = {'total': 0, 'brand': [], 'category': [], 'price': [], 'stock': {}, 'specs': {}}
+        cache.set(cache_key(params), cached)
+
+        self.assertEqual(get_facets(Products.objects.all(), QueryDict('template=mouse')), cached)
+
+
+class ProductConditionalGetTest(SimpleTestCase):
+    "Повторный запрос с актуальным ETag получает 304 без обращения к сериализатору и БД"
+
+    etag = '"p7-v3-r2.9"'
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    @mock.patch('api.views.product_validators', return_value=('"p7-v3-r2.9"', 1700000000))
+    def test_detail_returns_304_for_matching_etag(self, validators):
+        view = ProductViewSet.as_view({'get': 'retrieve'})
+        request = self.factory.get('/api/products/7/', HTTP_IF_NONE_MATCH=self.etag)
+
+        response = view(request, pk='7')
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(validators.call_args.args[1], '7')
+
+    @mock.patch('api.views.list_validators', return_value=('W/"abc"', 1700000000))
+    def test_list_returns_304_for_matching_weak_etag(self, validators):
+        view = ProductViewSet.as_view({'get': 'list'})
+
+        response = view(self.factory.get('/api/products/?brand=1', HTTP_IF_NONE_MATCH='W/"abc"'))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(validators.call_args.args[0]['brand'], '1')
+
+    def test_list_etag_follows_catalog_state(self):
+        moment = datetime(2026, 1, 5, 12, 0, tzinfo=dt_timezone.utc)
+        later = datetime(2026, 1, 5, 12, 5, tzinfo=dt_timezone.utc)
+        states = [(moment, None, 5, moment), (moment, None, 5, moment), (moment, later, 5, moment)]
+        with mock.patch('apps.products.conditional.catalog_state', side_effect=states):
+            first, last_modified = list_validators(QueryDict('brand=1'))
+            same, _ = list_validators(QueryDict('brand=1'))
+            rated, rated_modified = list_validators(QueryDict('brand=1'))
+
+        self.assertEqual(first, same)
+        self.assertNotEqual(first, rated)
+        self.assertEqual((last_modified, rated_modified), (int(moment.timestamp()), int(later.timestamp())))
+        self.assertIn('max(updated_at) FROM products', CATALOG_STATE_SQL)
+
+    def test_snapshot_and_database_give_same_etag(self):
+        state = (datetime(2026, 1, 5, tzinfo=dt_timezone.utc), None, 3, None)
+        snapshot = CatalogSnapshot()
+        snapshot.state = state
+        with mock.patch('apps.products.conditional.catalog_state', return_value=state):
+            self.assertEqual(snapshot.validators(QueryDict('sort=name')), list_validators(QueryDict('sort=name')))
+
+    def test_list_etag_depends_on_filters(self):
+        self.assertEqual(_params_signature(QueryDict('a=1&b=2')), _params_signature(QueryDict('b=2&a=1')))
+        self.assertNotEqual(_params_signature(QueryDict('brand=1')), _params_signature(QueryDict('brand=2')))
+
+
+class CatalogSnapshotTest(SimpleTestCase):
+    "Снимок каталога отдаёт список из памяти с теми же фильтрами, что и БД"
+
+    def _row(self, product_id, price, brand_id, category_id, stock=1, status='approved'):
+        product = Products(
+            product_id=product_id, sku=f'SKU-{product_id}', product_name=f'Товар {product_id}',
+            price=Decimal(price), stock_quantity=stock, status=status, images=[],
+        )
+        product.brand = Brands(brand_id=brand_id, brand_name=f'Бренд {brand_id}')
+        product.category = Categories(category_id=category_id, category_name='Мыши', template='mouse')
+        product.avg_rating = None
+        return ProductRow(product)
+
+    def _snapshot(self):
+        snapshot = CatalogSnapshot()
+        rows = [
+            self._row(1, '500', brand_id=1, category_id=10),
+            self._row(2, '1500', brand_id=2, category_id=11, stock=0),
+            self._row(3, '900', brand_id=1, category_id=12, status='pending'),
+        ]
+        snapshot.products = {row.product_id: row for row in rows}
+        snapshot.children = {None: [10], 10: [11]}
+        snapshot.state = (None, None, 1, None)
+        snapshot.ready = True
+        snapshot.mark_synced()
+        return snapshot
+
+    def test_filters_and_sort_match_list_endpoint(self):
+        snapshot = self._snapshot()
+        ids = lambda query: [row.product_id for row in snapshot.list(QueryDict(query))]
+
+        self.assertEqual(ids(''), [1, 2, 3])
+        self.assertEqual(ids('category=10'), [1, 2])
+        self.assertEqual(ids('brand=1&sort=price-desc'), [3, 1])
+        self.assertEqual(ids('in_stock=false'), [2])
+        self.assertEqual(ids('min_price=600&max_price=1000'), [3])
+        self.assertEqual(ids('status=approved&sort=new'), [2, 1])
+        self.assertEqual(ids('min_price=NaN&max_price=Infinity'), [1, 2, 3])
+        self.assertEqual(snapshot.hits, 7)
+
+    def test_unsupported_params_and_stale_snapshot_fall_back_to_database(self):
+        snapshot = self._snapshot()
+        self.assertIsNone(snapshot.list(QueryDict('q=мышь')))
+        self.assertIsNone(snapshot.list(QueryDict('specs.dpi=1600')))
+
+        snapshot.synced_at -= 60
+        self.assertIsNone(snapshot.list(QueryDict('page_size=24')))
+        self.assertEqual(snapshot.misses, 3)
+
+    def test_notifications_refresh_only_affected_products(self):
+        snapshot = self._snapshot()
+        with mock.patch.object(snapshot, 'refresh_products') as refresh, \
+                mock.patch('apps.products.snapshot.catalog_state', return_value=(None, None, 2, None)):
+            snapshot.apply([
+                {'table': 'reviews', 'op': 'INSERT', 'id': '3'},
+                {'table': 'brands', 'op': 'UPDATE', 'id': '2'},
+                {'table': 'products', 'op': 'DELETE', 'id': None},
+            ])
+        refresh.assert_called_once_with({2, 3})
+        # ETag снимка меняется вместе с перечитанными строками
+        self.assertEqual(snapshot.state, (None, None, 2, None))
+
+    @mock.patch('api.views.get_snapshot')
+    def test_list_is_served_from_snapshot_without_queries(self, get_snapshot):
+        get_snapshot.return_value = self._snapshot()
+        view = ProductViewSet.as_view({'get': 'list'})
+
+        response = view(RequestFactory().get('/api/products/?brand=1'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['product_id'] for item in response.data], [1, 3])
+        self.assertTrue(response['ETag'].startswith('W/'))
+
+    @mock.patch('api.views.get_snapshot')
+    def test_cursor_pages_are_served_from_snapshot(self, get_snapshot):
+        get_snapshot.return_value = self._snapshot()
+        view = ProductViewSet.as_view({'get': 'list'})
+
+        def walk(url):
+            ids = []
+            while url:
+                response = view(RequestFactory().get(url))
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response['ETag'].startswith('W/'))
+                ids += [item['product_id'] for item in response.data['results']]
+                url = response.data['next']
+            return ids
+
+        self.assertEqual(walk('/api/products/?page_size=1'), [1, 2, 3])
+        self.assertEqual(walk('/api/products/?page_size=2&sort=price-desc'), [2, 3, 1])
+        self.assertEqual(walk('/api/products/?page_size=1&sort=name&brand=1'), [1, 3])
+
+        response = view(RequestFactory().get('/api/products/?page_size=1&cursor=bad'))
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductImagesNormalizationTest(SimpleTestCase):
+    "images нормализуется при записи, чтение отдаёт сохранённый список как есть"
+
+    def test_legacy_representations_become_flat_url_list(self):
+        self.assertEqual(normalize_images(None), [])
+        self.assertEqual(normalize_images('/media/a.jpg'), ['/media/a.jpg'])
+        self.assertEqual(
+            normalize_images(['["/media/a.jpg", "blob:http://x/1"]', ' /media/a.jpg ', ['/media/b.jpg'], 7]),
+            ['/media/a.jpg', '/media/b.jpg'],
+        )
+        self.assertEqual(normalize_images('"[\\"/media/c.jpg\\"]"'), ['/media/c.jpg'])
+        self.assertEqual(len(normalize_images([f'/media/{i}.jpg' for i in range(9)])), 5)
+
+    def test_save_images_normalizes_existing_urls(self):
+        saved = ProductSerializer()._save_product_images([], '["/media/a.jpg", "/media/a.jpg", "blob:x"]')
+        self.assertEqual(saved, ['/media/a.jpg'])
+
+    def test_read_path_returns_stored_list(self):
+        product = Products(product_id=1, sku='S', product_name='Товар', price=Decimal('10'),
+                           stock_quantity=0, images=['/media/a.jpg', '/media/b.jpg'])
+        product.avg_rating = None
+        self.assertEqual(ProductSerializer(product).data['images'], ['/media/a.jpg', '/media/b.jpg'])
+
+        product.images = None
+        self.assertEqual(ProductSerializer(product).data['images'], [])
+
+
+class ProductImageDerivativesTest(SimpleTestCase):
+    "WebP-копии строятся вне запроса и отдаются в API как srcset"
+
+    def test_build_derivatives_uses_content_hash_and_never_upscales(self):
+        with tempfile.TemporaryDirectory() as root:
+            source = os.path.join(root, 'a.jpg')
+            Image.new('RGB', (800, 600), 'red').save(source)
+
+            result = build_derivatives(source, root)
+
+            self.assertEqual(list(result), [320, 640, 800])
+            for relative in result.values():
+                self.assertRegex(relative, r'^derivatives/[0-9a-f]{2}/[0-9a-f]{64}-\d+\.webp$')
+                with Image.open(os.path.join(root, relative)) as image:
+                    self.assertEqual(image.format, 'WEBP')
+            # Тот же файл под другим именем даёт те же копии
+            copy = os.path.join(root, 'b.jpg')
+            with open(source, 'rb') as src, open(copy, 'wb') as dst:
+                dst.write(src.read())
+            self.assertEqual(build_derivatives(copy, root), result)
+
+    def test_force_rewrites_existing_derivatives(self):
+        with tempfile.TemporaryDirectory() as root:
+            source = os.path.join(root, 'a.jpg')
+            Image.new('RGB', (300, 200), 'red').save(source)
+            relative = build_derivatives(source, root)[300]
+            absolute = os.path.join(root, relative)
+            with open(absolute, 'wb') as broken:
+                broken.write(b'broken')
+
+            build_derivatives(source, root)
+            with open(absolute, 'rb') as f:
+                self.assertEqual(f.read(), b'broken')
+
+            build_derivatives(source, root, force=True)
+            with Image.open(absolute) as image:
+                self.assertEqual(image.format, 'WEBP')
+
+    @override_settings(MEDIA_URL='/media/', MEDIA_ROOT='/srv/media')
+    def test_scheduling_waits_for_commit_and_skips_external_urls(self):
+        with mock.patch('apps.products.derivatives.transaction.on_commit') as on_commit, \
+                mock.patch('apps.products.derivatives.get_pool') as get_pool:
+            schedule_product_derivatives(1, ['https://cdn.example.com/x.jpg', '/media/../etc/passwd'])
+            on_commit.assert_not_called()
+
+            schedule_product_derivatives(1, ['/media/products/a.jpg'])
+            on_commit.assert_called_once()
+            get_pool.assert_not_called()
+
+            on_commit.call_args.args[0]()
+            submitted = get_pool.return_value.submit.call_args.args
+            self.assertEqual(submitted[1:], ('/srv/media/products/a.jpg', '/srv/media'))
+
+    def test_api_exposes_srcset_for_ready_images(self):
+        product = Products(product_id=1, sku='S', product_name='Товар', price=Decimal('10'), stock_quantity=1,
+                           images=['/media/a.jpg', '/media/b.jpg'],
+                           image_variants={'/media/a.jpg': {'640': '/media/d/a-640.webp', '320': '/media/d/a-320.webp'}})
+        product.avg_rating = None
+
+        data = ProductSerializer(product).data
+
+        self.assertEqual(data['image_srcset'], {'/media/a.jpg': '/media/d/a-320.webp 320w, /media/d/a-640.webp 640w'})
+
+
+class ProductImportTest(SimpleTestCase):
+    "Разбор файла импорта и сборка upsert-запроса"
+
+    def test_csv_headers_from_admin_export_and_semicolon_dialect(self):
+        data = 'SKU;Product Name;Price;Stock Quantity;Brand;Unknown\nA-1;Мышь;1 990,50;3;Logitech;x\n;;;;;\n'
+        rows = iter_file_rows(io.BytesIO(('\ufeff' + data).encode('utf-8')), 'catalog.csv')
+
+        self.assertEqual(next(rows), ['sku', 'product_name', 'price', 'stock_quantity', 'brand_name'])
+        row_num, raw = next(rows)
+        self.assertEqual(row_num, 2)
+        self.assertEqual(clean_row(raw)[:5], ('A-1', 'Мышь', None, Decimal('1990.50'), 3))
+        self.assertEqual(clean_row(raw)[8], 'Logitech')
+        # Пустая строка пропускается
+        self.assertEqual(list(rows), [])
+
+    def test_xlsx_numeric_sku(self):
+        from openpyxl import Workbook
+        workbook = Workbook()
+        workbook.active.append(['sku', 'price', 'stock_quantity'])
+        workbook.active.append([12345, 10.5, 2.0])
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        buffer.seek(0)
+
+        rows = iter_file_rows(buffer, 'catalog.xlsx')
+        next(rows)
+        _, raw = next(rows)
+
+        cleaned = clean_row(raw)
+        self.assertEqual((cleaned[0], cleaned[3], cleaned[4]), ('12345', Decimal('10.50'), 2))
+
+    def test_file_without_sku_column_is_rejected(self):
+        with self.assertRaises(ValueError):
+            next(iter_file_rows(io.BytesIO(b'name,price\nx,1\n'), 'catalog.csv'))
+        with self.assertRaises(ValueError):
+            next(iter_file_rows(io.BytesIO(b''), 'catalog.pdf'))
+
+    def test_row_validation(self):
+        invalid = [
+            {'sku': ''},
+            {'sku': 'A', 'price': '0'},
+            {'sku': 'A', 'price': 'abc'},
+            {'sku': 'A', 'stock_quantity': '-1'},
+            {'sku': 'A', 'stock_quantity': '1.5'},
+            {'sku': 'A', 'status': 'deleted'},
+            {'sku': 'A', 'specifications': '[1, 2]'},
+            {'sku': 'A' * 51},
+            # Не помещаются в колонки products / staging-таблицы
+            {'sku': 'A', 'price': 'NaN'},
+            {'sku': 'A', 'price': 'Infinity'},
+            {'sku': 'A', 'price': '1e20'},
+            {'sku': 'A', 'stock_quantity': 'Infinity'},
+            {'sku': 'A', 'stock_quantity': str(2 ** 31)},
+            {'sku': 'A', 'category_id': '1e30'},
+            {'sku': 'A', 'category_name': 'К' * 101},
+            {'sku': 'A', 'brand_name': 'B' * 101},
+        ]
+        for raw in invalid:
+            with self.subTest(raw=raw), self.assertRaises(RowError):
+                clean_row(raw)
+
+        cleaned = clean_row({'sku': 'A', 'specifications': '{"dpi": 1600}', 'status': 'approved'})
+        self.assertEqual((cleaned[10], cleaned[11]), ('approved', '{"dpi": 1600}'))
+
+    def test_upsert_touches_only_columns_from_file(self):
+        sql = build_upsert_sql(['price', 'stock_quantity'])
+
+        self.assertIn('INSERT INTO products AS p (sku, price, stock_quantity)', sql)
+        self.assertIn('price = COALESCE(EXCLUDED.price, p.price)', sql)
+        self.assertNotIn('product_name = ', sql)
+        self.assertIn('COALESCE(s.stock_quantity, 0)', sql)
+        # Аудит — одна вставка в том же запросе, включая PRICE_CHANGE
+        self.assertEqual(sql.count('INSERT INTO audit_log'), 1)
+        self.assertIn("'PRICE_CHANGE'", sql)
+
+
+class ProductBulkUpdateTest(SimpleTestCase):
+    "Пакетное изменение цен и остатков"
+
+    def test_item_validation(self):
+        self.assertEqual(clean_item({'sku': ' A-1 ', 'price': '10', 'row_version': '3'}),
+                         (None, 'A-1', Decimal('10.00'), None, 3))
+        for item in ({'price': '10'}, {'sku': 'A'}, {'sku': 'A', 'price': '-1'},
+                     {'product_id': 0, 'price': 1}, 'A-1',
+                     # Значения, которые переполнили бы приведения %s::int / ::numeric
+                     {'product_id': 1, 'price': 'NaN'}, {'product_id': 1, 'stock_quantity': 'Infinity'},
+                     {'product_id': '1e30', 'price': 1}, {'product_id': 1, 'price': '1e12'},
+                     {'product_id': 1, 'price': 1, 'row_version': str(2 ** 63)}):
+            with self.subTest(item=item), self.assertRaises(RowError):
+                clean_item(item)
+
+    def test_single_statement_with_ordered_locks(self):
+        sql = build_bulk_update_sql(3)
+
+        self.assertEqual(sql.count('%s'), 3 * 6 + 1)
+        self.assertIn('ORDER BY p.product_id\n            FOR UPDATE', sql)
+        self.assertEqual(sql.count('UPDATE products'), 1)
+        self.assertEqual(sql.count('INSERT INTO audit_log'), 1)
+
+    def test_row_results(self):
+        self.assertEqual(_row_result(5, 7, True, None, None)['status'], UNCHANGED)
+        self.assertEqual(_row_result(5, 7, False, None, 6), {'status': CONFLICT, 'product_id': 5, 'row_version': 7})
+        self.assertEqual(_row_result(5, 7, False, None, None)['status'], SUPERSEDED)
+        self.assertEqual(_row_result(5, 7, False, None, 7)['status'], SUPERSEDED)
+
+    def test_endpoint_reports_invalid_rows_without_touching_db(self):
+        view = ProductViewSet.as_view({'post': 'bulk_update'})
+        request = RequestFactory().post('/api/products/bulk-update/', {'items': [{'sku': 'A'}]},
+                                        content_type='application/json')
+
+        with mock.patch('api.views.ProductViewSet.get_permissions', return_value=[]), \
+                mock.patch('apps.users.decorators.get_user_from_request', return_value=(None, None)), \
+                mock.patch('apps.products.bulk_update.connection') as connection:
+            response = view(request)
+
+        connection.cursor.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['summary'], {'invalid': 1})
+
+
+class ProductBatchTest(SimpleTestCase):
+    "Облегчённые карточки товаров корзины"
+
+    ROWS = [
+        {'product_id': 1, 'product_name': 'Мышь', 'price': Decimal('990.00'), 'stock_quantity': 0,
+         'images': [], 'image_url': '/media/a.jpg'},
+        {'product_id': 3, 'product_name': 'Клавиатура', 'price': Decimal('2490.00'), 'stock_quantity': 4,
+         'images': ['/media/b.jpg', '/media/c.jpg'], 'image_url': None},
+    ]
+
+    def test_parse_ids(self):
+        self.assertEqual(parse_ids('3, 1,x,3,-2', 10), [3, 1])
+        self.assertEqual(parse_ids([5, '6', None, 5], 10), [5, 6])
+        self.assertEqual(parse_ids('1,2,3', 2), [1, 2])
+        self.assertEqual(parse_ids(None, 10), [])
+        # Повторы не вытесняют следующие id; разбор ограничен MAX_ID_PARTS значениями
+        self.assertEqual(parse_ids('1,1,1,1,2', 2), [1, 2])
+        self.assertEqual(parse_ids(['1'] * MAX_ID_PARTS + ['2'], 2), [1])
+        self.assertEqual(parse_ids(','.join(map(str, range(1, 100000))), 3), [1, 2, 3])
+
+    def test_one_query_in_requested_order(self):
+        with mock.patch('apps.products.batch.Products.objects') as objects:
+            objects.filter.return_value.values.return_value = self.ROWS
+            result = batch_products([3, 2, 1], PriceResolver(fetch=lambda ids, on_date: {}))
+
+        objects.filter.assert_called_once_with(product_id__in=[3, 2, 1])
+        self.assertEqual([p['product_id'] for p in result], [3, 1])
+        self.assertEqual(result[0], {'product_id': 3, 'product_name': 'Клавиатура', 'price': '2490.00',
+                                     'base_price': '2490.00', 'discount': None,
+                                     'stock_quantity': 4, 'image': '/media/b.jpg', 'is_in_stock': True})
+        self.assertEqual((result[1]['image'], result[1]['is_in_stock']), ('/media/a.jpg', False))
+
+    def test_endpoint_accepts_get_and_post(self):
+        view = ProductViewSet.as_view({'get': 'batch', 'post': 'batch'})
+        factory = RequestFactory()
+        with mock.patch('api.views.batch_products', return_value=[]) as batch:
+            view(factory.get('/api/products/batch/', {'ids': '3,1'}))
+            view(factory.post('/api/products/batch/', {'ids': [7, 8]}, content_type='application/json'))
+
+        self.assertEqual([c.args[0] for c in batch.call_args_list], [[3, 1], [7, 8]])
+
+
+class CategoryTreeTest(SimpleTestCase):
+    "Материализованный путь категорий: поддерево одним запросом, дерево из кэша"
+
+    def setUp(self):
+        cache.clear()
+
+    def test_subtree_filter_is_single_range_query(self):
+        "Фильтр по категории — подзапрос с диапазоном по path, без рекурсии"
+        sql = str(filter_products(Products.objects.all(), QueryDict('category=5,7')).query)
+
+        self.assertIn('"products"."category_id" IN (', sql)
+        self.assertIn("c.path >= r.path AND c.path < r.path || '~'", sql)
+        self.assertNotIn('RECURSIVE', sql)
+
+    def test_rebuild_reports_categories_outside_tree(self):
+        self.assertIn('WITH RECURSIVE', REBUILD_SQL)
+        self.assertIn('NOT IN (SELECT category_id FROM tree)', REBUILD_SQL)
+
+    def test_build_tree_nests_rows_ordered_by_path(self):
+        rows = [
+            (1, 'Компьютеры', None, None, 0),
+            (5, 'Периферия', 1, None, 1),
+            (12, 'Мыши', 5, 'mouse', 2),
+            (2, 'Телефоны', None, 'phone', 0),
+        ]
+        tree = build_tree(rows)
+
+        self.assertEqual([node['category_id'] for node in tree], [1, 2])
+        mice = tree[0]['children'][0]['children'][0]
+        self.assertEqual((mice['category_id'], mice['template'], mice['depth']), (12, 'mouse', 2))
+        self.assertEqual(tree[1]['children'], [])
+
+    def test_tree_is_cached_until_category_saved(self):
+        with mock.patch('apps.products.models.Categories.objects') as objects:
+            objects.order_by.return_value.values_list.return_value = [(1, 'Мыши', None, 'mouse', 0)]
+            get_tree()
+            get_tree()
+        self.assertEqual(objects.order_by.call_count, 1)
+
+        with mock.patch('apps.products.categories.transaction.on_commit', side_effect=lambda f: f()):
+            post_save.send(sender=Categories, instance=Categories(category_id=1), created=False)
+        self.assertIsNone(cache.get(TREE_CACHE_KEY))
+
+
+class ProductCompareTest(SimpleTestCase):
+    "Сравнение товаров: матрица по шаблону категории и кэш по версиям"
+
+    def _row(self, product_id, template, specs, price='1000.00'):
+        return {
+            'product_id': product_id, 'product_name': f'Товар {product_id}', 'price': Decimal(price),
+            'stock_quantity': 1, 'images': [], 'image_url': None, 'specifications': specs,
+            'category__category_name': 'Мыши', 'category__template': template, 'brand__brand_name': 'Logi',
+            'rating_stats__review_count': 2, 'rating_stats__rating_sum': 9,
+        }
+
+    def setUp(self):
+        cache.clear()
+
+    def test_specs_aligned_by_template_and_differences_marked(self):
+        rows = [
+            self._row(1, 'mouse', {'dpi': '1600', 'brand': 'Logi', 'color': 'black'}),
+            self._row(2, 'mouse', {'dpi': '800', 'connection': ' USB ', 'color': 'Black'}),
+            self._row(3, 'monitor', {'size': '27"'}),
+        ]
+        data = build_comparison(rows, [2, 1, 3])
+
+        self.assertEqual([p['product_id'] for p in data['products']], [2, 1, 3])
+        self.assertEqual(data['products'][0]['rating'], 4.5)
+        mice, monitors = data['groups']
+        self.assertEqual(mice['product_ids'], [2, 1])
+        attributes = {a['key']: a for a in mice['attributes']}
+        # Ключи шаблона идут первыми и в его порядке, пустые строки не попадают в матрицу
+        self.assertEqual([a['key'] for a in mice['attributes']], ['dpi', 'connection', 'color'])
+        self.assertEqual(attributes['dpi'], {'key': 'dpi', 'values': ['800', '1600'], 'differs': True})
+        self.assertEqual(attributes['connection']['values'], ['USB', None])
+        self.assertFalse(attributes['color']['differs'])
+        self.assertEqual((mice['differing_count'], mice['price_differs']), (2, False))
+        # Старые ключи приводятся к актуальным (size -> diagonal)
+        self.assertEqual(monitors['attributes'][0]['key'], 'diagonal')
+
+    def test_cache_key_follows_row_versions(self):
+        versions = [(1, 4, 2, 9), (2, 7, None, None)]
+        self.assertEqual(compare_signature(versions), compare_signature(list(reversed(versions))))
+        self.assertNotEqual(compare_signature(versions), compare_signature([(1, 5, 2, 9), (2, 7, None, None)]))
+
+        with mock.patch('apps.products.compare.Products.objects') as objects:
+            objects.filter.return_value.values_list.return_value = versions
+            objects.filter.return_value.values.return_value = [self._row(1, 'mouse', {}), self._row(2, 'mouse', {})]
+            first, etag = get_comparison([1, 2])
+            second, same_etag = get_comparison([1, 2])
+
+        self.assertEqual(objects.filter.return_value.values.call_count, 1)
+        self.assertEqual((first, etag), (second, same_etag))
+
+    def test_endpoint_returns_304_for_matching_etag(self):
+        view = ProductViewSet.as_view({'get': 'compare'})
+        factory = RequestFactory()
+        with mock.patch('api.views.get_comparison', return_value=({'products': [], 'groups': []}, '"cabc"')) as compare:
+            response = view(factory.get('/api/products/compare/', {'ids': '3,1'}))
+            cached = view(factory.get('/api/products/compare/', {'ids': '3,1'}, HTTP_IF_NONE_MATCH='"cabc"'))
+            missing = view(factory.get('/api/products/compare/'))
+
+        compare.assert_called_with([3, 1])
+        self.assertEqual((response.status_code, response['ETag']), (200, '"cabc"'))
+        self.assertEqual((cached.status_code, missing.status_code), (304, 400))
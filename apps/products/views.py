@@ -9,6 +9,8 @@ from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnl
 from apps.products.models import Brands, Categories, Products
 from .serializers import BrandSerializer, CategorySerializer, ProductSerializer
 from apps.users.models import Users
+from api.pagination import ProductCursorPagination
+from apps.products.filters import filter_products
 import os
 from django.conf import settings
 
@@ -75,10 +77,18 @@ class CategoryViewSet(viewsets.ModelViewSet):
     
 # === ПРОДУКТЫ ===
 class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Products.objects.all()
+    queryset = ProductSerializer.setup_eager_loading(Products.objects.all()).order_by('product_id')
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
     permission_classes = [AllowAny]  # Разрешаем всем доступ к продуктам
 
+    def get_queryset(self):
+        """Фильтры и сортировка списка: ?category=&brand=&min_price=&max_price=&in_stock=&status=&sort="""
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = filter_products(queryset, self.request.query_params)
+        return queryset
+
     def get_permissions(self):
         """
         Instantiates and returns the list of permissions that this view requires.
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PromotionsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.promotions'
+
+    def ready(self):
+        from apps.promotions.pricing import connect_signals
+        connect_signals()
@@ -0,0 +1,165 @@
+# apps/promotions/pricing.py
+"""
+Цены с учётом акций (promotions.discount — скидка в процентах).
+
+Действующая акция товара на дату ищется одним запросом по GiST-индексу
+(product_id, daterange(start_date, end_date, '[]')) из РАЗДЕЛА 12
+dbSNDshop.sql: пустая дата начала или окончания — открытый конец периода.
+Если на дату действует несколько акций, берётся наибольшая скидка.
+
+PriceResolver запоминает найденные акции, поэтому в пределах запроса
+(get_price_resolver) каталог, корзина и оформление заказа видят одни и те же
+цены, а каждый товар проверяется в БД не больше одного раза.
+"""
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+VERSION_KEY = 'promotions:version'
+CENT = Decimal('0.01')
+
+ActivePromotion = namedtuple('ActivePromotion', 'promotion_id promotion_name discount end_date')
+
+ACTIVE_PROMOTIONS_SQL = """
+    SELECT DISTINCT ON (ids.product_id)
+        ids.product_id, p.promotion_id, p.promotion_name, p.discount, p.end_date
+    FROM unnest(%s::int[]) AS ids (product_id)
+    JOIN promotions p
+        ON p.product_id = ids.product_id
+       AND daterange(p.start_date, p.end_date, '[]') @> %s::date
+    WHERE p.discount > 0
+    ORDER BY ids.product_id, p.discount DESC, p.promotion_id
+"""
+
+
+def discounted(price, discount):
+    """Цена после скидки discount % с округлением до копеек"""
+    price = Decimal(price)
+    if not discount:
+        return price
+    return (price * (100 - Decimal(discount)) / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def active_promotions(product_ids, on_date):
+    """{product_id: ActivePromotion} для товаров, у которых на дату есть акция"""
+    if not product_ids:
+        return {}
+    with connection.cursor() as cursor:
+        cursor.execute(ACTIVE_PROMOTIONS_SQL, [list(product_ids), on_date])
+        return {row[0]: ActivePromotion(*row[1:]) for row in cursor.fetchall()}
+
+
+class PriceResolver:
+    """Действующие цены на одну дату с запоминанием уже найденных акций"""
+
+    def __init__(self, on_date=None, fetch=None):
+        """fetch(product_ids, on_date) -> {product_id: ActivePromotion}; по умолчанию — запрос к БД"""
+        self.on_date = on_date or timezone.localdate()
+        self._fetch = fetch or active_promotions
+        self._promotions = {}
+
+    def promotions(self, product_ids):
+        """{product_id: ActivePromotion}; в БД запрашиваются только ещё не проверенные товары"""
+        missing = {product_id for product_id in product_ids if product_id not in self._promotions}
+        if missing:
+            found = self._fetch(sorted(missing), self.on_date)
+            for product_id in missing:
+                self._promotions[product_id] = found.get(product_id)
+        return {
+            product_id: self._promotions[product_id]
+            for product_id in product_ids
+            if self._promotions.get(product_id) is not None
+        }
+
+    def prices(self, base_prices):
+        """{product_id: базовая цена} -> {product_id: цена со скидкой}"""
+        promotions = self.promotions(list(base_prices))
+        return {
+            product_id: discounted(price, promotions[product_id].discount) if product_id in promotions else Decimal(price)
+            for product_id, price in base_prices.items()
+        }
+
+    def apply(self, items, price_key='price'):
+        """
+        Дописать в словари товаров effective_price, discount и promotion (или None).
+        price_key — поле базовой цены; список и словари меняются на месте.
+        """
+        ids = [item['product_id'] for item in items if item.get(price_key) is not None]
+        promotions = self.promotions(ids)
+        for item in items:
+            promotion = promotions.get(item['product_id'])
+            price = item.get(price_key)
+            item['effective_price'] = None if price is None else str(
+                discounted(price, promotion.discount) if promotion else Decimal(price)
+            )
+            item['discount'] = str(promotion.discount) if promotion else None
+            item['promotion'] = {
+                'promotion_id': promotion.promotion_id,
+                'promotion_name': promotion.promotion_name,
+                'end_date': promotion.end_date.isoformat() if promotion.end_date else None,
+            } if promotion else None
+        return items
+
+
+def order_items_total(items, resolver):
+    """Сумма строк [{product_id, quantity}] по действующим ценам; некорректные строки пропускаются"""
+    from apps.products.models import Products
+
+    quantities = {}
+    for item in items:
+        try:
+            product_id, quantity = int(item.get('product_id')), int(item.get('quantity', 1))
+        except (AttributeError, TypeError, ValueError):
+            continue
+        if quantity > 0:
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+    if not quantities:
+        return Decimal('0')
+    base_prices = dict(Products.objects.filter(product_id__in=list(quantities)).values_list('product_id', 'price'))
+    prices = resolver.prices(base_prices)
+    return sum((prices[product_id] * quantities[product_id] for product_id in prices), Decimal('0'))
+
+
+def get_price_resolver(request):
+    """Один PriceResolver на HTTP-запрос (DRF Request или HttpRequest)"""
+    request = getattr(request, '_request', request)
+    resolver = getattr(request, 'price_resolver', None)
+    if resolver is None:
+        resolver = request.price_resolver = PriceResolver()
+    return resolver
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = 1
+        cache.add(VERSION_KEY, version, None)
+    return version
+
+
+def pricing_token():
+    """Часть ETag ответов с ценами: меняется в полночь и при изменении акций через приложение"""
+    return f'{timezone.localdate():%Y%m%d}.{_version()}'
+
+
+def invalidate_prices(**kwargs):
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 2, None)
+
+
+def on_promotion_changed(**kwargs):
+    transaction.on_commit(invalidate_prices)
+
+
+def connect_signals():
+    from django.db.models.signals import post_delete, post_save
+
+    from apps.promotions.models import Promotions
+
+    post_save.connect(on_promotion_changed, sender=Promotions, dispatch_uid='pricing_promotion_saved')
+    post_delete.connect(on_promotion_changed, sender=Promotions, dispatch_uid='pricing_promotion_deleted')
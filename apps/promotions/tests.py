@@ -1,3 +1,71 @@
-from django.test import TestCase
+from datetime import date
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from apps.products.snapshot import CatalogSnapshot
+from apps.promotions.pricing import (
+    ACTIVE_PROMOTIONS_SQL, ActivePromotion, PriceResolver, discounted, invalidate_prices,
+    order_items_total, pricing_token,
+)
+
+
+class PricingTest(SimpleTestCase):
+    "Цены со скидками по акциям: одна выборка на запрос и одинаковый результат из БД и снимка"
+
+    SALE = ActivePromotion(5, 'Чёрная пятница', Decimal('15.00'), date(2026, 11, 30))
+
+    def test_discount_rounds_to_kopecks(self):
+        self.assertEqual(discounted(Decimal('999.99'), Decimal('15.00')), Decimal('849.99'))
+        self.assertEqual(discounted(Decimal('100.00'), Decimal('33.33')), Decimal('66.67'))
+        self.assertEqual(discounted(Decimal('100.00'), None), Decimal('100.00'))
+
+    def test_lookup_is_one_indexed_query_by_period(self):
+        self.assertIn("daterange(p.start_date, p.end_date, '[]') @> %s::date", ACTIVE_PROMOTIONS_SQL)
+        self.assertIn('DISTINCT ON (ids.product_id)', ACTIVE_PROMOTIONS_SQL)
+
+    def test_resolver_memoizes_per_request(self):
+        fetch = mock.Mock(side_effect=lambda ids, on_date: {1: self.SALE} if 1 in ids else {})
+        resolver = PriceResolver(on_date=date(2026, 11, 27), fetch=fetch)
+
+        prices = resolver.prices({1: Decimal('1000.00'), 2: Decimal('500.00')})
+        items = resolver.apply([{'product_id': 1, 'price': '1000.00'}, {'product_id': 3, 'price': '10.00'}])
+
+        self.assertEqual(prices, {1: Decimal('850.00'), 2: Decimal('500.00')})
+        self.assertEqual([call.args[0] for call in fetch.call_args_list], [[1, 2], [3]])
+        self.assertEqual(
+            (items[0]['effective_price'], items[0]['discount'], items[0]['promotion']['end_date']),
+            ('850.00', '15.00', '2026-11-30'),
+        )
+        self.assertEqual((items[1]['effective_price'], items[1]['promotion']), ('10.00', None))
+
+    def test_snapshot_resolves_same_promotion_in_memory(self):
+        snapshot = CatalogSnapshot()
+        smaller = ActivePromotion(6, 'Неделя мышей', Decimal('5.00'), None)
+        expired = ActivePromotion(7, 'Лето', Decimal('50.00'), date(2026, 8, 31))
+        snapshot.promotions = {1: [
+            (date(2026, 11, 1), None, smaller),
+            (date(2026, 11, 20), self.SALE.end_date, self.SALE),
+            (date(2026, 6, 1), expired.end_date, expired),
+        ]}
+
+        self.assertEqual(snapshot.active_promotions([1, 2], date(2026, 11, 27)), {1: self.SALE})
+        self.assertEqual(snapshot.active_promotions([1], date(2026, 12, 5)), {1: smaller})
+
+    def test_order_total_uses_effective_prices(self):
+        resolver = PriceResolver(fetch=lambda ids, on_date: {1: self.SALE})
+        with mock.patch('apps.products.models.Products.objects') as objects:
+            objects.filter.return_value.values_list.return_value = [(1, Decimal('1000.00')), (2, Decimal('99.50'))]
+            total = order_items_total(
+                [{'product_id': 1, 'quantity': 2}, {'product_id': '2'}, {'product_id': 'x'}], resolver
+            )
+
+        self.assertEqual(total, Decimal('1799.50'))
+
+    def test_pricing_token_changes_with_promotions(self):
+        cache.clear()
+        before = pricing_token()
+        invalidate_prices()
+        self.assertNotEqual(pricing_token(), before)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.sql_services import RatingStatsService
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает таблицу product_rating_stats из таблицы reviews'
+
+    def handle(self, *args, **options):
+        result = RatingStatsService.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"product_rating_stats пересобрана: товаров {result['products']}, отзывов {result['reviews']}"
+        ))
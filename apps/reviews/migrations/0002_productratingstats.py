@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+        ('reviews', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRatingStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='rating_stats', serialize=False, to='products.products')),
+                ('review_count', models.IntegerField()),
+                ('rating_sum', models.IntegerField()),
+                ('stars_1', models.IntegerField()),
+                ('stars_2', models.IntegerField()),
+                ('stars_3', models.IntegerField()),
+                ('stars_4', models.IntegerField()),
+                ('stars_5', models.IntegerField()),
+                ('last_review_date', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'product_rating_stats',
+                'managed': False,
+            },
+        ),
+    ]
@@ -21,3 +21,40 @@ class Reviews(models.Model):
     class Meta:
         managed = False
         db_table = 'reviews'
+
+
+class ProductRatingStats(models.Model):
+    """
+    Денормализованные агрегаты отзывов по товару (таблица product_rating_stats).
+    Поддерживается триггером trg_update_product_rating_stats на reviews.
+    Основные счётчики (карточка товара) учитывают все отзывы, кроме отклонённых
+    модерацией; approved_* — только одобренные (отчёт vw_product_ratings).
+    """
+    product = models.OneToOneField(Products, models.DO_NOTHING, primary_key=True, related_name='rating_stats')
+    review_count = models.IntegerField()
+    rating_sum = models.IntegerField()
+    stars_1 = models.IntegerField()
+    stars_2 = models.IntegerField()
+    stars_3 = models.IntegerField()
+    stars_4 = models.IntegerField()
+    stars_5 = models.IntegerField()
+    last_review_date = models.DateTimeField(blank=True, null=True)
+    approved_count = models.IntegerField()
+    approved_sum = models.IntegerField()
+    approved_stars_1 = models.IntegerField()
+    approved_stars_2 = models.IntegerField()
+    approved_stars_3 = models.IntegerField()
+    approved_stars_4 = models.IntegerField()
+    approved_stars_5 = models.IntegerField()
+    approved_last_review_date = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'product_rating_stats'
+
+    @property
+    def avg_rating(self):
+        if not self.review_count:
+            return None
+        return self.rating_sum / self.review_count
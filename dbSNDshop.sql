@@ -889,5 +889,725 @@ CREATE INDEX IF NOT EXISTS idx_audit_log_timestamp ON audit_log(timestamp DESC);
 CREATE INDEX IF NOT EXISTS idx_audit_log_action_type ON audit_log(action_type);
 CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(order_date DESC);
 CREATE INDEX IF NOT EXISTS idx_products_category_status ON products(category_id, status);
+-- Фильтры и сортировка каталога (/api/products/?min_price=&max_price=&brand=&sort=)
+CREATE INDEX IF NOT EXISTS idx_products_price ON products(price, product_id);
+CREATE INDEX IF NOT EXISTS idx_products_brand_price ON products(brand_id, price);
+CREATE INDEX IF NOT EXISTS idx_products_category_price ON products(category_id, price);
 CREATE INDEX IF NOT EXISTS idx_inventory_quantity ON inventory(quantity);
-CREATE INDEX IF NOT EXISTS idx_reviews_product_status ON reviews(product_id, status);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_reviews_product_status ON reviews(product_id, status);
+
+-- ========================================================================
+-- РАЗДЕЛ 4: ДЕНОРМАЛИЗОВАННЫЕ РЕЙТИНГИ ТОВАРОВ
+-- ========================================================================
+-- Агрегаты отзывов хранятся построчно на товар и обновляются триггером
+-- инкрементально, поэтому карточка товара и vw_product_ratings читают
+-- готовые значения вместо AVG/COUNT по всей таблице reviews.
+-- Карточка товара учитывает все отзывы, кроме отклонённых модерацией
+-- (status = 'rejected'), как и раньше считала по reviews. Отчёты
+-- (vw_product_ratings, как и vw_brand_statistics) показывают только
+-- одобренные отзывы — для них отдельные счётчики approved_*.
+-- Полная пересборка: python manage.py rebuild_rating_stats
+
+CREATE TABLE IF NOT EXISTS product_rating_stats (
+    product_id INT PRIMARY KEY,
+    review_count INT NOT NULL DEFAULT 0,
+    rating_sum INT NOT NULL DEFAULT 0,
+    stars_1 INT NOT NULL DEFAULT 0,
+    stars_2 INT NOT NULL DEFAULT 0,
+    stars_3 INT NOT NULL DEFAULT 0,
+    stars_4 INT NOT NULL DEFAULT 0,
+    stars_5 INT NOT NULL DEFAULT 0,
+    last_review_date TIMESTAMP,
+    approved_count INT NOT NULL DEFAULT 0,
+    approved_sum INT NOT NULL DEFAULT 0,
+    approved_stars_1 INT NOT NULL DEFAULT 0,
+    approved_stars_2 INT NOT NULL DEFAULT 0,
+    approved_stars_3 INT NOT NULL DEFAULT 0,
+    approved_stars_4 INT NOT NULL DEFAULT 0,
+    approved_stars_5 INT NOT NULL DEFAULT 0,
+    approved_last_review_date TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (product_id) REFERENCES products(product_id) ON DELETE CASCADE
+);
+
+CREATE OR REPLACE FUNCTION fn_update_product_rating_stats()
+RETURNS TRIGGER AS $$
+DECLARE
+    approved INT;
+BEGIN
+    -- Убираем прежнюю версию отзыва из агрегата
+    IF TG_OP IN ('UPDATE', 'DELETE')
+       AND OLD.product_id IS NOT NULL
+       AND OLD.status IS DISTINCT FROM 'rejected' THEN
+        approved := (OLD.status IS NOT DISTINCT FROM 'approved')::INT;
+        UPDATE product_rating_stats SET
+            review_count = review_count - 1,
+            rating_sum = rating_sum - OLD.rating,
+            stars_1 = stars_1 - (OLD.rating = 1)::INT,
+            stars_2 = stars_2 - (OLD.rating = 2)::INT,
+            stars_3 = stars_3 - (OLD.rating = 3)::INT,
+            stars_4 = stars_4 - (OLD.rating = 4)::INT,
+            stars_5 = stars_5 - (OLD.rating = 5)::INT,
+            approved_count = approved_count - approved,
+            approved_sum = approved_sum - approved * OLD.rating,
+            approved_stars_1 = approved_stars_1 - approved * (OLD.rating = 1)::INT,
+            approved_stars_2 = approved_stars_2 - approved * (OLD.rating = 2)::INT,
+            approved_stars_3 = approved_stars_3 - approved * (OLD.rating = 3)::INT,
+            approved_stars_4 = approved_stars_4 - approved * (OLD.rating = 4)::INT,
+            approved_stars_5 = approved_stars_5 - approved * (OLD.rating = 5)::INT,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE product_id = OLD.product_id;
+    END IF;
+
+    -- Добавляем новую версию отзыва
+    IF TG_OP IN ('INSERT', 'UPDATE')
+       AND NEW.product_id IS NOT NULL
+       AND NEW.status IS DISTINCT FROM 'rejected' THEN
+        approved := (NEW.status IS NOT DISTINCT FROM 'approved')::INT;
+        INSERT INTO product_rating_stats (
+            product_id, review_count, rating_sum,
+            stars_1, stars_2, stars_3, stars_4, stars_5,
+            last_review_date,
+            approved_count, approved_sum,
+            approved_stars_1, approved_stars_2, approved_stars_3, approved_stars_4, approved_stars_5,
+            approved_last_review_date, updated_at
+        ) VALUES (
+            NEW.product_id, 1, NEW.rating,
+            (NEW.rating = 1)::INT, (NEW.rating = 2)::INT, (NEW.rating = 3)::INT,
+            (NEW.rating = 4)::INT, (NEW.rating = 5)::INT,
+            NEW.publication_date,
+            approved, approved * NEW.rating,
+            approved * (NEW.rating = 1)::INT, approved * (NEW.rating = 2)::INT, approved * (NEW.rating = 3)::INT,
+            approved * (NEW.rating = 4)::INT, approved * (NEW.rating = 5)::INT,
+            CASE WHEN approved = 1 THEN NEW.publication_date END, CURRENT_TIMESTAMP
+        )
+        ON CONFLICT (product_id) DO UPDATE SET
+            review_count = product_rating_stats.review_count + 1,
+            rating_sum = product_rating_stats.rating_sum + EXCLUDED.rating_sum,
+            stars_1 = product_rating_stats.stars_1 + EXCLUDED.stars_1,
+            stars_2 = product_rating_stats.stars_2 + EXCLUDED.stars_2,
+            stars_3 = product_rating_stats.stars_3 + EXCLUDED.stars_3,
+            stars_4 = product_rating_stats.stars_4 + EXCLUDED.stars_4,
+            stars_5 = product_rating_stats.stars_5 + EXCLUDED.stars_5,
+            last_review_date = GREATEST(product_rating_stats.last_review_date, EXCLUDED.last_review_date),
+            approved_count = product_rating_stats.approved_count + EXCLUDED.approved_count,
+            approved_sum = product_rating_stats.approved_sum + EXCLUDED.approved_sum,
+            approved_stars_1 = product_rating_stats.approved_stars_1 + EXCLUDED.approved_stars_1,
+            approved_stars_2 = product_rating_stats.approved_stars_2 + EXCLUDED.approved_stars_2,
+            approved_stars_3 = product_rating_stats.approved_stars_3 + EXCLUDED.approved_stars_3,
+            approved_stars_4 = product_rating_stats.approved_stars_4 + EXCLUDED.approved_stars_4,
+            approved_stars_5 = product_rating_stats.approved_stars_5 + EXCLUDED.approved_stars_5,
+            approved_last_review_date = GREATEST(
+                product_rating_stats.approved_last_review_date, EXCLUDED.approved_last_review_date
+            ),
+            updated_at = CURRENT_TIMESTAMP;
+    END IF;
+
+    -- После удаления, отклонения или снятия одобрения даты последних отзывов могли уменьшиться
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.product_id IS NOT NULL THEN
+        UPDATE product_rating_stats s SET
+            last_review_date = (
+                SELECT MAX(r.publication_date)
+                FROM reviews r
+                WHERE r.product_id = OLD.product_id
+                  AND r.status IS DISTINCT FROM 'rejected'
+            ),
+            approved_last_review_date = (
+                SELECT MAX(r.publication_date)
+                FROM reviews r
+                WHERE r.product_id = OLD.product_id
+                  AND r.status = 'approved'
+            )
+        WHERE s.product_id = OLD.product_id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_update_product_rating_stats ON reviews;
+CREATE TRIGGER trg_update_product_rating_stats
+AFTER INSERT OR DELETE OR UPDATE OF product_id, rating, status, publication_date ON reviews
+FOR EACH ROW
+EXECUTE FUNCTION fn_update_product_rating_stats();
+
+-- Первичное заполнение для уже существующих отзывов
+INSERT INTO product_rating_stats (
+    product_id, review_count, rating_sum,
+    stars_1, stars_2, stars_3, stars_4, stars_5,
+    last_review_date,
+    approved_count, approved_sum,
+    approved_stars_1, approved_stars_2, approved_stars_3, approved_stars_4, approved_stars_5,
+    approved_last_review_date, updated_at
+)
+SELECT
+    r.product_id,
+    COUNT(*),
+    SUM(r.rating),
+    COUNT(*) FILTER (WHERE r.rating = 1),
+    COUNT(*) FILTER (WHERE r.rating = 2),
+    COUNT(*) FILTER (WHERE r.rating = 3),
+    COUNT(*) FILTER (WHERE r.rating = 4),
+    COUNT(*) FILTER (WHERE r.rating = 5),
+    MAX(r.publication_date),
+    COUNT(*) FILTER (WHERE r.status = 'approved'),
+    COALESCE(SUM(r.rating) FILTER (WHERE r.status = 'approved'), 0),
+    COUNT(*) FILTER (WHERE r.status = 'approved' AND r.rating = 1),
+    COUNT(*) FILTER (WHERE r.status = 'approved' AND r.rating = 2),
+    COUNT(*) FILTER (WHERE r.status = 'approved' AND r.rating = 3),
+    COUNT(*) FILTER (WHERE r.status = 'approved' AND r.rating = 4),
+    COUNT(*) FILTER (WHERE r.status = 'approved' AND r.rating = 5),
+    MAX(r.publication_date) FILTER (WHERE r.status = 'approved'),
+    CURRENT_TIMESTAMP
+FROM reviews r
+WHERE r.product_id IS NOT NULL
+  AND r.status IS DISTINCT FROM 'rejected'
+GROUP BY r.product_id
+ON CONFLICT (product_id) DO NOTHING;
+
+-- VIEW 4 (v2): рейтинг товаров по предрассчитанным агрегатам одобренных отзывов
+CREATE OR REPLACE VIEW vw_product_ratings AS
+SELECT
+    p.product_id,
+    p.product_name,
+    c.category_name,
+    b.brand_name,
+    COALESCE(s.approved_count, 0)::BIGINT AS review_count,
+    ROUND(s.approved_sum::NUMERIC / NULLIF(s.approved_count, 0), 2) AS avg_rating,
+    COALESCE(s.approved_stars_5, 0)::BIGINT AS five_star_count,
+    COALESCE(s.approved_stars_4, 0)::BIGINT AS four_star_count,
+    COALESCE(s.approved_stars_3, 0)::BIGINT AS three_star_count,
+    COALESCE(s.approved_stars_2, 0)::BIGINT AS two_star_count,
+    COALESCE(s.approved_stars_1, 0)::BIGINT AS one_star_count,
+    s.approved_last_review_date AS last_review_date
+FROM products p
+LEFT JOIN categories c ON p.category_id = c.category_id
+LEFT JOIN brands b ON p.brand_id = b.brand_id
+LEFT JOIN product_rating_stats s ON p.product_id = s.product_id
+ORDER BY avg_rating DESC;
+
+
+-- ========================================================================
+-- РАЗДЕЛ 5: ПОЛНОТЕКСТОВЫЙ И НЕЧЁТКИЙ ПОИСК ТОВАРОВ
+-- ========================================================================
+-- products.search_vector собирается из названия, SKU, бренда и описания и
+-- поддерживается триггерами; поиск по нему покрыт GIN-индексом.
+-- Для опечаток используется pg_trgm (оператор % по названию товара).
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE products
+    ADD COLUMN IF NOT EXISTS search_vector TSVECTOR;
+
+CREATE OR REPLACE FUNCTION fn_product_search_vector(
+    p_product_name VARCHAR,
+    p_sku VARCHAR,
+    p_brand_name VARCHAR,
+    p_description TEXT
+)
+RETURNS TSVECTOR AS $$
+    SELECT
+        setweight(to_tsvector('russian', COALESCE(p_product_name, '')), 'A') ||
+        setweight(to_tsvector('simple', COALESCE(p_sku, '')), 'A') ||
+        setweight(to_tsvector('russian', COALESCE(p_brand_name, '')), 'B') ||
+        setweight(to_tsvector('russian', COALESCE(p_description, '')), 'C');
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION fn_update_product_search_vector()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector = fn_product_search_vector(
+        NEW.product_name,
+        NEW.sku,
+        (SELECT brand_name FROM brands WHERE brand_id = NEW.brand_id),
+        NEW.description
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_update_product_search_vector ON products;
+CREATE TRIGGER trg_update_product_search_vector
+BEFORE INSERT OR UPDATE OF product_name, sku, brand_id, description ON products
+FOR EACH ROW
+EXECUTE FUNCTION fn_update_product_search_vector();
+
+-- Переименование бренда меняет поисковый вектор всех его товаров
+CREATE OR REPLACE FUNCTION fn_refresh_brand_search_vectors()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF OLD.brand_name IS DISTINCT FROM NEW.brand_name THEN
+        UPDATE products
+        SET search_vector = fn_product_search_vector(product_name, sku, NEW.brand_name, description)
+        WHERE brand_id = NEW.brand_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_refresh_brand_search_vectors ON brands;
+CREATE TRIGGER trg_refresh_brand_search_vectors
+AFTER UPDATE OF brand_name ON brands
+FOR EACH ROW
+EXECUTE FUNCTION fn_refresh_brand_search_vectors();
+
+-- Заполнение для существующих товаров
+UPDATE products p
+SET search_vector = fn_product_search_vector(
+    p.product_name,
+    p.sku,
+    (SELECT b.brand_name FROM brands b WHERE b.brand_id = p.brand_id),
+    p.description
+);
+
+CREATE INDEX IF NOT EXISTS idx_products_search_vector ON products USING GIN(search_vector);
+CREATE INDEX IF NOT EXISTS idx_products_name_trgm ON products USING GIN(product_name gin_trgm_ops);
+
+-- ========================================================================
+-- РАЗДЕЛ 6: ВЕРСИЯ И ВРЕМЯ ИЗМЕНЕНИЯ ТОВАРА ДЛЯ УСЛОВНЫХ GET-ЗАПРОСОВ
+-- ========================================================================
+-- ETag карточки строится из row_version, ETag списка — из max(updated_at),
+-- поэтому триггер обновляет оба поля при каждом изменении строки.
+
+CREATE OR REPLACE FUNCTION update_product_row_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.row_version = COALESCE(OLD.row_version, 0) + 1;
+    NEW.updated_at = CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE INDEX IF NOT EXISTS idx_products_updated_at ON products(updated_at);
+
+-- ========================================================================
+-- РАЗДЕЛ 7: УВЕДОМЛЕНИЯ ОБ ИЗМЕНЕНИЯХ КАТАЛОГА (LISTEN/NOTIFY)
+-- ========================================================================
+-- Снимок каталога в памяти воркеров слушает канал catalog_changes и
+-- перечитывает только изменённые строки. Аргумент триггера — колонка,
+-- значение которой уходит в уведомление как id (для отзывов — product_id).
+-- Уведомления доставляются после COMMIT, одинаковые в одной транзакции
+-- PostgreSQL объединяет.
+
+CREATE OR REPLACE FUNCTION fn_notify_catalog_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_row JSONB;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        v_row = to_jsonb(OLD);
+    ELSE
+        v_row = to_jsonb(NEW);
+    END IF;
+
+    PERFORM pg_notify('catalog_changes', json_build_object(
+        'table', TG_TABLE_NAME,
+        'op', TG_OP,
+        'id', v_row ->> TG_ARGV[0]
+    )::text);
+
+    -- Отзыв перенесён на другой товар: обновить и старый
+    IF TG_OP = 'UPDATE' AND (to_jsonb(OLD) ->> TG_ARGV[0]) IS DISTINCT FROM (v_row ->> TG_ARGV[0]) THEN
+        PERFORM pg_notify('catalog_changes', json_build_object(
+            'table', TG_TABLE_NAME,
+            'op', TG_OP,
+            'id', to_jsonb(OLD) ->> TG_ARGV[0]
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_notify_products_change ON products;
+CREATE TRIGGER trg_notify_products_change
+AFTER INSERT OR UPDATE OR DELETE ON products
+FOR EACH ROW
+EXECUTE FUNCTION fn_notify_catalog_change('product_id');
+
+DROP TRIGGER IF EXISTS trg_notify_brands_change ON brands;
+CREATE TRIGGER trg_notify_brands_change
+AFTER INSERT OR UPDATE OR DELETE ON brands
+FOR EACH ROW
+EXECUTE FUNCTION fn_notify_catalog_change('brand_id');
+
+DROP TRIGGER IF EXISTS trg_notify_categories_change ON categories;
+CREATE TRIGGER trg_notify_categories_change
+AFTER INSERT OR UPDATE OR DELETE ON categories
+FOR EACH ROW
+EXECUTE FUNCTION fn_notify_catalog_change('category_id');
+
+DROP TRIGGER IF EXISTS trg_notify_reviews_change ON reviews;
+CREATE TRIGGER trg_notify_reviews_change
+AFTER INSERT OR UPDATE OR DELETE ON reviews
+FOR EACH ROW
+EXECUTE FUNCTION fn_notify_catalog_change('product_id');
+
+-- ========================================================================
+-- РАЗДЕЛ 8: УМЕНЬШЕННЫЕ КОПИИ ИЗОБРАЖЕНИЙ ТОВАРОВ
+-- ========================================================================
+-- {url оригинала: {ширина: url WebP}}; заполняется фоновым пулом после
+-- загрузки и командой build_image_derivatives для уже загруженных файлов.
+
+ALTER TABLE products ADD COLUMN IF NOT EXISTS image_variants JSONB;
+
+-- ========================================================================
+-- РАЗДЕЛ 9: МАССОВЫЙ ИМПОРТ И ОБНОВЛЕНИЕ ТОВАРОВ
+-- ========================================================================
+-- Импорт (apps/products/importer.py) пишет audit_log одной вставкой, в том
+-- числе записи PRICE_CHANGE. На время такой транзакции построчный триггер
+-- цен отключается: set_config('app.skip_row_audit', 'on', true).
+
+CREATE OR REPLACE FUNCTION fn_audit_product_price_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('app.skip_row_audit', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
+
+    IF OLD.price IS DISTINCT FROM NEW.price THEN
+        INSERT INTO audit_log (
+            user_id, 
+            action_type, 
+            table_name, 
+            record_id, 
+            old_value, 
+            new_value, 
+            timestamp
+        ) VALUES (
+            (CASE WHEN current_setting('app.current_user_id', true) ~ '^[0-9]+$' 
+                  THEN current_setting('app.current_user_id', true)::INT ELSE NULL END),
+            'PRICE_CHANGE',
+            'products',
+            NEW.product_id,
+            JSONB_BUILD_OBJECT(
+                'product_id', OLD.product_id,
+                'product_name', OLD.product_name,
+                'old_price', OLD.price,
+                'change_amount', NEW.price - OLD.price
+            )::TEXT,
+            JSONB_BUILD_OBJECT(
+                'product_id', NEW.product_id,
+                'product_name', NEW.product_name,
+                'new_price', NEW.price
+            )::TEXT,
+            CURRENT_TIMESTAMP
+        );
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ========================================================================
+-- РАЗДЕЛ 10: СЕРВЕРНАЯ КОРЗИНА ПОКУПАТЕЛЯ
+-- ========================================================================
+-- Одна корзина на покупателя и одна строка на товар: apps/cart/services.py
+-- добавляет и сливает товары через INSERT ... ON CONFLICT по этим индексам.
+
+-- Позиции из лишних корзин переносятся в самую раннюю корзину покупателя
+UPDATE cart_items ci
+SET cart_id = keep.cart_id
+FROM carts c
+JOIN (SELECT customer_id, MIN(cart_id) AS cart_id FROM carts GROUP BY customer_id) keep
+    ON keep.customer_id = c.customer_id
+WHERE ci.cart_id = c.cart_id AND c.cart_id <> keep.cart_id;
+
+DELETE FROM carts c
+USING carts k
+WHERE c.customer_id = k.customer_id AND c.cart_id > k.cart_id;
+
+-- Повторяющиеся строки одного товара складываются
+UPDATE cart_items ci
+SET quantity = d.quantity
+FROM (
+    SELECT MIN(item_id) AS item_id, SUM(quantity) AS quantity
+    FROM cart_items
+    GROUP BY cart_id, product_id
+    HAVING COUNT(*) > 1
+) d
+WHERE ci.item_id = d.item_id;
+
+DELETE FROM cart_items ci
+USING cart_items k
+WHERE ci.cart_id = k.cart_id AND ci.product_id = k.product_id AND ci.item_id > k.item_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_carts_customer ON carts(customer_id);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_cart_items_cart_product ON cart_items(cart_id, product_id);
+
+-- ========================================================================
+-- РАЗДЕЛ 11: МАТЕРИАЛИЗОВАННЫЙ ПУТЬ КАТЕГОРИЙ
+-- ========================================================================
+-- path — id предков и самой категории: '/1/5/12/', depth — глубина (0 у корня).
+-- Поддерево категории r — диапазон path >= r.path AND path < r.path || '~'
+-- по btree-индексу (COLLATE "C": '/' и цифры меньше '~'), без рекурсии.
+-- BEFORE-триггер считает путь по родителю и не даёт создать цикл,
+-- AFTER-триггер переписывает префикс у потомков. Полная пересборка —
+-- команда rebuild_category_paths (apps/products/categories.py).
+
+ALTER TABLE categories ADD COLUMN IF NOT EXISTS path TEXT COLLATE "C";
+ALTER TABLE categories ADD COLUMN IF NOT EXISTS depth INT;
+
+CREATE INDEX IF NOT EXISTS idx_categories_path ON categories(path);
+
+CREATE OR REPLACE FUNCTION fn_category_set_path()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_parent_path TEXT;
+    v_parent_depth INT;
+BEGIN
+    IF NEW.parent_id IS NULL THEN
+        NEW.path = '/' || NEW.category_id || '/';
+        NEW.depth = 0;
+        RETURN NEW;
+    END IF;
+
+    SELECT path, depth INTO v_parent_path, v_parent_depth
+    FROM categories
+    WHERE category_id = NEW.parent_id;
+
+    IF NEW.parent_id = NEW.category_id
+       OR v_parent_path LIKE '%/' || NEW.category_id || '/%' THEN
+        RAISE EXCEPTION 'Категория % не может быть вложена в свою подкатегорию %',
+            NEW.category_id, NEW.parent_id;
+    END IF;
+
+    NEW.path = v_parent_path || NEW.category_id || '/';
+    NEW.depth = v_parent_depth + 1;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION fn_category_move_subtree()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- UPDATE только path/depth: триггеры UPDATE OF parent_id повторно не срабатывают
+    UPDATE categories
+    SET path = NEW.path || substr(path, length(OLD.path) + 1),
+        depth = depth + COALESCE(NEW.depth, 0) - COALESCE(OLD.depth, 0)
+    WHERE path > OLD.path AND path < OLD.path || '~';
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_category_set_path ON categories;
+CREATE TRIGGER trg_category_set_path
+BEFORE INSERT OR UPDATE OF parent_id ON categories
+FOR EACH ROW
+EXECUTE FUNCTION fn_category_set_path();
+
+DROP TRIGGER IF EXISTS trg_category_move_subtree ON categories;
+CREATE TRIGGER trg_category_move_subtree
+AFTER UPDATE OF parent_id ON categories
+FOR EACH ROW
+WHEN (OLD.path IS NOT NULL AND OLD.path IS DISTINCT FROM NEW.path)
+EXECUTE FUNCTION fn_category_move_subtree();
+
+-- Заполнение для существующих категорий (то же делает rebuild_category_paths)
+WITH RECURSIVE tree AS (
+    SELECT category_id, '/' || category_id || '/' AS path, 0 AS depth
+    FROM categories
+    WHERE parent_id IS NULL
+    UNION ALL
+    SELECT c.category_id, t.path || c.category_id || '/', t.depth + 1
+    FROM categories c
+    JOIN tree t ON c.parent_id = t.category_id
+)
+UPDATE categories c
+SET path = t.path, depth = t.depth
+FROM tree t
+WHERE c.category_id = t.category_id;
+
+-- ========================================================================
+-- РАЗДЕЛ 12: ДЕЙСТВУЮЩИЕ АКЦИИ ТОВАРОВ НА ДАТУ
+-- ========================================================================
+-- apps/promotions/pricing.py ищет акцию товара на дату условием
+-- daterange(start_date, end_date, '[]') @> дата; пустая граница — открытый
+-- период. Составной GiST-индекс (нужен btree_gist для product_id) отвечает
+-- на запрос по списку товаров одним проходом по индексу на товар.
+
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+CREATE INDEX IF NOT EXISTS idx_promotions_product_period
+    ON promotions USING GIST (product_id, daterange(start_date, end_date, '[]'));
+
+-- Снимок каталога (РАЗДЕЛ 7) держит акции в памяти и перечитывает их по уведомлению
+DROP TRIGGER IF EXISTS trg_notify_promotions_change ON promotions;
+CREATE TRIGGER trg_notify_promotions_change
+AFTER INSERT OR UPDATE OR DELETE ON promotions
+FOR EACH ROW
+EXECUTE FUNCTION fn_notify_catalog_change('product_id');
+
+-- ========================================================================
+-- РАЗДЕЛ 13: РЕЗЕРВЫ ОСТАТКОВ НА ВРЕМЯ ОПЛАТЫ
+-- ========================================================================
+-- create_payment резервирует количества корзины (apps/orders/reservations.py)
+-- только для авторизованного покупателя: один активный резерв на покупателя,
+-- не больше MAX_RESERVED_PER_LINE штук по строке. create_order по reservation_key превращает резерв в строки заказа.
+-- Резерв без оплаты перестаёт учитываться после expires_at; команда
+-- expire_stock_reservations помечает такие резервы и чистит старые записи.
+-- Частичные индексы покрывают только активные резервы — их немного.
+
+CREATE TABLE IF NOT EXISTS stock_reservations (
+    reservation_id BIGSERIAL PRIMARY KEY,
+    hold_key VARCHAR(64) NOT NULL,
+    product_id INT NOT NULL REFERENCES products(product_id) ON DELETE CASCADE,
+    quantity INT NOT NULL CHECK (quantity > 0),
+    customer_id INT REFERENCES customers(customer_id) ON DELETE SET NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'active'
+        CHECK (status IN ('active', 'converted', 'expired', 'released')),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_stock_reservations_active_product
+    ON stock_reservations (product_id, expires_at) INCLUDE (quantity)
+    WHERE status = 'active';
+
+CREATE INDEX IF NOT EXISTS idx_stock_reservations_active_expires
+    ON stock_reservations (expires_at)
+    WHERE status = 'active';
+
+CREATE INDEX IF NOT EXISTS idx_stock_reservations_hold_key
+    ON stock_reservations (hold_key);
+
+-- Новый резерв покупателя снимает его предыдущий активный
+CREATE INDEX IF NOT EXISTS idx_stock_reservations_active_customer
+    ON stock_reservations (customer_id)
+    WHERE status = 'active';
+
+-- Свободный остаток: склад минус действующие резервы
+CREATE OR REPLACE VIEW v_product_availability AS
+SELECT
+    p.product_id,
+    p.stock_quantity,
+    COALESCE(r.reserved, 0) AS reserved,
+    p.stock_quantity - COALESCE(r.reserved, 0) AS available
+FROM products p
+LEFT JOIN (
+    SELECT product_id, SUM(quantity) AS reserved
+    FROM stock_reservations
+    WHERE status = 'active' AND expires_at > CURRENT_TIMESTAMP
+    GROUP BY product_id
+) r ON r.product_id = p.product_id;
+
+-- ========================================================================
+-- РАЗДЕЛ 14: КЛЮЧИ ИДЕМПОТЕНТНОСТИ ОФОРМЛЕНИЯ И ОПЛАТЫ
+-- ========================================================================
+-- api/idempotency.py сохраняет успешный ответ create_order / create_payment
+-- по заголовку Idempotency-Key; повтор запроса с тем же ключом получает
+-- сохранённый ответ, не создавая второй заказ. Ключи старше суток удаляет
+-- команда purge_idempotency_keys.
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope VARCHAR(50) NOT NULL,
+    idem_key VARCHAR(64) NOT NULL,
+    request_hash CHAR(64) NOT NULL,
+    status_code SMALLINT NOT NULL,
+    response_body JSONB NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (scope, idem_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created
+    ON idempotency_keys (created_at);
+
+-- ========================================================================
+-- РАЗДЕЛ 15: СТАТУСЫ ПЛАТЕЖЕЙ ИЗ УВЕДОМЛЕНИЙ ШЛЮЗА
+-- ========================================================================
+-- apps/orders/payment_events.py: POST /api/payment/webhook/ кладёт
+-- уведомление ЮKassa в payment_events (повтор события отбрасывается
+-- уникальным ключом), команда process_payment_events пачками переносит
+-- статусы в gateway_payments, orders.payment_status и payments.
+-- Страница успешной оплаты читает статус из gateway_payments.
+
+CREATE TABLE IF NOT EXISTS gateway_payments (
+    gateway_payment_id VARCHAR(64) PRIMARY KEY,
+    status VARCHAR(30) NOT NULL,
+    amount NUMERIC(10,2),
+    order_id INT REFERENCES orders(order_id) ON DELETE SET NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_gateway_payments_order
+    ON gateway_payments (order_id)
+    WHERE order_id IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS payment_events (
+    event_id BIGSERIAL PRIMARY KEY,
+    payment_id VARCHAR(64) NOT NULL,
+    event VARCHAR(50) NOT NULL,
+    status VARCHAR(30),
+    amount NUMERIC(10,2),
+    payload JSONB NOT NULL,
+    received_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP,
+    UNIQUE (payment_id, event)
+);
+
+-- Необработанная часть очереди: воркер читает её по event_id
+CREATE INDEX IF NOT EXISTS idx_payment_events_pending
+    ON payment_events (event_id)
+    WHERE processed_at IS NULL;
+
+-- Воркер process_payment_events ждёт новые события по LISTEN payment_events
+CREATE OR REPLACE FUNCTION fn_notify_payment_event()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('payment_events', NEW.payment_id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_notify_payment_event ON payment_events;
+CREATE TRIGGER trg_notify_payment_event
+AFTER INSERT ON payment_events
+FOR EACH ROW
+EXECUTE FUNCTION fn_notify_payment_event();
+
+-- ========================================================================
+-- РАЗДЕЛ 16: СОСТОЯНИЕ КАТАЛОГА ДЛЯ ETAG СПИСКА ТОВАРОВ
+-- ========================================================================
+-- apps/products/conditional.py строит слабый ETag /api/products/ из
+-- max(products.updated_at), max(product_rating_stats.updated_at) и
+-- версии catalog_version плюс параметров запроса — три чтения по индексу.
+-- Вставки и изменения товаров и отзывов двигают updated_at; счётчик
+-- catalog_version ловит то, что updated_at товаров не меняет: удаление
+-- товаров и правки брендов и категорий (их названия входят в ответ).
+-- Триггеры счётчика уровня оператора и только на редких админских
+-- операциях: оформление заказа (списание остатков) строку не блокирует.
+
+CREATE INDEX IF NOT EXISTS idx_product_rating_stats_updated_at ON product_rating_stats(updated_at);
+
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO catalog_version (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION fn_bump_catalog_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_catalog_version_products ON products;
+CREATE TRIGGER trg_catalog_version_products
+AFTER DELETE ON products
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_bump_catalog_version();
+
+DROP TRIGGER IF EXISTS trg_catalog_version_brands ON brands;
+CREATE TRIGGER trg_catalog_version_brands
+AFTER INSERT OR UPDATE OR DELETE ON brands
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_bump_catalog_version();
+
+DROP TRIGGER IF EXISTS trg_catalog_version_categories ON categories;
+CREATE TRIGGER trg_catalog_version_categories
+AFTER INSERT OR UPDATE OR DELETE ON categories
+FOR EACH STATEMENT
+EXECUTE FUNCTION fn_bump_catalog_version();
@@ -0,0 +1,118 @@
+# main/home.py
+"""
+Кэш главной страницы.
+
+Блоки слайдера и категорий собираются узкими запросами (values_list без
+description/specifications) и хранятся в кэше вместе с готовым HTML страницы
+для анонимных посетителей. Оба ключа содержат номер версии: сброс —
+это увеличение версии, старые записи просто истекают.
+
+Версия увеличивается при сохранении и удалении товаров и категорий через ORM
+(сигналы в MainConfig.ready), после массового импорта и bulk-update и когда
+заказ выкупает последний экземпляр товара. Изменения в обход приложения
+подхватываются по истечении HOME_CACHE_TTL.
+"""
+import logging
+
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+HOME_CACHE_TTL = 300
+SLIDER_SIZE = 10
+CATEGORIES_SIZE = 10
+VERSION_KEY = 'home:version'
+
+# Поля, изменение которых меняет главную страницу
+PRODUCT_FIELDS = ('images', 'image_url', 'stock_quantity', 'status', 'product_name')
+
+
+def _version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = 1
+        cache.add(VERSION_KEY, version, None)
+    return version
+
+
+def blocks_key():
+    return f'home:blocks:v{_version()}'
+
+
+def page_key():
+    return f'home:page:v{_version()}'
+
+
+def build_home_blocks():
+    """Слайдер и категории одним узким запросом на каждый блок"""
+    from apps.products.models import Categories, Products
+
+    rows = (
+        Products.objects
+        .filter(stock_quantity__gt=0, status='approved')
+        .exclude(images__isnull=True)
+        .exclude(images=[])
+        .order_by('-product_id')
+        .values_list('product_id', 'product_name', 'images', 'image_url')[:SLIDER_SIZE]
+    )
+    # images хранится нормализованным списком URL (apps/products/images.py)
+    slider = [
+        {'url': images[0] if images else image_url, 'product_id': product_id, 'product_name': product_name}
+        for product_id, product_name, images, image_url in rows
+        if images or image_url
+    ]
+    categories = list(
+        Categories.objects.order_by('category_id').values('category_id', 'category_name')[:CATEGORIES_SIZE]
+    )
+    return {'slider_images': slider, 'categories': categories}
+
+
+def get_home_blocks():
+    key = blocks_key()
+    blocks = cache.get(key)
+    if blocks is None:
+        blocks = build_home_blocks()
+        cache.set(key, blocks, HOME_CACHE_TTL)
+    return blocks
+
+
+def get_cached_page():
+    return cache.get(page_key())
+
+
+def store_page(content):
+    cache.set(page_key(), content, HOME_CACHE_TTL)
+
+
+def invalidate_home(**kwargs):
+    """Сбросить кэш главной (принимает аргументы сигналов)"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 2, None)
+    logger.debug('Кэш главной страницы сброшен')
+
+
+def on_catalog_changed(**kwargs):
+    """Сброс после COMMIT: иначе параллельный запрос успеет закэшировать старые данные"""
+    transaction.on_commit(invalidate_home)
+
+
+def on_product_saved(sender, instance, created=False, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & set(PRODUCT_FIELDS):
+        return
+    on_catalog_changed()
+
+
+def connect_signals():
+    from django.db.models.signals import post_delete, post_save
+
+    from apps.products.models import Categories, Products
+    from apps.products.signals import products_bulk_changed
+
+    post_save.connect(on_product_saved, sender=Products, dispatch_uid='home_product_saved')
+    post_delete.connect(on_catalog_changed, sender=Products, dispatch_uid='home_product_deleted')
+    post_save.connect(on_catalog_changed, sender=Categories, dispatch_uid='home_category_saved')
+    post_delete.connect(on_catalog_changed, sender=Categories, dispatch_uid='home_category_deleted')
+    products_bulk_changed.connect(on_catalog_changed, dispatch_uid='home_products_bulk_changed')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from main.home import invalidate_home
+from main.page_cache import purge
+
+
+class Command(BaseCommand):
+    help = 'Сбрасывает кэш готовых страниц и главной (запускать при выкладке)'
+
+    def handle(self, *args, **options):
+        generation = purge()
+        invalidate_home()
+        self.stdout.write(self.style.SUCCESS(f"Кэш страниц сброшен, поколение ключей: {generation}"))
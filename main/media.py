@@ -0,0 +1,124 @@
+# main/media.py
+"""
+Раздача файлов MEDIA_ROOT с заголовками кэширования и поддержкой Range.
+
+Файлы с именем по sha256 (apps/products/storage.py, копии из
+apps/products/derivatives.py) неизменны и кэшируются на год с immutable;
+старые файлы с произвольными именами — на час с обязательной проверкой.
+"""
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+
+from apps.products.storage import is_immutable
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+MUTABLE_CACHE_CONTROL = 'public, max-age=3600, must-revalidate'
+STREAM_CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _resolve(path):
+    media_root = os.path.normpath(str(settings.MEDIA_ROOT))
+    absolute = os.path.normpath(os.path.join(media_root, path))
+    if not absolute.startswith(media_root + os.sep) or not os.path.isfile(absolute):
+        raise Http404('Файл не найден')
+    return absolute
+
+
+def _etag(path, stat):
+    """Для файлов по хэшу — сам хэш, для остальных — размер и время изменения"""
+    if is_immutable(path):
+        return '"%s"' % os.path.splitext(os.path.basename(path))[0]
+    return '"%x-%x"' % (stat.st_size, int(stat.st_mtime))
+
+
+def _parse_range(header, size):
+    """
+    Один диапазон 'bytes=a-b' -> (start, end) включительно; None — отдать файл
+    целиком; ValueError — диапазон вне файла (416).
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # bytes=-N — последние N байт
+        length = int(last)
+        if length == 0:
+            raise ValueError('empty suffix range')
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError('range not satisfiable')
+    return start, end
+
+
+def _iter_range(absolute, start, length):
+    with open(absolute, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(last_modified) <= if_modified_since
+
+
+def serve_media(request, path):
+    absolute = _resolve(path)
+    stat = os.stat(absolute)
+    etag = _etag(path, stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if is_immutable(path) else MUTABLE_CACHE_CONTROL,
+        'Accept-Ranges': 'bytes',
+    }
+
+    if _not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+        for name, value in headers.items():
+            if name != 'Accept-Ranges':
+                response[name] = value
+        return response
+
+    content_type = mimetypes.guess_type(absolute)[0] or 'application/octet-stream'
+    range_header = request.META.get('HTTP_RANGE')
+    # If-Range: диапазон только если у клиента та же версия файла
+    if range_header and request.META.get('HTTP_IF_RANGE', etag) != etag:
+        range_header = None
+
+    try:
+        byte_range = _parse_range(range_header, stat.st_size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+
+    if byte_range is None:
+        response = FileResponse(open(absolute, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(_iter_range(absolute, start, length), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        response['Content-Length'] = str(length)
+
+    for name, value in headers.items():
+        response[name] = value
+    return response
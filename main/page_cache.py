@@ -0,0 +1,139 @@
+# main/page_cache.py
+"""
+Кэш готовых ответов статичных страниц (about, delivery, catalog, ...) для
+анонимных GET-запросов.
+
+PageCacheMiddleware стоит сразу после SecurityMiddleware: при попадании ответ отдаётся
+до сессий, JWTAuthMiddleware и DBAuditMiddleware — без единого обращения к БД.
+Сохраняются только ответы view, помеченных декоратором cached_page.
+
+Ключ — путь, строка запроса, язык, STATIC_VERSION и поколение кэша.
+Новая STATIC_VERSION при выкладке делает старые записи недостижимыми;
+команда purge_page_cache сбрасывает кэш явно (увеличивает поколение).
+"""
+import hashlib
+import threading
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils import translation
+
+PAGE_CACHE_TTL = 600
+GENERATION_KEY = 'page_cache:generation'
+HIT_HEADER = 'X-Page-Cache'
+# Куки, при наличии которых страница может зависеть от пользователя
+AUTH_COOKIES = ('access_token', 'sessionid')
+STORED_HEADERS = ('Content-Type', 'Content-Language', 'X-Frame-Options')
+# Пути, которые никогда не кэшируются — для них не делаем и поиск в кэше
+SKIP_PREFIXES = ('/api/', '/static/', '/media/', '/admin/', '/admin-panel/')
+
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'bypassed': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    """Счётчики текущего процесса"""
+    with _stats_lock:
+        result = dict(_stats)
+    lookups = result['hits'] + result['misses']
+    result['hit_ratio'] = round(result['hits'] / lookups, 3) if lookups else None
+    result['generation'] = _generation()
+    result['static_version'] = getattr(settings, 'STATIC_VERSION', '')
+    return result
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = 1
+        cache.add(GENERATION_KEY, generation, None)
+    return generation
+
+
+def purge():
+    """Сбросить все страницы (новое поколение ключей)"""
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 2, None)
+        return 2
+
+
+def page_key(request):
+    language = translation.get_language_from_request(request)
+    raw = '|'.join((
+        request.path,
+        request.META.get('QUERY_STRING', ''),
+        language,
+        str(getattr(settings, 'STATIC_VERSION', '')),
+    ))
+    return f'page_cache:{_generation()}:{hashlib.md5(raw.encode()).hexdigest()}'
+
+
+def is_anonymous(request):
+    if request.method not in ('GET', 'HEAD') or request.path.startswith(SKIP_PREFIXES):
+        return False
+    if 'HTTP_AUTHORIZATION' in request.META or request.GET.get('token'):
+        return False
+    return not any(name in request.COOKIES for name in AUTH_COOKIES)
+
+
+def cached_page(view_func):
+    """Разрешить кэширование ответа view для анонимных посетителей"""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        request.page_cacheable = True
+        return view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def _cacheable_response(response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and 'private' not in response.get('Cache-Control', '')
+        and 'no-store' not in response.get('Cache-Control', '')
+    )
+
+
+class PageCacheMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_anonymous(request):
+            _count('bypassed')
+            return self.get_response(request)
+
+        key = page_key(request)
+        entry = cache.get(key)
+        if entry is not None:
+            _count('hits')
+            content, headers = entry
+            response = HttpResponse(content if request.method == 'GET' else b'')
+            for name, value in headers.items():
+                response[name] = value
+            response['Content-Length'] = str(len(content))
+            response[HIT_HEADER] = 'HIT'
+            return response
+
+        response = self.get_response(request)
+        if not getattr(request, 'page_cacheable', False):
+            _count('bypassed')
+            return response
+
+        _count('misses')
+        if request.method == 'GET' and _cacheable_response(response):
+            headers = {name: response[name] for name in STORED_HEADERS if response.has_header(name)}
+            cache.set(key, (response.content, headers), PAGE_CACHE_TTL)
+            _count('stores')
+        response[HIT_HEADER] = 'MISS'
+        return response
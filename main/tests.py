@@ -1,6 +1,17 @@
-from django.test import TestCase, Client
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, Client, SimpleTestCase, override_settings
 from django.urls import reverse
 
+from apps.products.models import Products
+from apps.products.storage import store_upload
+from main import home, page_cache
+
 
 class URLResolutionTest(TestCase):
     "Тест проверки правильности разрешения URL-адресов"
@@ -133,3 +144,134 @@ class BasicTestCase(TestCase):
         from django.urls import reverse
         home_url = reverse('home')
         self.assertEqual(home_url, '/')
+
+
+class MediaServingTest(SimpleTestCase):
+    "Файлы media отдаются с кэшированием, ETag и поддержкой Range"
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_URL='/media/')
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        upload = SimpleUploadedFile('Фото товара.JPG', b'0123456789' * 10)
+        self.url = store_upload(upload, 'products')
+        self.client = Client()
+
+    def test_identical_uploads_are_stored_once(self):
+        stored = os.path.join(self.media_root, self.url[len('/media/'):])
+        os.utime(stored, (0, 0))
+        again = store_upload(SimpleUploadedFile('copy.jpg', b'0123456789' * 10), 'products')
+
+        self.assertEqual(again, self.url)
+        self.assertRegex(self.url, r'^/media/products/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'tmp')), [])
+        # Повторная загрузка продлевает жизнь файла для gc_media
+        self.assertGreater(os.stat(stored).st_mtime, 0)
+
+    def test_hashed_file_is_immutable_and_revalidates(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789' * 10)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+        repeat = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repeat.status_code, 304)
+
+    def test_range_requests(self):
+        partial = self.client.get(self.url, HTTP_RANGE='bytes=5-14')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial['Content-Range'], 'bytes 5-14/100')
+        self.assertEqual(b''.join(partial.streaming_content), b'5678901234')
+
+        suffix = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(suffix.streaming_content), b'789')
+
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=500-').status_code, 416)
+
+    def test_paths_outside_media_root_are_not_served(self):
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/products/missing.jpg').status_code, 404)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class HomeCacheTest(SimpleTestCase):
+    "Главная страница для анонимных посетителей отдаётся из кэша"
+
+    BLOCKS = {'slider_images': [], 'categories': []}
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_hit_skips_db_and_templates(self):
+        with mock.patch('main.views.get_home_blocks', return_value=self.BLOCKS) as blocks:
+            first = self.client.get('/')
+            with mock.patch('main.views.render') as render:
+                second = self.client.get('/')
+
+        self.assertEqual(blocks.call_count, 1)
+        render.assert_not_called()
+        self.assertEqual(first.content, second.content)
+
+    def test_logged_in_visitor_is_not_served_from_cache(self):
+        with mock.patch('main.views.get_home_blocks', return_value=self.BLOCKS) as blocks:
+            self.client.get('/')
+            self.client.cookies['access_token'] = 'token'
+            self.client.get('/')
+        self.assertEqual(blocks.call_count, 2)
+
+    def test_invalidation_bumps_version(self):
+        home.store_page(b'old')
+        home.invalidate_home()
+        self.assertIsNone(home.get_cached_page())
+
+    def test_unrelated_product_update_keeps_cache(self):
+        product = Products(product_id=1)
+        with mock.patch('main.home.transaction.on_commit') as on_commit:
+            home.on_product_saved(Products, product, update_fields=['description'])
+            on_commit.assert_not_called()
+            home.on_product_saved(Products, product, update_fields=['stock_quantity'])
+            on_commit.assert_called_once_with(home.invalidate_home)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PageCacheTest(SimpleTestCase):
+    "Статичные страницы для анонимных посетителей отдаются из кэша до middleware с БД"
+
+    def setUp(self):
+        cache.clear()
+
+    def test_hit_bypasses_db_middleware(self):
+        with mock.patch('api.db_audit_middleware.connection') as connection:
+            first = self.client.get('/about/')
+            calls = connection.cursor.call_count
+            second = self.client.get('/about/')
+
+        self.assertEqual(first['X-Page-Cache'], 'MISS')
+        self.assertEqual(second['X-Page-Cache'], 'HIT')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(connection.cursor.call_count, calls)
+
+    def test_logged_in_and_unmarked_pages_are_not_cached(self):
+        self.client.get('/about/')
+        self.client.cookies['access_token'] = 'token'
+        self.assertFalse(self.client.get('/about/').has_header('X-Page-Cache'))
+
+        self.client.cookies.clear()
+        stores = page_cache.stats()['stores']
+        with mock.patch('api.views.batch_products', return_value=[]):
+            self.client.get('/api/products/batch/')
+        self.assertEqual(page_cache.stats()['stores'], stores)
+
+    def test_purge_and_static_version_change_miss(self):
+        self.client.get('/delivery/')
+        page_cache.purge()
+        self.assertEqual(self.client.get('/delivery/')['X-Page-Cache'], 'MISS')
+
+        with override_settings(STATIC_VERSION='next'):
+            self.assertEqual(self.client.get('/delivery/')['X-Page-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/delivery/')['X-Page-Cache'], 'HIT')
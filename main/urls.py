@@ -1,10 +1,12 @@
 # C:\WebsiteDjSND\main\urls.py
+import re
 from django.conf import settings
-from django.conf.urls.static import static
-from django.urls import path, include
-from .views import home, catalog, promotions, register, login, admin_panel, admin_users, admin_user_edit, admin_backup_db, admin_inventory, admin_orders_manage, admin_analytics, admin_export_orders_csv, admin_import_reports, admin_export_products_csv, admin_sales_report, admin_export_sales_report_csv, admin_export_sales_report_excel, admin_export_sales_report_pdf, admin_moderate_reviews, admin_audit_log, favorites, orders
+from django.urls import path, re_path, include
+from .views import home, catalog, promotions, register, login, admin_panel, admin_users, admin_user_edit, admin_backup_db, admin_inventory, admin_orders_manage, admin_analytics, admin_export_orders_csv, admin_import_reports, admin_export_products_csv, admin_sales_report, admin_export_sales_report_csv, admin_export_sales_report_excel, admin_export_sales_report_pdf, admin_moderate_reviews, admin_audit_log, admin_page_cache_stats, admin_payment_gateway_stats, favorites, orders
 from apps.reviews import views as reviews_views
 from django.views.generic import TemplateView
+from .media import serve_media
+from .page_cache import cached_page
 
 urlpatterns = [
     path('', include('apps.products.urls')),
@@ -26,34 +28,38 @@ urlpatterns = [
     path('admin-panel/export-sales-report-pdf/', admin_export_sales_report_pdf, name='admin_export_sales_report_pdf'),
     path('admin-panel/reviews/', admin_moderate_reviews, name='admin_moderate_reviews'),
     path('admin-panel/audit/', admin_audit_log, name='admin_audit'),
+    path('admin-panel/page-cache/', admin_page_cache_stats, name='admin_page_cache'),
+    path('admin-panel/payment-gateway/', admin_payment_gateway_stats, name='admin_payment_gateway'),
 
     path('', home, name='home'),
-    path('login/', TemplateView.as_view(template_name='login.html'), name='login'),
-    path('privacy/', TemplateView.as_view(template_name='privacy.html'), name='privacy'),
+    path('login/', cached_page(TemplateView.as_view(template_name='login.html')), name='login'),
+    path('privacy/', cached_page(TemplateView.as_view(template_name='privacy.html')), name='privacy'),
     path('compony/', TemplateView.as_view(template_name='compony.html'), name='compony'),
-    path('about/', TemplateView.as_view(template_name='about.html'), name='about'),
-    path('for-customers/', TemplateView.as_view(template_name='for_customers.html'), name='for_customers'),
-    path('how-to-order/', TemplateView.as_view(template_name='how_to_order.html'), name='how_to_order'),
-    path('payment-methods/', TemplateView.as_view(template_name='payment_methods.html'), name='payment_methods'),
-    path('delivery/', TemplateView.as_view(template_name='delivery.html'), name='delivery'),
-    path('order-status/', TemplateView.as_view(template_name='order_status.html'), name='order_status'),
+    path('about/', cached_page(TemplateView.as_view(template_name='about.html')), name='about'),
+    path('for-customers/', cached_page(TemplateView.as_view(template_name='for_customers.html')), name='for_customers'),
+    path('how-to-order/', cached_page(TemplateView.as_view(template_name='how_to_order.html')), name='how_to_order'),
+    path('payment-methods/', cached_page(TemplateView.as_view(template_name='payment_methods.html')), name='payment_methods'),
+    path('delivery/', cached_page(TemplateView.as_view(template_name='delivery.html')), name='delivery'),
+    path('order-status/', cached_page(TemplateView.as_view(template_name='order_status.html')), name='order_status'),
     path('exchange-return/', TemplateView.as_view(template_name='exchange_return.html'), name='exchange_return'),
-    path('help/', TemplateView.as_view(template_name='help.html'), name='help'),
-    path('contact/', TemplateView.as_view(template_name='contact.html'), name='contact'),
+    path('help/', cached_page(TemplateView.as_view(template_name='help.html')), name='help'),
+    path('contact/', cached_page(TemplateView.as_view(template_name='contact.html')), name='contact'),
     
-    path('register/', TemplateView.as_view(template_name='register.html'), name='register'),
-    path('catalog/', TemplateView.as_view(template_name='catalog.html'), name='catalog'),
-    path('promotions/', TemplateView.as_view(template_name='promotions.html'), name='promotions'),
+    path('register/', cached_page(TemplateView.as_view(template_name='register.html')), name='register'),
+    path('catalog/', cached_page(TemplateView.as_view(template_name='catalog.html')), name='catalog'),
+    path('promotions/', cached_page(TemplateView.as_view(template_name='promotions.html')), name='promotions'),
     path('favorites/', favorites, name='favorites'),
-    path('cart/', TemplateView.as_view(template_name='cart.html'), name='cart'),
+    path('cart/', cached_page(TemplateView.as_view(template_name='cart.html')), name='cart'),
     path('orders/', orders, name='orders'),
     path('reviews/', reviews_views.reviews_page, name='reviews'),
     path('reviews/submit/', reviews_views.submit_review, name='reviews_submit'),
     path('reviews/edit/<int:review_id>/', reviews_views.edit_review, name='reviews_edit'),
     path('reviews/delete/<int:review_id>/', reviews_views.delete_review, name='reviews_delete'),
-    path('decoration/', TemplateView.as_view(template_name='decoration.html'), name='decoration'),
+    path('decoration/', cached_page(TemplateView.as_view(template_name='decoration.html')), name='decoration'),
     path('decoration-success/', TemplateView.as_view(template_name='decoration-success.html'), name='decoration_success'),
     path('password_reset/', TemplateView.as_view(template_name='auth/password_reset.html')),
     path('reset-password-confirm/', TemplateView.as_view(template_name='auth/reset_password_confirm.html')),
     path('profile/', TemplateView.as_view(template_name='profile.html'), name='profile'),
-]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    # Файлы MEDIA_ROOT: кэширование, ETag и Range (main/media.py)
+    re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media, name='media'),
+]
\ No newline at end of file
@@ -2,6 +2,7 @@
 from django.shortcuts import render, redirect
 from django.http import JsonResponse, HttpResponse
 from apps.users.decorators import require_role
+from main.home import get_cached_page, get_home_blocks, store_page
 from django.utils import timezone
 from django.db.models import Sum, Count, F, DecimalField
 from apps.products.models import Products, Inventory, Categories
@@ -29,56 +30,20 @@ from reportlab.pdfbase.cidfonts import UnicodeCIDFont
 import os
 
 def home(request):
-    # Получаем товары с изображениями для слайдера
-    import json
-    slider_products = Products.objects.filter(
-        stock_quantity__gt=0,
-        status='active'
-    ).exclude(
-        images__isnull=True
-    ).exclude(
-        images='[]'
-    )[:10]  # Берем первые 10 товаров
-    
-    slider_images = []
-    for product in slider_products:
-        # Извлекаем первое изображение из JSONField
-        first_image = None
-        if product.images:
-            try:
-                if isinstance(product.images, str):
-                    images_data = json.loads(product.images)
-                else:
-                    images_data = product.images
-                
-                if isinstance(images_data, list) and len(images_data) > 0:
-                    # Берем первое изображение
-                    first_image = images_data[0]
-                    if isinstance(first_image, str) and not first_image.startswith('blob:'):
-                        slider_images.append({
-                            'url': first_image,
-                            'product_id': product.product_id,
-                            'product_name': product.product_name
-                        })
-            except (json.JSONDecodeError, TypeError, AttributeError):
-                pass
-        
-        # Если не нашли в images, пробуем image_url
-        if not first_image and product.image_url:
-            slider_images.append({
-                'url': product.image_url,
-                'product_id': product.product_id,
-                'product_name': product.product_name
-            })
-    
-    # Получаем категории для отображения
-    categories = Categories.objects.all()[:10]
-    
-    context = {
-        'slider_images': slider_images,
-        'categories': categories
-    }
-    return render(request, 'home.html', context)
+    """
+    Главная: блоки слайдера и категорий из кэша (main/home.py); анонимным
+    посетителям отдаётся готовый HTML без обращения к БД и шаблонам.
+    """
+    anonymous = request.method == 'GET' and not request.user.is_authenticated and 'access_token' not in request.COOKIES
+    if anonymous:
+        content = get_cached_page()
+        if content is not None:
+            return HttpResponse(content)
+
+    response = render(request, 'home.html', get_home_blocks())
+    if anonymous:
+        store_page(response.content)
+    return response
 
 def catalog(request):
     return render(request, 'catalog.html')  # Заглушка
@@ -283,6 +248,20 @@ def admin_panel(request):
     })
 
 
+# Статистика кэша страниц текущего процесса - только для admin
+@require_role('admin')
+def admin_page_cache_stats(request):
+    from main.page_cache import stats
+    return JsonResponse(stats())
+
+
+# Задержки, ошибки и состояние CircuitBreaker платёжного шлюза текущего процесса - только для admin
+@require_role('admin')
+def admin_payment_gateway_stats(request):
+    from apps.orders.gateway import stats
+    return JsonResponse(stats())
+
+
 # Управление пользователями - только для admin
 @require_role('admin')
 def admin_users(request):
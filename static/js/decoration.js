@@ -219,6 +219,24 @@ function restoreOrderData() {
     }
 }
 
+// ===== CART PRODUCTS =====
+// Только товары корзины: /api/products/batch/ вместо загрузки всего каталога
+function fetchCartProducts(cart, headers) {
+    const ids = [...new Set(cart.map(item => parseInt(item.product_id)).filter(id => id > 0))];
+    if (ids.length === 0) return Promise.resolve([]);
+    const request = ids.length > 100
+        ? fetch('/api/products/batch/', {
+            method: 'POST',
+            headers: { ...headers, 'Content-Type': 'application/json' },
+            body: JSON.stringify({ ids })
+        })
+        : fetch(`/api/products/batch/?ids=${ids.join(',')}`, { headers });
+    return request.then(response => {
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        return response.json();
+    });
+}
+
 // ===== LOAD CART ITEMS TO SUMMARY =====
 function loadCartItemsToSummary() {
     const cart = JSON.parse(localStorage.getItem(getCartKey()) || '[]');
@@ -231,8 +249,7 @@ function loadCartItemsToSummary() {
         return;
     }
 
-    fetch('/api/products/', { headers })
-        .then(response => response.json())
+    fetchCartProducts(cart, headers)
         .then(products => {
             const cartItems = cart.map(cartItem => {
                 const product = products.find(p => parseInt(p.product_id) === parseInt(cartItem.product_id));
@@ -258,8 +275,7 @@ function renderSummaryItems(cartItems) {
     const summaryItemsContainer = document.getElementById('summary-items');
     
     summaryItemsContainer.innerHTML = cartItems.map(item => {
-        const validImages = getValidImages(item.images);
-        const imageUrl = validImages[0] || '/static/images/no-image.png';
+        const imageUrl = item.image || '/static/images/no-image.png';
 
         return `
             <div class="summary-item">
@@ -280,8 +296,7 @@ function updateOrderSummary() {
     const token = localStorage.getItem('access_token');
     const headers = token ? { 'Authorization': `Bearer ${token}` } : {};
 
-    fetch('/api/products/', { headers })
-        .then(response => response.json())
+    fetchCartProducts(cart, headers)
         .then(products => {
             let subtotal = 0;
             let totalItems = 0;
@@ -308,49 +323,18 @@ function updateOrderSummary() {
 }
 
 // ===== HELPER FUNCTIONS =====
-function getValidImages(images) {
-    if (!images) return [];
-    
-    const result = [];
-    const seen = new Set();
-    
-    const addImage = (img) => {
-        if (typeof img === 'string' && !img.startsWith('blob:') && img.trim() && !seen.has(img.trim())) {
-            if (img.trim().startsWith('[')) {
-                try {
-                    const parsed = JSON.parse(img.trim());
-                    if (Array.isArray(parsed)) {
-                        parsed.forEach(p => {
-                            if (p && typeof p === 'string' && !p.startsWith('blob:') && !seen.has(p.trim())) {
-                                seen.add(p.trim());
-                                result.push(p.trim());
-                            }
-                        });
-                    }
-                } catch (e) {
-                    seen.add(img.trim());
-                    result.push(img.trim());
-                }
-            } else {
-                seen.add(img.trim());
-                result.push(img.trim());
-            }
-        }
-    };
-    
-    if (Array.isArray(images)) {
-        images.forEach(addImage);
-    } else if (typeof images === 'string') {
-        addImage(images);
-    }
-    
-    return result.slice(0, 5);
-}
-
 function formatPrice(price) {
     return new Intl.NumberFormat('ru-RU').format(Math.round(price));
 }
 
+// Ключ идемпотентности: повтор запроса с тем же ключом не создаёт второй заказ/платёж
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+}
+
 // ===== SUBMIT ORDER WITH PAYMENT =====
 async function submitOrder() {
     // Validate final step
@@ -379,6 +363,10 @@ async function submitOrder() {
     button.disabled = true;
     button.textContent = 'Обработка платежа...';
 
+    // Один ключ на попытку оформления; страница успешной оплаты создаёт заказ с ним же
+    const idempotencyKey = newIdempotencyKey();
+    sessionStorage.setItem('order_idempotency_key', idempotencyKey);
+
     try {
         // Get selected payment type
         const paymentType = document.querySelector('input[name="payment_type"]:checked').value;
@@ -406,7 +394,7 @@ async function submitOrder() {
         const token = localStorage.getItem('access_token');
         const headers = token ? { 'Authorization': `Bearer ${token}` } : {};
         
-        const products = await fetch('/api/products/', { headers }).then(r => r.json());
+        const products = await fetchCartProducts(orderData.items, headers);
         
         orderData.items.forEach(cartItem => {
             const product = products.find(p => parseInt(p.product_id) === parseInt(cartItem.product_id));
@@ -428,7 +416,8 @@ async function submitOrder() {
             const orderResponse = await fetch('/api/orders/create/', {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    'Idempotency-Key': idempotencyKey
                 },
                 body: JSON.stringify(orderData)
             });
@@ -455,7 +444,8 @@ async function submitOrder() {
         const paymentResponse = await fetch('/api/payment/create/', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                'Idempotency-Key': idempotencyKey
             },
             body: JSON.stringify(orderData)
         });
@@ -471,6 +461,10 @@ async function submitOrder() {
 
         // Store payment and order data in sessionStorage for later
         sessionStorage.setItem('payment_id', paymentResult.payment_id);
+        // Резерв товаров на время оплаты — create_order спишет остатки по нему
+        if (paymentResult.reservation_key) {
+            orderData.reservation_key = paymentResult.reservation_key;
+        }
         sessionStorage.setItem('order_data', JSON.stringify(orderData));
 
         // Redirect to YooKassa payment page